@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# PyDNSSEC - DNSSEC toolkit
+# Copyright (C) 2013 Tomas Mazak
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of PyDNSSEC hot paths on synthetic zones.
+
+Every benchmark runs in a separate process, so that peak memory usage can be
+measured for each of them. Results are written as JSON and can be compared
+with results of another run (e.g. of another commit):
+
+    python bench.py --sizes 10000,100000 -o new.json
+    python bench.py --sizes 10000,100000 --compare old.json
+"""
+
+import sys
+import os
+import time
+import json
+import random
+import resource
+import platform
+import subprocess
+import multiprocessing
+import optparse
+
+import Crypto.Random
+
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.rdtypes.ANY.NS
+import dns.rdtypes.ANY.SOA
+import dns.rdtypes.IN.A
+import dns.version
+import dns.zone
+
+import dnssec
+
+
+def generate_zone(names, origin='bench.example.', delegations=0.1,
+                  secure=0.3, depth=3, fanout=16, wildcards=0.01,
+                  rrset_size=2, seed=0):
+    """
+    Generate a synthetic unsigned zone with the given number of owner names
+    (not counting the apex, glue and empty non-terminals).
+
+    @param delegations: ratio of names which are zone delegations
+    @param secure: ratio of delegations having DS records
+    @param depth: maximal number of labels below the origin
+    @param fanout: number of distinct labels on each intermediate level (the
+    lower, the more names share empty non-terminals)
+    @param wildcards: ratio of names which are wildcards
+    @param rrset_size: number of records in A RR sets
+    @param seed: random seed, the same arguments give the same zone
+    """
+    rnd = random.Random(seed)
+    origin = dns.name.from_text(origin)
+    zone = dns.zone.Zone(origin, relativize=False)
+    IN = dns.rdataclass.IN
+
+    def name(*labels):
+        return dns.name.Name(labels + origin.labels)
+
+    def address(i, j):
+        return '10.%d.%d.%d' % ((i >> 16) & 0xff, (i >> 8) & 0xff,
+                                (i + j) & 0xff)
+
+    def add(owner, rdtype, rdatas, ttl=3600):
+        rdataset = zone.find_rdataset(owner, rdtype, create=True)
+        for rdata in rdatas:
+            rdataset.add(rdata, ttl)
+
+    ns1, ns2 = name('ns1'), name('ns2')
+    add(origin, dns.rdatatype.SOA, [dns.rdtypes.ANY.SOA.SOA(IN,
+        dns.rdatatype.SOA, ns1, name('hostmaster'), 1, 3600, 900, 1209600,
+        300)])
+    add(origin, dns.rdatatype.NS, [dns.rdtypes.ANY.NS.NS(IN,
+        dns.rdatatype.NS, ns) for ns in (ns1, ns2)])
+    add(ns1, dns.rdatatype.A, [dns.rdtypes.IN.A.A(IN, dns.rdatatype.A,
+                                                  '192.0.2.1')])
+    add(ns2, dns.rdatatype.A, [dns.rdtypes.IN.A.A(IN, dns.rdatatype.A,
+                                                  '192.0.2.2')])
+
+    for i in xrange(names):
+        labels = tuple('d%d' % rnd.randrange(fanout)
+                       for j in xrange(rnd.randrange(depth)))
+        owner = name('n%d' % i, *labels)
+        kind = rnd.random()
+        if kind < delegations:
+            glue = name('ns', 'n%d' % i, *labels)
+            add(owner, dns.rdatatype.NS, [
+                dns.rdtypes.ANY.NS.NS(IN, dns.rdatatype.NS, glue),
+                dns.rdtypes.ANY.NS.NS(IN, dns.rdatatype.NS, ns1)])
+            add(glue, dns.rdatatype.A, [dns.rdtypes.IN.A.A(IN,
+                dns.rdatatype.A, address(i, 0))])
+            if rnd.random() < secure:
+                add(owner, dns.rdatatype.DS, [dns.rdata.from_text(IN,
+                    dns.rdatatype.DS, '%d 8 2 %064x' % (i & 0xffff,
+                                                        rnd.getrandbits(256)))])
+            continue
+        if kind < delegations + wildcards:
+            owner = name('*', 'n%d' % i, *labels)
+        add(owner, dns.rdatatype.A, [dns.rdtypes.IN.A.A(IN, dns.rdatatype.A,
+                                     address(i, j))
+                                     for j in xrange(rrset_size)])
+        if rnd.random() < 0.2:
+            add(owner, dns.rdatatype.TXT, [dns.rdata.from_text(IN,
+                dns.rdatatype.TXT, '"v=spf1 a -all"')])
+    return zone
+
+
+def _rusage():
+    """
+    Get CPU time (user + system) and peak resident size in kB of this process
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+# Benchmarks: functions taking an unsigned zone and options. Each of them
+# prepares its input, then calls the given timer with the measured function
+# and returns number of operations done by it.
+
+def bench_canonical_order(zone, keys, opts, timer):
+    names = [name for name in zone.nodes]
+    timer(lambda: dnssec._canonical_order(names))
+    return len(names)
+
+def bench_add_nsec(zone, keys, opts, timer):
+    index = timer(lambda: dnssec.add_nsec(zone))
+    return len(index)
+
+def bench_add_nsec3(zone, keys, opts, timer):
+    index = timer(lambda: dnssec.add_nsec3(zone, opts.salt, opts.iterations,
+                                           workers=opts.workers))
+    return len(index)
+
+def _count_signatures(zone):
+    return sum(len(rdataset) for node in zone.nodes.itervalues()
+               for rdataset in node
+               if rdataset.rdtype == dns.rdatatype.RRSIG)
+
+def bench_sign_zone_nsec(zone, keys, opts, timer):
+    timer(lambda: dnssec.sign_zone(zone, keys, workers=opts.workers))
+    return _count_signatures(zone)
+
+def bench_sign_zone_nsec3(zone, keys, opts, timer):
+    timer(lambda: dnssec.sign_zone(zone, keys, nsec3=True,
+                                   nsec3salt=opts.salt,
+                                   nsec3iters=opts.iterations,
+                                   workers=opts.workers))
+    return _count_signatures(zone)
+
+def bench_unsign_zone(zone, keys, opts, timer):
+    dnssec.sign_zone(zone, keys, workers=opts.workers)
+    count = len(zone.nodes)
+    timer(lambda: dnssec.unsign_zone(zone))
+    return count
+
+def bench_validate(zone, keys, opts, timer):
+    dnssec.sign_zone(zone, keys, workers=opts.workers)
+    store = dnssec.KeyStore({zone.origin: [k.get_pubkey() for k in keys]})
+    rrsets = []
+    for name, node in zone.nodes.iteritems():
+        for rdataset in node:
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                continue
+            rrsigs = node.get_rdataset(zone.rdclass, dns.rdatatype.RRSIG,
+                                       rdataset.rdtype)
+            if rrsigs is not None:
+                rrsets.append(((name, rdataset), (name, rrsigs)))
+        if len(rrsets) >= opts.validate_limit:
+            break
+    def validate():
+        for rrset, rrsigset in rrsets:
+            dnssec.validate(rrset, rrsigset, store, zone.origin)
+    timer(validate)
+    return len(rrsets)
+
+def bench_verify_zone(zone, keys, opts, timer):
+    dnssec.sign_zone(zone, keys, workers=opts.workers)
+    report = timer(lambda: dnssec.verify_zone(zone, workers=opts.workers))
+    if not report.valid():
+        raise RuntimeError(report.to_text())
+    return report.signatures
+
+BENCHMARKS = [
+    ('canonical_order', bench_canonical_order),
+    ('add_nsec', bench_add_nsec),
+    ('add_nsec3', bench_add_nsec3),
+    ('sign_zone_nsec', bench_sign_zone_nsec),
+    ('sign_zone_nsec3', bench_sign_zone_nsec3),
+    ('unsign_zone', bench_unsign_zone),
+    ('validate', bench_validate),
+    ('verify_zone', bench_verify_zone),
+    ]
+
+
+def _run(name, function, size, keys, opts, queue):
+    """
+    Run single benchmark (in a child process) and put the result to the queue
+    """
+    try:
+        Crypto.Random.atfork()
+        zone = generate_zone(size, delegations=opts.delegations,
+                             secure=opts.secure, depth=opts.depth,
+                             wildcards=opts.wildcards,
+                             rrset_size=opts.rrset_size, seed=opts.seed)
+        measured = {}
+        def timer(f):
+            cpu, rss = _rusage()
+            wall = time.time()
+            ret = f()
+            measured['wall'] = time.time() - wall
+            measured['cpu'] = _rusage()[0] - cpu
+            measured['rss_before'] = rss
+            return ret
+        ops = function(zone, keys, opts, timer)
+        peak = _rusage()[1]
+        queue.put(dict(benchmark=name, names=size, ops=ops,
+                       wall=measured['wall'], cpu=measured['cpu'],
+                       ops_per_sec=ops / max(measured['wall'], 1e-9),
+                       peak_rss_kb=peak,
+                       peak_rss_delta_kb=peak - measured['rss_before']))
+    except Exception, e:
+        queue.put(dict(benchmark=name, names=size, error=repr(e)))
+
+
+def run(sizes, names, keys, opts):
+    """
+    Run the given benchmarks for all zone sizes. Return list of results.
+    """
+    results = []
+    for size in sizes:
+        for name, function in BENCHMARKS:
+            if names and name not in names:
+                continue
+            best = None
+            for i in xrange(opts.repeat):
+                queue = multiprocessing.Queue()
+                process = multiprocessing.Process(target=_run,
+                            args=(name, function, size, keys, opts, queue))
+                process.start()
+                result = queue.get()
+                process.join()
+                if 'error' in result or best is None or \
+                   result['wall'] < best['wall']:
+                    best = result
+                if 'error' in result:
+                    break
+            best['repeat'] = opts.repeat
+            results.append(best)
+            if opts.verbose:
+                sys.stderr.write(_format(best) + '\n')
+    return results
+
+
+def _format(result):
+    if 'error' in result:
+        return '%(benchmark)-16s %(names)8d  ERROR %(error)s' % result
+    return '%(benchmark)-16s %(names)8d %(wall)9.3fs %(cpu)9.3fs ' \
+           '%(ops_per_sec)11.1f/s %(peak_rss_kb)9dkB' % result
+
+
+def _metadata(opts):
+    try:
+        commit = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+                    stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'),
+                    cwd=os.path.dirname(os.path.abspath(__file__))
+                    ).communicate()[0].strip() or None
+    except OSError:
+        commit = None
+    return dict(commit=commit, time=int(time.time()),
+                python=platform.python_version(),
+                dnspython=dns.version.version, backend=dnssec.get_backend(),
+                algorithm=dnssec.algorithm_to_text(opts.algorithm),
+                bits=opts.bits, workers=opts.workers,
+                delegations=opts.delegations, secure=opts.secure,
+                depth=opts.depth, wildcards=opts.wildcards,
+                rrset_size=opts.rrset_size, seed=opts.seed,
+                iterations=opts.iterations)
+
+
+def compare(old, new):
+    """
+    Print relative change of wall time and peak memory of results present in
+    both old and new results
+    """
+    previous = dict(((r['benchmark'], r['names']), r)
+                    for r in old['results'] if 'error' not in r)
+    print '%-16s %8s %10s %10s %8s %10s' % ('benchmark', 'names', 'old',
+                                            'new', 'time', 'memory')
+    for r in new['results']:
+        o = previous.get((r['benchmark'], r['names']))
+        if o is None or 'error' in r:
+            continue
+        print '%-16s %8d %9.3fs %9.3fs %+7.1f%% %+9.1f%%' % (
+            r['benchmark'], r['names'], o['wall'], r['wall'],
+            100.0 * (r['wall'] - o['wall']) / max(o['wall'], 1e-9),
+            100.0 * (r['peak_rss_kb'] - o['peak_rss_kb']) /
+            max(o['peak_rss_kb'], 1))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] [benchmark ...]',
+                                   description='Benchmarks: ' +
+                                   ', '.join(name for name, f in BENCHMARKS))
+    parser.add_option('--sizes', default='10000',
+                      help='comma separated zone sizes in names [%default]')
+    parser.add_option('--delegations', type='float', default=0.1,
+                      help='ratio of delegations [%default]')
+    parser.add_option('--secure', type='float', default=0.3,
+                      help='ratio of delegations with DS [%default]')
+    parser.add_option('--depth', type='int', default=3,
+                      help='maximal depth of names [%default]')
+    parser.add_option('--wildcards', type='float', default=0.01,
+                      help='ratio of wildcards [%default]')
+    parser.add_option('--rrset-size', type='int', default=2,
+                      help='number of records in A RR sets [%default]')
+    parser.add_option('--seed', type='int', default=0,
+                      help='zone generator seed [%default]')
+    parser.add_option('--algorithm', default='RSASHA256',
+                      help='DNSKEY algorithm [%default]')
+    parser.add_option('--bits', type='int', default=1024,
+                      help='RSA key size [%default]')
+    parser.add_option('--backend', default=None,
+                      help='cryptographic backend (%s)' %
+                           ', '.join(dnssec.backends()))
+    parser.add_option('--workers', type='int', default=None,
+                      help='number of worker processes')
+    parser.add_option('--iterations', type='int', default=10,
+                      help='NSEC3 iterations [%default]')
+    parser.add_option('--validate-limit', type='int', default=10000,
+                      help='maximal number of RR sets validated [%default]')
+    parser.add_option('--repeat', type='int', default=1,
+                      help='repeat each benchmark, the best run is reported '
+                           '[%default]')
+    parser.add_option('-o', '--output', default=None,
+                      help='write JSON results to the file (default stdout)')
+    parser.add_option('--compare', default=None, metavar='FILE',
+                      help='compare results with the given JSON results')
+    parser.add_option('-q', '--quiet', dest='verbose', action='store_false',
+                      default=True, help="don't print progress to stderr")
+    opts, args = parser.parse_args()
+
+    unknown = set(args) - set(name for name, f in BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmark: %s' % ', '.join(sorted(unknown)))
+    if opts.backend:
+        dnssec.set_backend(opts.backend)
+    opts.algorithm = dnssec.algorithm_from_text(opts.algorithm)
+    opts.salt = '\x05\xd6\x7b\xb3\xfe\x7b\xf9\x07'
+
+    keys = [dnssec.PrivateDNSKEY.generate(dnssec.DNSKEY_FLAG_ZONEKEY | flag,
+                                          opts.algorithm, opts.bits)
+            for flag in (dnssec.DNSKEY_FLAG_SEP, 0)]
+    sizes = [int(size) for size in opts.sizes.split(',')]
+    results = dict(meta=_metadata(opts), results=run(sizes, args, keys, opts))
+
+    if opts.output:
+        fd = open(opts.output, 'w')
+        json.dump(results, fd, indent=1, sort_keys=True)
+        fd.close()
+    elif not opts.compare:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print
+    if opts.compare:
+        compare(json.load(open(opts.compare)), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,11 +19,28 @@
 
 import cStringIO
 import os
+import re
+import sys
 import math
 import struct
 import time
+import errno
+import stat
 import base64
-
+import hashlib
+import cPickle
+import bisect
+import collections
+import heapq
+import itertools
+import contextlib
+import threading
+import tempfile
+import socket
+import SocketServer
+import multiprocessing
+
+import Crypto.Random
 import Crypto.PublicKey.RSA
 import Crypto.PublicKey.DSA
 import Crypto.Util.number
@@ -34,6 +51,7 @@ import Crypto.Hash.SHA512
 import Crypto.Signature.PKCS1_v1_5
 
 import dns.exception
+import dns.grange
 import dns.hash
 import dns.name
 import dns.node
@@ -41,6 +59,10 @@ import dns.rdataset
 import dns.rdata
 import dns.rdatatype
 import dns.rdataclass
+import dns.rrset
+import dns.tokenizer
+import dns.ttl
+import dns.zone
 import dns.rdtypes.ANY.DNSKEY
 import dns.rdtypes.ANY.DS
 import dns.rdtypes.ANY.RRSIG
@@ -48,6 +70,30 @@ import dns.rdtypes.ANY.NSEC
 import dns.rdtypes.ANY.NSEC3
 import dns.rdtypes.ANY.NSEC3PARAM
 
+# ECDSA, EdDSA and OpenSSL backend require the cryptography package, it's
+# optional otherwise
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import dsa, ec, padding, rsa
+    from cryptography.hazmat.primitives.asymmetric import utils as ec_utils
+    _have_cryptography = True
+except ImportError:
+    _have_cryptography = False
+
+# Peak memory usage is reported only where the resource module is available
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from cryptography.hazmat.primitives.asymmetric import ed25519, ed448
+    _have_eddsa = True
+except ImportError:
+    _have_eddsa = False
+
 
 class UnsupportedAlgorithm(dns.exception.DNSException):
     """Raised if an algorithm is not supported."""
@@ -61,6 +107,14 @@ class NSEC3Collision(dns.exception.DNSException):
     """Collision was detected in hashed owner names."""
     pass
 
+class JobCancelled(dns.exception.DNSException):
+    """The background job was cancelled."""
+    pass
+
+class SignerError(dns.exception.DNSException):
+    """The remote signer failed or replied with an error."""
+    pass
+
 # DNSSEC algorithm numbers, according to IANA authority
 # http://www.iana.org/assignments/dns-sec-alg-numbers/dns-sec-alg-numbers.xml
 RSAMD5 = 1 # deprecated
@@ -74,6 +128,8 @@ RSASHA512 = 10
 ECCGOST = 12
 ECDSAP256SHA256 = 13
 ECDSAP384SHA384 = 14
+ED25519 = 15
+ED448 = 16
 INDIRECT = 252
 PRIVATEDNS = 253
 PRIVATEOID = 254
@@ -102,6 +158,8 @@ _algorithm_by_text = {
     'ECCGOST' : ECCGOST,
     'ECDSAP256SHA256' : ECDSAP256SHA256,
     'ECDSAP384SHA384' : ECDSAP384SHA384,
+    'ED25519' : ED25519,
+    'ED448' : ED448,
     'INDIRECT' : INDIRECT,
     'PRIVATEDNS' : PRIVATEDNS,
     'PRIVATEOID' : PRIVATEOID,
@@ -138,11 +196,9 @@ def _to_rdata(record, origin):
 
 def key_id(key, origin=None):
     rdata = _to_rdata(key, origin)
-    total = 0
-    for i in range(len(rdata) // 2):
-        total += (ord(rdata[2 * i]) << 8) + ord(rdata[2 * i + 1])
     if len(rdata) % 2 != 0:
-        total += ord(rdata[len(rdata) - 1]) << 8
+        rdata += '\x00'
+    total = sum(struct.unpack('!%dH' % (len(rdata) // 2), rdata))
     total += ((total >> 16) & 0xffff);
     return total & 0xffff
 
@@ -166,23 +222,30 @@ def make_ds(name, key, algorithm, origin=None):
     return dns.rdata.from_wire(dns.rdataclass.IN, dns.rdatatype.DS, dsrdata, 0,
                                len(dsrdata))
 
+def _dnskey_rdataset(value):
+    """
+    Get DNSKEY rdataset from the given node, rdataset or None
+    """
+    if isinstance(value, dns.node.Node):
+        return value.get_rdataset(dns.rdataclass.IN, dns.rdatatype.DNSKEY)
+    return value
+
 def _find_candidate_keys(keys, rrsig):
+    """
+    Get verifiers of the keys which may have made the given signature. Keys
+    are either KeyStore or a dictionary keyed by dns.name.Name with node or
+    rdataset values.
+    """
+    if isinstance(keys, KeyStore):
+        return keys.candidates(rrsig)
     candidate_keys=[]
-    value = keys.get(rrsig.signer)
-    if value is None:
-        return None
-    if isinstance(value, dns.node.Node):
-        try:
-            rdataset = node.find_rdataset(dns.rdataclass.IN,
-                                          dns.rdatatype.DNSKEY)
-        except KeyError:
-            return None
-    else:
-        rdataset = value
+    rdataset = _dnskey_rdataset(keys.get(rrsig.signer))
+    if rdataset is None:
+        return candidate_keys
     for rdata in rdataset:
         if rdata.algorithm == rrsig.algorithm and \
                key_id(rdata) == rrsig.key_tag:
-            candidate_keys.append(rdata)
+            candidate_keys.append(_verifier(rdata))
     return candidate_keys
 
 def _is_rsa(algorithm):
@@ -191,12 +254,65 @@ def _is_rsa(algorithm):
 def _is_dsa(algorithm):
     return algorithm in (DSA, DSANSEC3SHA1)
 
+def _is_ecdsa(algorithm):
+    return algorithm in (ECDSAP256SHA256, ECDSAP384SHA384)
+
+def _is_eddsa(algorithm):
+    return algorithm in (ED25519, ED448)
+
+def _is_supported(algorithm):
+    """
+    Test if signatures of the given algorithm can be validated
+    """
+    return _backend_for(algorithm) is not None
+
+def _ecdsa_params(algorithm):
+    """
+    Get curve, hash and size of a coordinate in octets for ECDSA algorithm
+    (see RFC-6605)
+    """
+    if not _have_cryptography:
+        raise UnsupportedAlgorithm, 'ECDSA requires the cryptography package'
+    if algorithm == ECDSAP256SHA256:
+        return ec.SECP256R1(), hashes.SHA256(), 32
+    return ec.SECP384R1(), hashes.SHA384(), 48
+
+def _eddsa_params(algorithm):
+    """
+    Get private key class, public key class and key size in octets for EdDSA
+    algorithm (see RFC-8080)
+    """
+    if not _have_eddsa:
+        raise UnsupportedAlgorithm, 'EdDSA requires the cryptography package'
+    if algorithm == ED25519:
+        return ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey, 32
+    return ed448.Ed448PrivateKey, ed448.Ed448PublicKey, 57
+
+class _Accumulator(object):
+    """
+    Hash-like object keeping the whole message. EdDSA signs the message
+    itself rather than its digest (RFC-8080), so the message is passed
+    through hashing code paths unchanged.
+    """
+    def __init__(self, data=''):
+        self._data = [data]
+
+    @classmethod
+    def new(cls, data=''):
+        return cls(data)
+
+    def update(self, data):
+        self._data.append(data)
+
+    def digest(self):
+        return ''.join(self._data)
+
 def _is_sha1(algorithm):
     return algorithm in (DSA, RSASHA1,
                          DSANSEC3SHA1, RSASHA1NSEC3SHA1)
 
 def _is_sha256(algorithm):
-    return algorithm == RSASHA256
+    return algorithm in (RSASHA256, ECDSAP256SHA256)
 
 def _is_sha384(algorithm):
     return algorithm == ECDSAP384SHA384
@@ -204,17 +320,29 @@ def _is_sha384(algorithm):
 def _is_sha512(algorithm):
     return algorithm == RSASHA512
 
-def _make_hash(algorithm):
+def _hash_name(algorithm):
     if _is_sha1(algorithm):
-        return Crypto.Hash.SHA.new()
+        return 'sha1'
     if _is_sha256(algorithm):
-        return Crypto.Hash.SHA256.new()
+        return 'sha256'
     if _is_sha384(algorithm):
-        return Crypto.Hash.SHA384.new()
+        return 'sha384'
     if _is_sha512(algorithm):
-        return Crypto.Hash.SHA512.new()
+        return 'sha512'
     raise ValidationFailure, 'unknown hash for algorithm %u' % algorithm
 
+def _hash_module(algorithm):
+    """
+    Get hash module-like object (with new() function and digest_size) of the
+    selected backend for the given algorithm
+    """
+    if _is_eddsa(algorithm):
+        return _Accumulator
+    return _backend.hash(_hash_name(algorithm))
+
+def _make_hash(algorithm):
+    return _hash_module(algorithm).new()
+
 def _make_algorithm_id(algorithm):
     if _is_sha1(algorithm):
         oid = [0x2b, 0x0e, 0x03, 0x02, 0x1a]
@@ -243,61 +371,240 @@ def _get_minimum_ttl(zone):
         raise dns.zone.NoSOA
 
 
-def _is_delegation(rrname, rdataset, zone):
+def _is_nsec3_node(node):
     """
-    Test if the given rrset is a subzone delegation
+    Test if the given node holds NSEC3 records (and their signatures) only,
+    i.e. it's a hashed owner name of NSEC3 chain rather than a zone name.
     """
-    if rdataset.rdtype == dns.rdatatype.NS and \
-       rrname.derelativize(zone.origin) != zone.origin:
-        return True
-    else:
-        return False
+    return node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.NSEC3) \
+           is not None and all(r.rdtype == dns.rdatatype.NSEC3 or
+                               r.covers == dns.rdatatype.NSEC3 for r in node)
+
+
+# Status of names in _ZoneView
+_AUTHORITATIVE = 0
+_DELEGATION = 1
+_GLUE = 2
+
+# Authoritative types at delegation points
+_DELEGATION_TYPES = (dns.rdatatype.DS, dns.rdatatype.NSEC, dns.rdatatype.NSEC3)
 
 
-def _get_delegations(zone):
+class _ZoneView(object):
     """
-    Get all zone delegation rrsets
+    Zone annotated in a single pass over its nodes. For every name, the
+    node and status is kept: whether it contains authoritative data, it's a
+    delegation point or it contains glue records only. Empty non-terminals
+    are collected as well.
+
+    If lazy is set, names are classified on demand, as they are looked up,
+    in O(depth). That is suitable for processing a few names of a large
+    zone, however nodes and empty_non_terminals are left empty then.
+
+    NSEC and NSEC3 type bitmaps are memoized by name status and set of types
+    present at the name, as most of the names share only a few of them.
     """
-    return [x[0].derelativize(zone.origin) 
-            for x in zone.iterate_rdatasets(dns.rdatatype.NS)
-            if _is_delegation(x[0], x[1], zone)]
+    def __init__(self, zone, lazy=False):
+        self.zone = zone
+        self.nodes = {}
+        self.empty_non_terminals = []
+        self._lazy = lazy
+        self._bitmaps = {}
+
+        # Memo of names at or below a zone cut, shared by all the names, so
+        # that each ancestor is looked at only once. Names are keyed by
+        # lowercase labels relative to origin, which hash much faster.
+        self._suffix = tuple([label.lower() for label in zone.origin.labels])
+        self._cuts = {(): False}
+        if lazy:
+            return
+        for name, node in zone.nodes.iteritems():
+            labels = self._relative(name)
+            if labels is None or _is_nsec3_node(node):
+                continue
+            self.nodes[name.derelativize(zone.origin)] = \
+                (node, self._status(labels, node))
+
+    def _relative(self, name):
+        """
+        Get labels of the given name relative to origin, None if the name is
+        outside of the zone
+        """
+        labels = name.labels
+        if not name.is_absolute():
+            return labels
+        if tuple([label.lower() for label in
+                  labels[len(labels) - len(self._suffix):]]) != self._suffix:
+            return None
+        return labels[:len(labels) - len(self._suffix)]
+
+    def _status(self, labels, node):
+        if not labels:
+            return _AUTHORITATIVE
+        if self._below(tuple([label.lower() for label in labels[1:]]),
+                       labels[1:]):
+            return _GLUE
+        if node is not None and \
+           node.get_rdataset(self.zone.rdclass, dns.rdatatype.NS) is not None:
+            return _DELEGATION
+        return _AUTHORITATIVE
+
+    def _below(self, key, labels):
+        """
+        Test if the name of the given labels is at or below a zone cut.
+        Ancestors not seen yet are added to the memo; those without a node
+        outside delegations are empty non-terminals.
+        """
+        below = self._cuts
+        i = 0
+        while key[i:] not in below:
+            i += 1
+        cut = below[key[i:]]
+        for i in xrange(i - 1, -1, -1):
+            name = dns.name.Name(labels[i:] + self.zone.origin.labels)
+            node = self.zone.get_node(name)
+            if node is None:
+                if not cut and not self._lazy:
+                    self.empty_non_terminals.append(name)
+            elif not cut:
+                cut = node.get_rdataset(self.zone.rdclass,
+                                        dns.rdatatype.NS) is not None
+            below[key[i:]] = cut
+        return cut
+
+    def status(self, name):
+        """
+        Get status of the given name (which may not exist): _AUTHORITATIVE,
+        _DELEGATION or _GLUE. Return None for names outside of the zone.
+        """
+        name = name.derelativize(self.zone.origin)
+        if name in self.nodes:
+            return self.nodes[name][1]
+        labels = self._relative(name)
+        if labels is None:
+            return None
+        return self._status(labels, self.zone.get_node(name))
+
+    def is_authoritative(self, name, rdtype):
+        """
+        Test if records of the given name and type are authoritative
+        """
+        status = self.status(name)
+        return status == _AUTHORITATIVE or \
+               (status == _DELEGATION and rdtype in _DELEGATION_TYPES)
+
+    def is_delegation(self, name):
+        """
+        Test if the given name is a delegation point (which itself isn't
+        below another zone cut)
+        """
+        return self.status(name) == _DELEGATION
+
+    def is_occluded(self, name):
+        """
+        Test if the given name is below a zone cut
+        """
+        return self.status(name) == _GLUE
+
+    def members(self):
+        """
+        Get names which belong to NSEC chain: names containing authoritative
+        data and delegation points.
+        """
+        return [name for name, (node, status) in self.nodes.iteritems()
+                if status != _GLUE]
+
+    def nsec3_members(self, optout=False):
+        """
+        Get names which belong to NSEC3 chain: names of NSEC chain and empty
+        non-terminals. With opt-out (RFC-5155, section 6), insecure
+        delegations (without DS records) and empty non-terminals having only
+        insecure delegations below them are left out.
+        """
+        if not optout:
+            return self.members() + self.empty_non_terminals
+        members = []
+        above = set()
+        for name, (node, status) in self.nodes.iteritems():
+            if status == _GLUE:
+                continue
+            if status == _DELEGATION and \
+               node.get_rdataset(self.zone.rdclass, dns.rdatatype.DS) is None:
+                continue
+            members.append(name)
+            while name != self.zone.origin and name not in above:
+                above.add(name)
+                name = name.parent()
+        members.extend(name for name in self.empty_non_terminals
+                       if name in above)
+        return members
+
+    def _bitmap(self, key, rdtypes):
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            bitmap = self._bitmaps[key] = _rdtypes_to_bitmaps(list(rdtypes))
+        return bitmap
+
+    def nsec_bitmap(self, name):
+        """
+        Get type bitmap of NSEC record of the given name
+        """
+        node, status = self.nodes[name]
+        present = frozenset([r.rdtype for r in node])
+        key = (dns.rdatatype.NSEC, status, present)
+        if key in self._bitmaps:
+            return self._bitmaps[key]
+        return self._bitmap(key, _nsec_types(status, present))
+
+    def nsec3_bitmap(self, name):
+        """
+        Get type bitmap of NSEC3 record of the given name (which may be an
+        empty non-terminal)
+        """
+        if name not in self.nodes:
+            return []
+        node, status = self.nodes[name]
+        present = frozenset([r.rdtype for r in node])
+        key = (dns.rdatatype.NSEC3, status, present)
+        if key in self._bitmaps:
+            return self._bitmaps[key]
+        return self._bitmap(key, _nsec3_types(status, present))
 
 
-def _is_authoritative(rrname, rdataset, zone, delegations = None):
+def _nsec_types(status, present):
     """
-    Checks if a given resource records is authoritative in the zone
+    Get set of types in NSEC record of a name of the given status with the
+    given types present
     """
-    if not delegations:
-        delegations = _get_delegations(zone)
-    rrname = rrname.derelativize(zone.origin)
+    rdtypes = set([dns.rdatatype.RRSIG, dns.rdatatype.NSEC])
+    for rdtype in present:
+        if status == _AUTHORITATIVE or rdtype in _DELEGATION_TYPES or \
+           (status == _DELEGATION and rdtype == dns.rdatatype.NS):
+            rdtypes.add(rdtype)
+    return rdtypes
 
-    if not rrname.is_subdomain(zone.origin):
-        return False
 
-    deleg_dnssec = (dns.rdatatype.DS, dns.rdatatype.NSEC, dns.rdatatype.NSEC3)
-    for delegation in delegations:
-        if (rrname==delegation and rdataset.rdtype not in deleg_dnssec) or \
-           (rrname.is_subdomain(delegation) and rrname != delegation):
-            return False
-    
-    return True
+def _nsec3_types(status, present):
+    """
+    Get set of types in NSEC3 record of a name of the given status with the
+    given types present
+    """
+    rdtypes = set()
+    for rdtype in present:
+        if status == _AUTHORITATIVE or rdtype in _DELEGATION_TYPES:
+            rdtypes.add(rdtype)
+            rdtypes.add(dns.rdatatype.RRSIG)
+        elif status == _DELEGATION and rdtype == dns.rdatatype.NS:
+            rdtypes.add(rdtype)
+    return rdtypes
 
 
-def _get_authoritative(zone):
+def _canonical_key(name):
     """
-    Get all owner names from the zone which contain any authoritative data.
+    Get sort key of the given name according to canonical order defined in
+    RFC-4034, section 6.1: tuple of lowercase labels in reversed order
     """
-    delegs = _get_delegations(zone)
-    names = []
-    for name in zone.nodes:
-        auth = False
-        for rdataset in zone.get_node(name):
-            if _is_authoritative(name, rdataset, zone, delegs):
-                auth = True
-                break
-        if auth:
-            names.append(name)
-    return names
+    return tuple([label.lower() for label in reversed(name.labels)])
 
 
 def _canonical_order(names, origin = None):
@@ -305,52 +612,367 @@ def _canonical_order(names, origin = None):
     Sort the given names according to canonical order defined in RFC-4034,
     section 6.1
     """
-    def labelCmp(n1, n2):
-        for i in range(min(len(n1), len(n2))):
-            i1 = len(n1) - i - 1
-            i2 = len(n2) - i - 1
-            if cmp(n1.labels[i1].lower(), n2.labels[i2].lower()) != 0:
-                return cmp(n1.labels[i1].lower(), n2.labels[i2].lower())
-        return cmp(len(n1), len(n2))
-    
     if origin:
         names = [n.derelativize(origin) for n in names]
-    return sorted(names, cmp=labelCmp)
+    return sorted(names, key=_canonical_key)
+
+
+class NameIndex(object):
+    """
+    Sorted list of unique names supporting fast lookups of predecessors and
+    successors. By default, the names are kept in canonical order (RFC-4034,
+    section 6.1), which is the order of NSEC chain. The order of NSEC3 chain
+    can be achieved using key=_nsec3_owner_hash on NSEC3 owner names.
+
+    Sort key of every name is computed only once, when it is added to the
+    index.
+    """
+    def __init__(self, names=(), key=_canonical_key):
+        self._key = key
+        items = sorted((key(name), name) for name in names)
+        self._keys = []
+        self._names = []
+        for k, name in items:
+            if not self._keys or self._keys[-1] != k:
+                self._keys.append(k)
+                self._names.append(name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __getitem__(self, i):
+        return self._names[i]
+
+    def __contains__(self, name):
+        k = self._key(name)
+        i = bisect.bisect_left(self._keys, k)
+        return i < len(self._keys) and self._keys[i] == k
+
+    def add(self, name):
+        """
+        Add the given name to the index, if it isn't present yet.
+        """
+        k = self._key(name)
+        i = bisect.bisect_left(self._keys, k)
+        if i < len(self._keys) and self._keys[i] == k:
+            return
+        self._keys.insert(i, k)
+        self._names.insert(i, name)
+
+    def remove(self, name):
+        """
+        Remove the given name from the index. Raise KeyError if it isn't
+        present.
+        """
+        k = self._key(name)
+        i = bisect.bisect_left(self._keys, k)
+        if i == len(self._keys) or self._keys[i] != k:
+            raise KeyError(name)
+        del self._keys[i]
+        del self._names[i]
+
+    def predecessor(self, name):
+        """
+        Get the greatest indexed name lower than the given one. The given name
+        doesn't have to be present in the index. The index is circular, as
+        NSEC/NSEC3 chain is: the last name precedes the first one.
+        """
+        i = bisect.bisect_left(self._keys, self._key(name))
+        return self._names[i - 1]
+
+    def successor(self, name):
+        """
+        Get the lowest indexed name greater than the given one. The given name
+        doesn't have to be present in the index. The index is circular, as
+        NSEC/NSEC3 chain is: the first name follows the last one.
+        """
+        i = bisect.bisect_right(self._keys, self._key(name))
+        return self._names[i % len(self._names)]
+
+    def covering(self, name):
+        """
+        Get indexed name matching or covering (i.e. preceding, see RFC-4034
+        section 6.1) the given name. Applied on index of NSEC chain owners,
+        it gives owner of the NSEC record proving the name doesn't exist.
+        """
+        i = bisect.bisect_right(self._keys, self._key(name))
+        return self._names[i - 1]
+
+    def descendants(self, name):
+        """
+        Iterate indexed names below the given name. Only available in
+        canonical order, where the descendants follow the name immediately.
+        """
+        k = self._key(name)
+        i = bisect.bisect_right(self._keys, k)
+        while i < len(self._keys) and self._keys[i][:len(k)] == k:
+            yield self._names[i]
+            i += 1
+
+
+def _nsec3_hash(name, origin=None, salt='', iterations=0):
+    """
+    Compute NSEC3 hash of the given name (see RFC-5155, section 5)
+    """
+    return _nsec3_hash_wire(name.to_digestable(origin), salt, iterations)
+
+
+def _nsec3_hash_wire(h, salt, iterations):
+    """
+    Compute NSEC3 hash of the given name in canonical wire format
+    """
+    sha1 = hashlib.sha1
+    for i in xrange(iterations + 1):
+        h = sha1(h + salt).digest()
+    return h
+
+
+def _nsec3_hash_worker(task):
+    """
+    Hash a batch of names in canonical wire format in a worker process. Task
+    is a (names, salt, iterations) tuple.
+    """
+    names, salt, iterations = task
+    return [_nsec3_hash_wire(name, salt, iterations) for name in names]
+
+
+def _write_records(filename, magic, records):
+    """
+    Atomically replace the given file with the given records (tuples of
+    strings). The file starts with magic and each record is stored as the
+    number of fields followed by length-prefixed fields.
+    """
+    directory, basename = os.path.split(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(prefix='.%s.' % basename, suffix='.tmp',
+                                   dir=directory)
+    try:
+        out = os.fdopen(fd, 'wb')
+        try:
+            out.write(magic)
+            for record in records:
+                out.write(struct.pack('!B', len(record)))
+                for field in record:
+                    out.write(struct.pack('!H', len(field)))
+                    out.write(field)
+            out.flush()
+            os.fsync(out.fileno())
+        finally:
+            out.close()
+        os.rename(tmpname, filename)
+    except:
+        exc = sys.exc_info()
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise exc[0], exc[1], exc[2]
+
+
+def _read_records(filename, magic):
+    """
+    Read records written by _write_records. Raise ValueError if the file
+    is not in the expected format.
+    """
+    fd = open(filename, 'rb')
+    try:
+        data = fd.read()
+    finally:
+        fd.close()
+    if not data.startswith(magic):
+        raise ValueError('%s: unknown file format' % filename)
+    reader = _FrameReader(data, len(magic))
+    try:
+        while reader.offset < len(data):
+            count, = reader.unpack('!B')
+            record = []
+            for i in xrange(count):
+                size, = reader.unpack('!H')
+                record.append(reader.read(size))
+            yield tuple(record)
+    except struct.error:
+        raise ValueError('%s: truncated file' % filename)
+
+
+class _FileCache(object):
+    """
+    Base of the caches which can be persisted between runs: if filename is
+    given, the cache is loaded from it (if it exists) and save() writes it
+    back. Subclasses convert entries to and from records of plain strings,
+    so that loading a file never executes anything.
+    """
+    _magic = None
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._entries = {}
+        if filename is not None and os.path.exists(filename):
+            self.load(filename)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _to_record(self, key, value):
+        raise NotImplementedError
+
+    def _from_record(self, record):
+        raise NotImplementedError
+
+    def _prune(self, stale):
+        for key, value in self._entries.items():
+            if stale(key, value):
+                del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def load(self, filename):
+        """
+        Load entries from the given file and merge them with the cached ones.
+        """
+        entries = {}
+        for record in _read_records(filename, self._magic):
+            try:
+                key, value = self._from_record(record)
+            except (ValueError, struct.error):
+                raise ValueError('%s: invalid record' % filename)
+            entries[key] = value
+        self._entries.update(entries)
+
+    def save(self, filename=None):
+        """
+        Write the cache to the given file (default is the file the cache was
+        loaded from). The file is replaced atomically.
+        """
+        if filename is None:
+            filename = self.filename
+        if filename is None:
+            raise ValueError('no file name given')
+        _write_records(filename, self._magic,
+                       (self._to_record(key, value)
+                        for key, value in self._entries.iteritems()))
+
+
+class NSEC3HashCache(_FileCache):
+    """
+    Cache of NSEC3 hashes keyed by name, salt and number of iterations. When
+    a zone is signed again with the same NSEC3 parameters, hashes of the
+    unchanged names are not computed again. prune() drops hashes which were
+    not used since the cache was loaded (or pruned last time), e.g. of names
+    removed from the zone or of an old salt.
+    """
+    _magic = 'PYDNSSEC NSEC3 HASHES 1\n'
+
+    def __init__(self, filename=None):
+        self._used = set()
+        super(NSEC3HashCache, self).__init__(filename)
+
+    def _to_record(self, key, value):
+        salt, iterations, name = key
+        return (salt, struct.pack('!H', iterations), name, value)
+
+    def _from_record(self, record):
+        salt, iterations, name, hashed = record
+        return (salt, struct.unpack('!H', iterations)[0], name), hashed
+
+    def get(self, name, salt, iterations):
+        """
+        Get hash of the given name (in canonical wire format) or None if it
+        isn't cached.
+        """
+        key = (salt, iterations, name)
+        hashed = self._entries.get(key)
+        if hashed is not None:
+            self._used.add(key)
+        return hashed
+
+    def set(self, name, salt, iterations, hashed):
+        """
+        Store hash of the given name (in canonical wire format).
+        """
+        key = (salt, iterations, name)
+        self._entries[key] = hashed
+        self._used.add(key)
+
+    def prune(self):
+        """
+        Remove hashes not used since the last prune
+        """
+        self._prune(lambda key, value: key not in self._used)
+        self._used.clear()
+
+    def clear(self):
+        super(NSEC3HashCache, self).clear()
+        self._used.clear()
+
+
+def _nsec3_owner(hashed, origin):
+    """
+    Get NSEC3 owner name for the given hash. DNSSEC uses base32 encoding
+    with extended hex alphabet (see RFC-5155, section 3.3)
+    """
+    b32hash = base64.b32encode(hashed)
+    b32hash = b32hash.translate(dns.rdtypes.ANY.NSEC3.b32_normal_to_hex)
+    return dns.name.Name((b32hash.lower(),)).derelativize(origin)
+
 
+def _nsec3_owner_hash(owner):
+    """
+    Get hash from the given NSEC3 owner name, see _nsec3_owner
+    """
+    b32hash = owner.labels[0].upper()
+    b32hash = b32hash.translate(dns.rdtypes.ANY.NSEC3.b32_hex_to_normal)
+    return base64.b32decode(b32hash)
 
-def _hashed_order(names, origin=None, salt='', iterations=0):
+
+def _hashed_order(names, origin=None, salt='', iterations=0, workers=None,
+                  cache=None):
     """
     Hash the given names using SHA-1 algorithm, the given salt and the given
     number of iterations. Return list of tuples (name, hash) in hash order.
-    Used for NSEC3 records generation. See RFC-5155 for details.
-    """
+    Used for NSEC3 records generation. See RFC-5155 for details. Empty
+    non-terminals must be included in the given names.
 
-    # Add empty non terminals to the list, see RFC-5155, section 7.1
-    nameset = set(names)
-    for name in names:
-        n = name.relativize(origin)
-        while len(n) > 1:
-            n = n.parent()
-            nameset.add(n.derelativize(origin))
-    names = list(nameset)
+    If workers > 1, names are hashed in batches by a pool of processes.
+    Optional NSEC3HashCache is consulted first and updated afterwards.
+    """
+    names = list(names)
+    wires = [name.to_digestable(origin) for name in names]
+    hashes = [None] * len(names)
+    if cache is not None:
+        for i, wire in enumerate(wires):
+            hashes[i] = cache.get(wire, salt, iterations)
+    missing = [i for i, h in enumerate(hashes) if h is None]
+
+    if workers and workers > 1 and len(missing) > 1:
+        batch = max(1, min(1024, len(missing) // (workers * 4)))
+        tasks = [([wires[i] for i in missing[j:j+batch]], salt, iterations)
+                 for j in xrange(0, len(missing), batch)]
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = itertools.chain.from_iterable(
+                pool.imap(_nsec3_hash_worker, tasks))
+            for i, h in itertools.izip(missing, results):
+                hashes[i] = h
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for i in missing:
+            hashes[i] = _nsec3_hash_wire(wires[i], salt, iterations)
 
-    ret = []
-    for name in names:
-        h = name.to_digestable(origin)
-        i = iterations
-        while i >= 0:
-            sha = Crypto.Hash.SHA.new()
-            sha.update(h)
-            sha.update(salt)
-            h = sha.digest()
-            i -= 1
-        ret.append((name, h))
+    if cache is not None:
+        for i in missing:
+            cache.set(wires[i], salt, iterations, hashes[i])
 
     # Check for hash collision
-    if len(ret) != len(set(ret)):
+    if len(set(hashes)) != len(hashes):
         raise NSEC3Collision()
 
-    ret = sorted(ret, key=lambda x: x[1])
+    ret = sorted(itertools.izip(names, hashes), key=lambda x: x[1])
     return ret
 
 
@@ -387,40 +1009,167 @@ def _rdtypes_to_bitmaps(rdtypes):
     return windows
 
 
-def add_nsec(zone):
+class SigningStats(object):
     """
-    Add appropriate NSEC records to the given zone (see RFC-4034 for details).
+    Instrumentation of zone signing. When passed to sign_zone, add_nsec or
+    add_nsec3, wall clock and CPU time (including finished worker processes)
+    of each phase is measured, and numbers of RR sets signed by each key (by
+    key tag), signatures and NSEC/NSEC3 records created are counted. Total
+    number of signatures to be made is known after the 'collect' phase. Peak
+    memory usage of the process (in kB) is sampled after each phase.
+
+    Optional hook is called with (phase, wall, cpu) when a phase finishes.
     """
-    # Only add NSEC records to owner names containing authoritative data or
-    # zone delegations
-    delegs = _get_delegations(zone)
-    names = list(set(delegs + _get_authoritative(zone)))
-    ordered = _canonical_order(names, zone.origin)
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.phases = []
+        self.rrsets = {}
+        self.signatures = 0
+        self.total = 0
+        self.nsec = 0
+        self.nsec3 = 0
+        self.peak_memory = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager measuring a phase of the given name
+        """
+        wall = time.time()
+        cpu = _cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.time() - wall
+            cpu = _cpu_time() - cpu
+            self.phases.append((name, wall, cpu))
+            self.peak_memory = _peak_memory()
+            if self.hook is not None:
+                self.hook(name, wall, cpu)
+
+    def signed(self, rrsig):
+        """
+        Count a signature made
+        """
+        self.signatures += 1
+        self.rrsets[rrsig.key_tag] = self.rrsets.get(rrsig.key_tag, 0) + 1
 
-    ttl = _get_minimum_ttl(zone)
-    for i, name in enumerate(ordered):
-        # Compute RDATA types covered by this NSEC record
-        rdtypes = [dns.rdatatype.RRSIG, dns.rdatatype.NSEC]
-        node = zone.find_node(name)
-        for rdataset in node:
-            # Only include RDATA types of authoritative records or delegations
-            if _is_authoritative(name, rdataset, zone, delegs) or \
-               _is_delegation(name, rdataset, zone):
-                rdtypes.append(rdataset.rdtype)
-        typemap = _rdtypes_to_bitmaps(rdtypes)
-
-        # Add the NSEC record to the zone
-        rdataset = zone.find_rdataset(name, rdtype=dns.rdatatype.NSEC, 
-                                      create=True)
-        nsec = dns.rdtypes.ANY.NSEC.NSEC(dns.rdataclass.IN, dns.rdatatype.NSEC, 
-                    ordered[(i+1)%len(ordered)], typemap)
-        rdataset.add(nsec, ttl=ttl)
+    def wall(self, phase=None):
+        """
+        Get wall clock time of the given phase or of all the phases
+        """
+        return sum(w for name, w, c in self.phases
+                   if phase is None or name == phase)
+
+    def cpu(self, phase=None):
+        """
+        Get CPU time of the given phase or of all the phases
+        """
+        return sum(c for name, w, c in self.phases
+                   if phase is None or name == phase)
+
+    def signatures_per_second(self):
+        wall = self.wall('sign')
+        if not wall:
+            return 0.0
+        return self.signatures / wall
+
+    def to_dict(self):
+        """
+        Get the statistics as a dictionary of plain types (e.g. to be
+        serialized to JSON)
+        """
+        return dict(phases=[dict(phase=name, wall=wall, cpu=cpu)
+                            for name, wall, cpu in self.phases],
+                    rrsets=dict((str(tag), count)
+                                for tag, count in self.rrsets.iteritems()),
+                    signatures=self.signatures,
+                    signatures_per_second=self.signatures_per_second(),
+                    nsec=self.nsec, nsec3=self.nsec3,
+                    peak_memory=self.peak_memory)
+
+    def to_text(self):
+        lines = ['%-8s %9.3fs wall %9.3fs cpu' % phase
+                 for phase in self.phases]
+        for tag in sorted(self.rrsets):
+            lines.append('key %d: %d RR sets signed' % (tag, self.rrsets[tag]))
+        lines.append('%d signatures (%.1f/s), %d NSEC, %d NSEC3 records' %
+                     (self.signatures, self.signatures_per_second(),
+                      self.nsec, self.nsec3))
+        if self.peak_memory is not None:
+            lines.append('peak memory %d kB' % self.peak_memory)
+        return '\n'.join(lines)
+
+
+def _cpu_time():
+    """
+    Get CPU time used by this process and its finished children
+    """
+    return sum(os.times()[:4])
+
+
+def _peak_memory():
+    """
+    Get peak resident set size of this process in kB or None if unknown
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@contextlib.contextmanager
+def _phase(stats, name):
+    """
+    Measure a phase if stats are collected
+    """
+    if stats is None:
+        yield
+    else:
+        with stats.phase(name):
+            yield
 
 
-def add_nsec3(zone, salt=None, iters=None):
+def add_nsec(zone, view=None, stats=None):
+    """
+    Add appropriate NSEC records to the given zone (see RFC-4034 for details).
+    Return NameIndex of the NSEC chain. Optional SigningStats are updated.
+    """
+    # Only add NSEC records to owner names containing authoritative data or
+    # zone delegations
+    if view is None:
+        with _phase(stats, 'view'):
+            view = _ZoneView(zone)
+
+    with _phase(stats, 'nsec'):
+        index = NameIndex(view.members())
+        ttl = _get_minimum_ttl(zone)
+        for i, name in enumerate(index):
+            typemap = view.nsec_bitmap(name)
+
+            # Add the NSEC record to the zone
+            rdataset = zone.find_rdataset(name, rdtype=dns.rdatatype.NSEC,
+                                          create=True)
+            nsec = dns.rdtypes.ANY.NSEC.NSEC(dns.rdataclass.IN,
+                        dns.rdatatype.NSEC, index[(i+1)%len(index)], typemap)
+            rdataset.add(nsec, ttl=ttl)
+    if stats is not None:
+        stats.nsec += len(index)
+    return index
+
+
+def add_nsec3(zone, salt=None, iters=None, view=None, workers=None,
+              cache=None, optout=False, stats=None):
     """
     Add appropriate NSEC3 records to the given zone. The NSEC3PARAM record 
     is added as well. (see RFC-5155 for details)
+    Return NameIndex of the NSEC3 chain.
+
+    If workers > 1, owner names are hashed by a pool of processes. Hashes
+    can be reused between runs with NSEC3HashCache.
+
+    If optout is set, insecure delegations are not included in the chain
+    and Opt-Out flag is set in all NSEC3 records (RFC-5155, section 6).
+    Optional SigningStats are updated.
     """
     # For NSEC3 purposes, 8 octets long salt is used and fixed number of
     # iterations - 10. As this configuration is used by CZ.NIC, it's considered
@@ -432,22 +1181,27 @@ def add_nsec3(zone, salt=None, iters=None):
     if iters is None:
         iters = 10
 
-    # Only add NSEC records to owner names containing authoritative data or
-    # zone delegations
-    delegs = _get_delegations(zone)
-    names = list(set(delegs + _get_authoritative(zone)))
+    # Only add NSEC3 records to owner names containing authoritative data,
+    # zone delegations and empty non-terminals (RFC-5155, section 7.1)
+    if view is None:
+        with _phase(stats, 'view'):
+            view = _ZoneView(zone)
+    names = view.nsec3_members(optout)
+    flags = optout and NSEC3_FLAG_OPTOUT or NSEC3_FLAG_NONE
 
     # If a collision occurs (two names with the same hash - EXTREMLY low
     # probability), change the salt and try again. 
-    while True:
-        try:
-            hashed_names = _hashed_order(names, zone.origin, salt, iters)
-            break
-        except NSEC3Collision as collision:
-            if not can_resalt:
-                raise collision
-            salt = os.urandom(8)
-            continue
+    with _phase(stats, 'hash'):
+        while True:
+            try:
+                hashed_names = _hashed_order(names, zone.origin, salt, iters,
+                                             workers, cache)
+                break
+            except NSEC3Collision as collision:
+                if not can_resalt:
+                    raise collision
+                salt = os.urandom(8)
+                continue
 
     # Add NSEC3PARAM resource record
     ttl = _get_minimum_ttl(zone)
@@ -460,148 +1214,466 @@ def add_nsec3(zone, salt=None, iters=None):
 
     # Add NSEC3 records for all owner names having at least one authoritative
     # resource record
-    for i, nametuple in enumerate(hashed_names):
-        name, hashed = nametuple
-        rdtypes = set()
-        node = zone.get_node(name) or []
-        for rdataset in node:
-            if _is_authoritative(name, rdataset, zone, delegs):
-                rdtypes.add(rdataset.rdtype)
-                rdtypes.add(dns.rdatatype.RRSIG)
-            if _is_delegation(name, rdataset, zone):
-                rdtypes.add(rdataset.rdtype)
-        typemap = _rdtypes_to_bitmaps(list(rdtypes))
-
-        # Convert hashed name to DNSSEC's strange base32 encoding
-        b32hash = base64.b32encode(hashed)
-        b32hash = b32hash.translate(dns.rdtypes.ANY.NSEC3.b32_normal_to_hex)
-        owner = dns.name.Name((b32hash.lower(),)).derelativize(zone.origin)
-
-        rdataset = zone.find_rdataset(owner, rdtype=dns.rdatatype.NSEC3, 
-                                      create=True)
-        nexthash = hashed_names[(i+1)%len(hashed_names)][1]
-        nsec3 = dns.rdtypes.ANY.NSEC3.NSEC3(dns.rdataclass.IN, 
-                    dns.rdatatype.NSEC3, NSEC3_ALG_SHA1, 
-                    NSEC3_FLAG_NONE, iters, salt, nexthash, typemap)
-        rdataset.add(nsec3, ttl=ttl)
+    index = NameIndex(key=_nsec3_owner_hash)
+    with _phase(stats, 'nsec3'):
+        for i, nametuple in enumerate(hashed_names):
+            name, hashed = nametuple
+            typemap = view.nsec3_bitmap(name)
+            owner = _nsec3_owner(hashed, zone.origin)
+            rdataset = zone.find_rdataset(owner, rdtype=dns.rdatatype.NSEC3,
+                                          create=True)
+            nexthash = hashed_names[(i+1)%len(hashed_names)][1]
+            nsec3 = dns.rdtypes.ANY.NSEC3.NSEC3(dns.rdataclass.IN,
+                        dns.rdatatype.NSEC3, NSEC3_ALG_SHA1,
+                        flags, iters, salt, nexthash, typemap)
+            rdataset.add(nsec3, ttl=ttl)
+            index.add(owner)
+    if stats is not None:
+        stats.nsec3 += len(index)
+    return index
+
+
+def chain_index(zone):
+    """
+    Build NameIndex of NSEC or NSEC3 chain (depending on how the zone was
+    signed) of the given signed zone.
+    """
+    if zone.get_rdataset(zone.origin, dns.rdatatype.NSEC3PARAM) is not None:
+        return NameIndex([name.derelativize(zone.origin) for name, rdataset
+                          in zone.iterate_rdatasets(dns.rdatatype.NSEC3)],
+                         key=_nsec3_owner_hash)
+    return NameIndex([name.derelativize(zone.origin) for name, rdataset
+                      in zone.iterate_rdatasets(dns.rdatatype.NSEC)])
 
 
-def validate_rrsig(rrset, rrsig, keys, origin=None, now=None):
-    """Validate an RRset against a single signature rdata
+def zone_names(zone):
+    """
+    Build NameIndex of all the names in the given zone (see update_zone).
+    """
+    return NameIndex([name.derelativize(zone.origin) for name in zone.nodes])
 
-    The owner name of the rrsig is assumed to be the same as the owner name
-    of the rrset.
 
-    @param rrset: The RRset to validate
-    @type rrset: dns.rrset.RRset or (dns.name.Name, dns.rdataset.Rdataset)
-    tuple
-    @param rrsig: The signature rdata
-    @type rrsig: dns.rrset.Rdata
-    @param keys: The key dictionary.
-    @type keys: a dictionary keyed by dns.name.Name with node or rdataset values
-    @param origin: The origin to use for relative names
-    @type origin: dns.name.Name or None
-    @param now: The time to use when validating the signatures.  The default
-    is the current time.
-    @type now: int
+class _UnsupportedVerifier(object):
     """
+    Verifier of a key whose algorithm isn't supported by any backend
+    """
+    def __init__(self, key):
+        self.algorithm = key.algorithm
 
-    if isinstance(origin, (str, unicode)):
-        origin = dns.name.from_text(origin, dns.name.root)
+    def verify(self, digest, signature):
+        raise ValidationFailure, 'unknown algorithm %u' % self.algorithm
 
-    for candidate_key in _find_candidate_keys(keys, rrsig):
-        if not candidate_key:
-            raise ValidationFailure, 'unknown key'
 
-        # For convenience, allow the rrset to be specified as a (name, rdataset)
-        # tuple as well as a proper rrset
-        if isinstance(rrset, tuple):
-            rrname = rrset[0]
-            rdataset = rrset[1]
+class _PyCryptoVerifier(object):
+    """
+    RSA or DSA public key of a DNSKEY record decoded by PyCrypto
+    """
+    def __init__(self, key):
+        self.algorithm = key.algorithm
+        if _is_rsa(key.algorithm):
+            (rsa_e, rsa_n) = _dnskey2rsa(key.key)
+            self.keylen = len(rsa_n) * 8
+            self.pubkey = Crypto.PublicKey.RSA.construct(
+                (Crypto.Util.number.bytes_to_long(rsa_n),
+                 Crypto.Util.number.bytes_to_long(rsa_e)))
+            self.algorithm_id = _make_algorithm_id(key.algorithm)
         else:
-            rrname = rrset.name
-            rdataset = rrset
-
-        if now is None:
-            now = time.time()
-        if rrsig.expiration < now:
-            raise ValidationFailure, 'expired'
-        if rrsig.inception > now:
-            raise ValidationFailure, 'not yet valid'
-
-        hash = _make_hash(rrsig.algorithm)
-
-        if _is_rsa(rrsig.algorithm):
-            keyptr = candidate_key.key
-            (bytes,) = struct.unpack('!B', keyptr[0:1])
-            keyptr = keyptr[1:]
-            if bytes == 0:
-                (bytes,) = struct.unpack('!H', keyptr[0:2])
-                keyptr = keyptr[2:]
-            rsa_e = keyptr[0:bytes]
-            rsa_n = keyptr[bytes:]
-            keylen = len(rsa_n) * 8
-            pubkey = Crypto.PublicKey.RSA.construct(
-                (Crypto.Util.number.bytes_to_long(rsa_n),
-                 Crypto.Util.number.bytes_to_long(rsa_e)))
-            sig = (Crypto.Util.number.bytes_to_long(rrsig.signature),)
-        elif _is_dsa(rrsig.algorithm):
-            keyptr = candidate_key.key
-            (t,) = struct.unpack('!B', keyptr[0:1])
-            keyptr = keyptr[1:]
-            octets = 64 + t * 8
-            dsa_q = keyptr[0:20]
-            keyptr = keyptr[20:]
-            dsa_p = keyptr[0:octets]
-            keyptr = keyptr[octets:]
-            dsa_g = keyptr[0:octets]
-            keyptr = keyptr[octets:]
-            dsa_y = keyptr[0:octets]
-            pubkey = Crypto.PublicKey.DSA.construct(
+            (dsa_q, dsa_p, dsa_g, dsa_y) = _dnskey2dsa(key.key)
+            self.pubkey = Crypto.PublicKey.DSA.construct(
                 (Crypto.Util.number.bytes_to_long(dsa_y),
                  Crypto.Util.number.bytes_to_long(dsa_g),
                  Crypto.Util.number.bytes_to_long(dsa_p),
                  Crypto.Util.number.bytes_to_long(dsa_q)))
-            (dsa_r, dsa_s) = struct.unpack('!20s20s', rrsig.signature[1:])
+
+    def verify(self, digest, signature):
+        if _is_rsa(self.algorithm):
+            # PKCS1 algorithm identifier goop
+            digest = self.algorithm_id + digest
+            padlen = self.keylen // 8 - len(digest) - 3
+            digest = chr(0) + chr(1) + chr(0xFF) * padlen + chr(0) + digest
+            sig = (Crypto.Util.number.bytes_to_long(signature),)
+        else:
+            (dsa_r, dsa_s) = struct.unpack('!20s20s', signature[1:])
             sig = (Crypto.Util.number.bytes_to_long(dsa_r),
                    Crypto.Util.number.bytes_to_long(dsa_s))
+        return self.pubkey.verify(digest, sig)
+
+
+class _PyCryptoSigner(object):
+    """
+    RSA private key parsed by PyCrypto
+    """
+    def __init__(self, key):
+        if not _is_rsa(key.algorithm):
+            raise ValidationFailure("Unsupported algorithm %d" % key.algorithm)
+        self.hash = _pycrypto_hashes[_hash_name(key.algorithm)]
+        self.key = Crypto.PublicKey.RSA.importKey(key.privkey)
+        self.signer = Crypto.Signature.PKCS1_v1_5.new(self.key)
+
+    def sign(self, data):
+        return self.signer.sign(self.hash.new(data))
+
+
+_pycrypto_hashes = {
+    'sha1' : Crypto.Hash.SHA,
+    'sha256' : Crypto.Hash.SHA256,
+    'sha384' : Crypto.Hash.SHA384,
+    'sha512' : Crypto.Hash.SHA512,
+    }
+
+
+class _PyCryptoBackend(object):
+    """
+    Cryptographic backend using PyCrypto: RSA signing and RSA and DSA
+    validation.
+    """
+    name = 'pycrypto'
+
+    def supports(self, algorithm):
+        return _is_rsa(algorithm) or _is_dsa(algorithm)
+
+    def hash(self, name):
+        return _pycrypto_hashes[name]
+
+    def generate(self, algorithm, bits):
+        if not _is_rsa(algorithm):
+            raise ValidationFailure("Unknown algorithm %d" % algorithm)
+        key = Crypto.PublicKey.RSA.generate(bits)
+        return key.exportKey(format='PEM'), _rsa2dnskey(key)
+
+    def signer(self, key):
+        return _PyCryptoSigner(key)
+
+    def verifier(self, key):
+        return _PyCryptoVerifier(key)
+
+
+class _HashlibHash(object):
+    """
+    Hash module-like wrapper of hashlib (OpenSSL) hash constructor
+    """
+    def __init__(self, name):
+        self.new = getattr(hashlib, name)
+        self.digest_size = self.new().digest_size
+
+
+def _openssl_hash(algorithm):
+    """
+    Get hash algorithm of cryptography package for DNSSEC algorithm
+    """
+    return getattr(hashes, _hash_name(algorithm).upper())()
+
+
+class _OpenSSLVerifier(object):
+    """
+    Public key of a DNSKEY record decoded by OpenSSL (cryptography package)
+    """
+    def __init__(self, key):
+        self.algorithm = key.algorithm
+        backend = default_backend()
+        try:
+            if _is_rsa(key.algorithm):
+                (rsa_e, rsa_n) = _dnskey2rsa(key.key)
+                self.pubkey = rsa.RSAPublicNumbers(
+                    Crypto.Util.number.bytes_to_long(rsa_e),
+                    Crypto.Util.number.bytes_to_long(rsa_n)).public_key(backend)
+                self.args = (padding.PKCS1v15(),
+                             ec_utils.Prehashed(_openssl_hash(key.algorithm)))
+            elif _is_dsa(key.algorithm):
+                (dsa_q, dsa_p, dsa_g, dsa_y) = _dnskey2dsa(key.key)
+                params = dsa.DSAParameterNumbers(
+                    Crypto.Util.number.bytes_to_long(dsa_p),
+                    Crypto.Util.number.bytes_to_long(dsa_q),
+                    Crypto.Util.number.bytes_to_long(dsa_g))
+                self.pubkey = dsa.DSAPublicNumbers(
+                    Crypto.Util.number.bytes_to_long(dsa_y),
+                    params).public_key(backend)
+                self.args = (ec_utils.Prehashed(hashes.SHA1()),)
+            elif _is_ecdsa(key.algorithm):
+                curve, hash, self.octets = _ecdsa_params(key.algorithm)
+                self.pubkey = ec.EllipticCurvePublicNumbers(
+                    Crypto.Util.number.bytes_to_long(key.key[:self.octets]),
+                    Crypto.Util.number.bytes_to_long(key.key[self.octets:]),
+                    curve).public_key(backend)
+                self.args = (ec.ECDSA(ec_utils.Prehashed(hash)),)
+            else:
+                private, public, octets = _eddsa_params(key.algorithm)
+                self.pubkey = public.from_public_bytes(key.key)
+                self.args = ()
+        except ValueError:
+            raise ValidationFailure, 'invalid %s public key' % \
+                                     algorithm_to_text(key.algorithm)
+
+    def verify(self, digest, signature):
+        if _is_dsa(self.algorithm):
+            (dsa_r, dsa_s) = struct.unpack('!20s20s', signature[1:])
+            signature = ec_utils.encode_dss_signature(
+                Crypto.Util.number.bytes_to_long(dsa_r),
+                Crypto.Util.number.bytes_to_long(dsa_s))
+        elif _is_ecdsa(self.algorithm):
+            signature = ec_utils.encode_dss_signature(
+                Crypto.Util.number.bytes_to_long(signature[:self.octets]),
+                Crypto.Util.number.bytes_to_long(signature[self.octets:]))
+        try:
+            self.pubkey.verify(signature, digest, *self.args)
+        except InvalidSignature:
+            return False
+        return True
+
+
+class _OpenSSLSigner(object):
+    """
+    Private key parsed by OpenSSL (cryptography package)
+    """
+    def __init__(self, key):
+        self.algorithm = key.algorithm
+        if _is_rsa(key.algorithm):
+            self.args = (padding.PKCS1v15(), _openssl_hash(key.algorithm))
+        elif _is_ecdsa(key.algorithm):
+            curve, hash, self.octets = _ecdsa_params(key.algorithm)
+            self.args = (ec.ECDSA(hash),)
+        elif _is_eddsa(key.algorithm):
+            _eddsa_params(key.algorithm)
+            self.args = ()
         else:
-            raise ValidationFailure, 'unknown algorithm %u' % rrsig.algorithm
-
-        hash.update(_to_rdata(rrsig, origin)[:18])
-        hash.update(rrsig.signer.to_digestable(origin))
-
-        if rrsig.labels < len(rrname) - 1:
-            suffix = rrname.split(rrsig.labels + 1)[1]
-            rrname = dns.name.from_text('*', suffix)
-        rrnamebuf = rrname.to_digestable(origin)
-        rrfixed = struct.pack('!HHI', rdataset.rdtype, rdataset.rdclass,
-                              rrsig.original_ttl)
-        rrlist = sorted(rdataset);
-        for rr in rrlist:
-            hash.update(rrnamebuf)
-            hash.update(rrfixed)
-            rrdata = rr.to_digestable(origin)
-            rrlen = struct.pack('!H', len(rrdata))
-            hash.update(rrlen)
-            hash.update(rrdata)
-
-        digest = hash.digest()
-
-        if _is_rsa(rrsig.algorithm):
-            # PKCS1 algorithm identifier goop
-            digest = _make_algorithm_id(rrsig.algorithm) + digest
-            padlen = keylen // 8 - len(digest) - 3
-            digest = chr(0) + chr(1) + chr(0xFF) * padlen + chr(0) + digest
-        elif _is_dsa(rrsig.algorithm):
-            pass
+            raise ValidationFailure("Unsupported algorithm %d" % key.algorithm)
+        self.key = serialization.load_pem_private_key(key.privkey, None,
+                                                      default_backend())
+
+    def sign(self, data):
+        signature = self.key.sign(data, *self.args)
+        if _is_ecdsa(self.algorithm):
+            # DER encoded signature is converted to r | s (RFC-6605)
+            (ecdsa_r, ecdsa_s) = ec_utils.decode_dss_signature(signature)
+            signature = \
+                Crypto.Util.number.long_to_bytes(ecdsa_r, self.octets) + \
+                Crypto.Util.number.long_to_bytes(ecdsa_s, self.octets)
+        return signature
+
+
+class _OpenSSLBackend(object):
+    """
+    Cryptographic backend using OpenSSL through the cryptography package:
+    RSA, ECDSA and EdDSA signing and validation, DSA validation.
+    """
+    name = 'openssl'
+
+    def __init__(self):
+        self._curves = {}
+
+    def supports(self, algorithm):
+        if _is_ecdsa(algorithm):
+            # The curves depend on how OpenSSL was built
+            if algorithm not in self._curves:
+                curve, hash, octets = _ecdsa_params(algorithm)
+                self._curves[algorithm] = default_backend(). \
+                    elliptic_curve_signature_algorithm_supported(
+                        ec.ECDSA(hash), curve)
+            return self._curves[algorithm]
+        return _is_rsa(algorithm) or _is_dsa(algorithm) or \
+               (_is_eddsa(algorithm) and _have_eddsa)
+
+    def hash(self, name):
+        return _HashlibHash(name)
+
+    def generate(self, algorithm, bits):
+        backend = default_backend()
+        if _is_rsa(algorithm):
+            key = rsa.generate_private_key(65537, bits, backend)
+            private = key.private_bytes(serialization.Encoding.PEM,
+                                serialization.PrivateFormat.TraditionalOpenSSL,
+                                serialization.NoEncryption())
+            return private, _rsa2dnskey(key.public_key().public_numbers())
+        if _is_ecdsa(algorithm):
+            curve, hash, octets = _ecdsa_params(algorithm)
+            key = ec.generate_private_key(curve, backend)
+            numbers = key.public_key().public_numbers()
+            public = Crypto.Util.number.long_to_bytes(numbers.x, octets) + \
+                     Crypto.Util.number.long_to_bytes(numbers.y, octets)
+        elif _is_eddsa(algorithm):
+            private, public, octets = _eddsa_params(algorithm)
+            key = private.generate()
+            public = key.public_key().public_bytes(serialization.Encoding.Raw,
+                                                   serialization.PublicFormat.Raw)
         else:
-            # Raise here for code clarity; this won't actually ever happen
-            # since if the algorithm is really unknown we'd already have
-            # raised an exception above
-            raise ValidationFailure, 'unknown algorithm %u' % rrsig.algorithm
+            raise ValidationFailure("Unknown algorithm %d" % algorithm)
+        private = key.private_bytes(serialization.Encoding.PEM,
+                                    serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+        return private, public
+
+    def signer(self, key):
+        return _OpenSSLSigner(key)
+
+    def verifier(self, key):
+        return _OpenSSLVerifier(key)
+
+
+# Available cryptographic backends, see set_backend
+_backends = {'pycrypto' : _PyCryptoBackend()}
+if _have_cryptography:
+    _backends['openssl'] = _OpenSSLBackend()
+_backend = _backends['pycrypto']
+
+def backends():
+    """
+    Get names of the available cryptographic backends
+    """
+    return sorted(_backends)
+
+def get_backend():
+    """
+    Get name of the selected cryptographic backend
+    """
+    return _backend.name
+
+def set_backend(name):
+    """
+    Select cryptographic backend used for hashing, key generation, signing and
+    validation: 'pycrypto' (default) or 'openssl' (requires the cryptography
+    package). Algorithms not supported by the selected backend are handled by
+    another available one.
+    """
+    global _backend
+    if name not in _backends:
+        raise ValueError('unknown cryptographic backend %s' % name)
+    _backend = _backends[name]
+
+def _backend_for(algorithm):
+    """
+    Get backend supporting the given algorithm, preferably the selected one.
+    Return None if there isn't any.
+    """
+    if _backend.supports(algorithm):
+        return _backend
+    for name in sorted(_backends):
+        if _backends[name].supports(algorithm):
+            return _backends[name]
+    return None
+
+def _verifier(key):
+    """
+    Get public key of the given DNSKEY decoded and ready to verify signatures
+    made by it: an object with verify(digest, signature) method, returning
+    True if the signature of the given digest (or the whole message in case
+    of EdDSA, see _Accumulator) is valid.
+    """
+    backend = _backend_for(key.algorithm)
+    if backend is None:
+        return _UnsupportedVerifier(key)
+    return backend.verifier(key)
+
+
+class KeyStore(object):
+    """
+    Trusted keys indexed by signer name, algorithm and key tag. Public keys
+    are decoded when they are added, so that validation of many signatures
+    doesn't pay the key setup cost for each of them. It can be used in place
+    of the key dictionary in validate and validate_rrsig.
+    """
+    def __init__(self, keys=None):
+        self._verifiers = {}
+        if keys is not None:
+            for name, value in keys.iteritems():
+                self.add(name, value)
+
+    def __len__(self):
+        return sum(len(v) for v in self._verifiers.itervalues())
+
+    def add(self, name, keys):
+        """
+        Add keys of the given signer name. Keys are a node, rdataset or list
+        of DNSKEY rdatas.
+        """
+        if isinstance(name, (str, unicode)):
+            name = dns.name.from_text(name, dns.name.root)
+        for rdata in _dnskey_rdataset(keys) or ():
+            index = (name, rdata.algorithm, key_id(rdata))
+            self._verifiers.setdefault(index, []).append(_verifier(rdata))
+
+    def candidates(self, rrsig):
+        """
+        Get verifiers of the keys which may have made the given signature.
+        """
+        index = (rrsig.signer, rrsig.algorithm, rrsig.key_tag)
+        return self._verifiers.get(index, [])
+
+
+def _validation_signed_data(rrsig, rrname, rdataset, origin):
+    """
+    Build the data covered by the signature for validation, see RFC-4034,
+    section 3.1.8.1. It's built independently of the signing side
+    (_rrsig_header and _rrset_image), so that a mistake in one doesn't hide
+    in the other.
+    """
+    if rrsig.labels < len(rrname) - 1:
+        suffix = rrname.split(rrsig.labels + 1)[1]
+        rrname = dns.name.from_text('*', suffix)
+    data = [_to_rdata(rrsig, origin)[:18], rrsig.signer.to_digestable(origin)]
+    rrnamebuf = rrname.to_digestable(origin)
+    rrfixed = struct.pack('!HHI', rdataset.rdtype, rdataset.rdclass,
+                          rrsig.original_ttl)
+    for rrdata in sorted(rr.to_digestable(origin) for rr in rdataset):
+        data.append(rrnamebuf)
+        data.append(rrfixed)
+        data.append(struct.pack('!H', len(rrdata)))
+        data.append(rrdata)
+    return ''.join(data)
+
+
+def validate_rrsig(rrset, rrsig, keys, origin=None, now=None):
+    """Validate an RRset against a single signature rdata
+
+    The owner name of the rrsig is assumed to be the same as the owner name
+    of the rrset.
+
+    @param rrset: The RRset to validate
+    @type rrset: dns.rrset.RRset or (dns.name.Name, dns.rdataset.Rdataset)
+    tuple
+    @param rrsig: The signature rdata
+    @type rrsig: dns.rrset.Rdata
+    @param keys: The key dictionary or key store.
+    @type keys: KeyStore or a dictionary keyed by dns.name.Name with node or
+    rdataset values
+    @param origin: The origin to use for relative names
+    @type origin: dns.name.Name or None
+    @param now: The time to use when validating the signatures.  The default
+    is the current time.
+    @type now: int
+    """
+
+    if isinstance(origin, (str, unicode)):
+        origin = dns.name.from_text(origin, dns.name.root)
+
+    candidate_keys = _find_candidate_keys(keys, rrsig)
+    if not candidate_keys:
+        raise ValidationFailure, 'unknown key'
+
+    # For convenience, allow the rrset to be specified as a (name, rdataset)
+    # tuple as well as a proper rrset
+    if isinstance(rrset, tuple):
+        rrname = rrset[0]
+        rdataset = rrset[1]
+    else:
+        rrname = rrset.name
+        rdataset = rrset
+
+    if now is None:
+        now = time.time()
+    if rrsig.expiration < now:
+        raise ValidationFailure, 'expired'
+    if rrsig.inception > now:
+        raise ValidationFailure, 'not yet valid'
+
+    if not _is_supported(rrsig.algorithm):
+        raise ValidationFailure, 'unknown algorithm %u' % rrsig.algorithm
 
-        if pubkey.verify(digest, sig):
+    hash = _make_hash(rrsig.algorithm)
+    hash.update(_validation_signed_data(rrsig, rrname, rdataset, origin))
+    digest = hash.digest()
+
+    for verifier in candidate_keys:
+        if verifier.verify(digest, rrsig.signature):
             return
     raise ValidationFailure, 'verify failure'
 
@@ -614,8 +1686,9 @@ def validate(rrset, rrsigset, keys, origin=None, now=None):
     @param rrsigset: The signature RRset
     @type rrsigset: dns.rrset.RRset or (dns.name.Name, dns.rdataset.Rdataset)
     tuple
-    @param keys: The key dictionary.
-    @type keys: a dictionary keyed by dns.name.Name with node or rdataset values
+    @param keys: The key dictionary or key store.
+    @type keys: KeyStore or a dictionary keyed by dns.name.Name with node or
+    rdataset values
     @param origin: The origin to use for relative names
     @type origin: dns.name.Name or None
     @param now: The time to use when validating the signatures.  The default
@@ -662,22 +1735,141 @@ def _rrsig_labels(name, origin):
     return len(labels)
 
 
-def _sign(digest, key):
+def _sign(data, key):
     """
     Sign the given string using the given key
     """
-    if _is_rsa(key.algorithm):
-        rsakey = Crypto.PublicKey.RSA.importKey(key.privkey)
-        signer = Crypto.Signature.PKCS1_v1_5.new(rsakey)
-        return signer.sign(digest)
-    else:
-        raise ValidationFailure("Unsupported algorithm %d" % key.algorithm)
+    return key.signing_context().sign(data)
+
+
+def _rrsig_template(rrname, rdataset, key, origin, expiration, inception):
+    """
+    Prepare RRSIG record for the given RR set (without signature field)
+    """
+    return dns.rdtypes.ANY.RRSIG.RRSIG(rdataset.rdclass, dns.rdatatype.RRSIG,
+                rdataset.rdtype, key.algorithm, _rrsig_labels(rrname, origin),
+                rdataset.ttl,expiration, inception, key.key_tag(), 
+                origin.canonicalize(), 'NULL')
 
 
-def sign_rrset(rrset, key, origin, expiration, inception):
+def _rrsig_header(rrsig, origin):
+    """
+    Build RRSIG RDATA without the signature: the first part of the signed
+    data, see RFC-4034, section 3.1.8.1
+    """
+    return struct.pack('!HBBIIIH', rrsig.type_covered, rrsig.algorithm,
+                       rrsig.labels, rrsig.original_ttl, rrsig.expiration,
+                       rrsig.inception, rrsig.key_tag) + \
+           rrsig.signer.to_digestable(origin)
+
+
+def _rrset_image(rrname, rdataset, ttl, origin):
+    """
+    Build canonical wire image of the given RR set with the given TTL: the
+    second part of the signed data, see RFC-4034, section 3.1.8.1. RRs are
+    sorted by their canonical RDATA (RFC-4034, section 6.3), which is
+    computed only once for each of them.
+    """
+    header = rrname.to_digestable(origin) + \
+             struct.pack('!HHI', rdataset.rdtype, rdataset.rdclass, ttl)
+    rrdatas = sorted(set(rr.to_digestable(origin) for rr in rdataset))
+    data = []
+    for rrdata in rrdatas:
+        data.append(header + struct.pack('!H', len(rrdata)))
+        data.append(rrdata)
+    return ''.join(data)
+
+
+class SignatureCache(_FileCache):
+    """
+    Cache of signatures keyed by digest of the signed data without validity
+    times (canonical RR set image and RRSIG fields: type, algorithm, labels,
+    original TTL, key tag and signer) and of the public key. When an
+    unchanged RR set is signed again by the same key, cached signature is
+    reused (with its original inception and expiration) unless it expires
+    within refresh seconds.
+
+    The cache can be persisted between runs: if filename is given, the cache
+    is loaded from it (if it exists) and save() writes it back.
+    """
+    _magic = 'PYDNSSEC SIGNATURES 1\n'
+
+    def __init__(self, filename=None, refresh=3600 * 24 * 30):
+        self.refresh = refresh
+        super(SignatureCache, self).__init__(filename)
+
+    def _to_record(self, key, value):
+        inception, expiration, signature = value
+        return (key, struct.pack('!II', inception, expiration), signature)
+
+    def _from_record(self, record):
+        key, times, signature = record
+        inception, expiration = struct.unpack('!II', times)
+        return key, (inception, expiration, signature)
+
+    def _key(self, rrsig, image, key, origin):
+        header = _rrsig_header(rrsig, origin)
+        # Skip expiration and inception fields
+        return hashlib.sha256(header[:8] + header[16:] + key.key +
+                              image).digest()
+
+    def fetch(self, rrsig, image, key, origin, now=None, before=None):
+        """
+        Complete RRSIG template of the given RR set image and key with cached
+        signature and its validity times. Return False if there is no
+        signature to be reused: none is cached or it expires within refresh
+        seconds or before the given time.
+        """
+        cached = self._entries.get(self._key(rrsig, image, key, origin))
+        if cached is None:
+            return False
+        if now is None:
+            now = time.time()
+        inception, expiration, signature = cached
+        if inception > now or expiration < now + self.refresh:
+            return False
+        if before is not None and expiration < before:
+            return False
+        rrsig.inception = inception
+        rrsig.expiration = expiration
+        rrsig.signature = signature
+        return True
+
+    def store(self, rrsig, image, key, origin):
+        """
+        Store signature of the given RR set image made by the given key
+        """
+        self._entries[self._key(rrsig, image, key, origin)] = \
+            (rrsig.inception, rrsig.expiration, rrsig.signature)
+
+    def prune(self, now=None):
+        """
+        Remove signatures which can't be reused anymore
+        """
+        if now is None:
+            now = time.time()
+        self._prune(lambda key, value: value[1] < now + self.refresh)
+
+
+def sign_rrset(rrset, key, origin, expiration, inception, signer=None,
+               cache=None):
     """
     Generate a RRSIG record for given RR set
     """
+    return sign_rrset_multi(rrset, [key], origin, expiration, inception,
+                            signer, cache)[0]
+
+
+def sign_rrset_multi(rrset, keys, origin, expiration, inception, signer=None,
+                     cache=None, refresh_before=None):
+    """
+    Generate RRSIG records for given RR set, one for each of the given keys
+    (e.g. during key rollover). Canonical form of the RR set is built only
+    once and shared by all the signatures. Signatures are made by the remote
+    signer (SignerClient) if given. Signatures found in SignatureCache are
+    reused (unless they expire before refresh_before), new ones are stored
+    to it.
+    """
     # For convenience, allow the rrset to be specified as a (name, rdataset)
     # tuple as well as a proper rrset
     if isinstance(rrset, tuple):
@@ -687,47 +1879,205 @@ def sign_rrset(rrset, key, origin, expiration, inception):
         rrname = rrset.name
         rdataset = rrset
 
-    # Prepare RRSIG record (without signature field)
-    rrsig = dns.rdtypes.ANY.RRSIG.RRSIG(rdataset.rdclass, dns.rdatatype.RRSIG,
-                rdataset.rdtype, key.algorithm, _rrsig_labels(rrname, origin),
-                rdataset.ttl,expiration, inception, key.key_tag(), 
-                origin.canonicalize(), 'NULL')
+    image = _rrset_image(rrname, rdataset, rdataset.ttl, origin)
+    rrsigs = [_rrsig_template(rrname, rdataset, key, origin, expiration,
+                              inception) for key in keys]
+    missing = [i for i, rrsig in enumerate(rrsigs) if cache is None or
+               not cache.fetch(rrsig, image, keys[i], origin,
+                               before=refresh_before)]
+    if signer is not None and missing:
+        headers = [(i, _rrsig_header(rrsigs[i], origin)) for i in missing]
+        signatures = list(signer.sign(keys, [(image, headers)]))[0]
+    else:
+        signatures = [_sign(_rrsig_header(rrsigs[i], origin) + image,
+                            keys[i]) for i in missing]
+    for i, signature in itertools.izip(missing, signatures):
+        rrsigs[i].signature = signature
+        if cache is not None:
+            cache.store(rrsigs[i], image, keys[i], origin)
+    return rrsigs
 
-    # Prepare digest function
-    digest = _make_hash(key.algorithm)
 
-    # Add RRSIG fields to digest
-    digest.update(_to_rdata(rrsig, origin)[:18])
-    digest.update(rrsig.signer.to_digestable(origin))
+# Private keys of a signing worker process, see _sign_worker_init
+_worker_keys = None
 
-    # Add RRs to digest
-    rrnamebuf = rrname.to_digestable(origin)
-    rrfixed = struct.pack('!HHI', rdataset.rdtype, rdataset.rdclass,
-                  rrsig.original_ttl)
-    rrlist = sorted(rdataset)
-    for rr in rrlist:
-        digest.update(rrnamebuf)
-        digest.update(rrfixed)
-        rrdata = rr.to_digestable(origin)
-        rrlen = struct.pack('!H', len(rrdata))
-        digest.update(rrlen)
-        digest.update(rrdata)
+def _sign_worker_init(keys):
+    """
+    Initialize a signing worker process: keys are transferred only once per
+    process, not with every signing task.
+    """
+    global _worker_keys
+    Crypto.Random.atfork()
+    _worker_keys = keys
 
-    # Update RRSIG with calculated signature and return
-    rrsig.signature = _sign(digest, key)
-    return rrsig
 
+def _sign_worker(task):
+    """
+    Sign RR set in a worker process with one or more keys. Task is a (RR set
+    image, [(key index, RRSIG header), ...]) tuple. Return list of signatures.
+    """
+    image, headers = task
+    return [_sign(header + image, _worker_keys[index])
+            for index, header in headers]
 
-def sign_zone(zone, keys, expiration=None, inception=None, nsec3=False,
-               keyttl=3600, nsec3salt=None, nsec3iters=None):
+
+def _sign_pool(keys, workers):
     """
-    Given dnspython zone instance and uNIC KSK and ZSK keys to be used,
-    sign the zone with DNSSEC
+    Start a pool of signing worker processes holding the given keys
+    """
+    return multiprocessing.Pool(workers, _sign_worker_init, (keys,))
+
+
+def _expiration_jitter(name, rdtype, origin, jitter):
+    """
+    Get offset (0 to jitter seconds) to be subtracted from expiration time of
+    signatures of the given RR set. It's derived from the owner name and type,
+    so that the RR set gets the same offset every time it's signed.
+    """
+    if not jitter:
+        return 0
+    digest = hashlib.sha1(name.to_digestable(origin) +
+                          struct.pack('!H', rdtype)).digest()
+    return struct.unpack('!I', digest[:4])[0] % (int(jitter) + 1)
+
+
+def _sign_rrsets(rrsets, keys, origin, expiration, inception, workers=None,
+                 signer=None, jitter=0, cache=None, refresh_before=None,
+                 pool=None):
+    """
+    Sign the given list of (name, rdataset, signing keys) tuples. Yield (name,
+    rdataset, rrsig) tuples in the same order, one for each key. If workers
+    > 1, signatures are computed by a pool of worker processes. If a remote
+    signer (SignerClient) is given, signatures are made by it. Expiration
+    of each RR set is moved back by up to jitter seconds. Signatures are
+    reused from and stored to SignatureCache if given, cached signatures
+    expiring before refresh_before are not reused. A pool of workers
+    started by the caller (see _sign_pool) is used if given, so that it
+    can be shared by several calls.
+    """
+    if signer is None and pool is None and (not workers or workers <= 1):
+        for rrname, rdataset, signers in rrsets:
+            rrexpiration = expiration - _expiration_jitter(rrname,
+                                    rdataset.rdtype, origin, jitter)
+            for rrsig in sign_rrset_multi((rrname, rdataset), signers, origin,
+                                          rrexpiration, inception,
+                                          cache=cache,
+                                          refresh_before=refresh_before):
+                yield rrname, rdataset, rrsig
+        return
+
+    # dnspython objects can't be pickled, so the signed data are prepared
+    # here and only the raw strings are transferred to the workers. Tasks
+    # are prepared lazily as they are consumed; RRSIG templates wait in
+    # pending until their signatures arrive (RR sets signed from the cache
+    # only don't produce a task).
+    indexes = dict((id(key), i) for i, key in enumerate(keys))
+    pending = collections.deque()
+    failed = []
+    now = time.time()
+
+    def prepare():
+        try:
+            for rrname, rdataset, signers in rrsets:
+                image = _rrset_image(rrname, rdataset, rdataset.ttl, origin)
+                rrexpiration = expiration - _expiration_jitter(rrname,
+                                        rdataset.rdtype, origin, jitter)
+                rrsigs = []
+                headers = []
+                for key in signers:
+                    rrsig = _rrsig_template(rrname, rdataset, key, origin,
+                                            rrexpiration, inception)
+                    if cache is not None and \
+                       cache.fetch(rrsig, image, key, origin, now,
+                                   refresh_before):
+                        rrsigs.append((key, rrsig, False))
+                        continue
+                    rrsigs.append((key, rrsig, True))
+                    headers.append((indexes[id(key)],
+                                    _rrsig_header(rrsig, origin)))
+                pending.append((rrname, rdataset, image, rrsigs, headers))
+                if headers:
+                    yield image, headers
+        except Exception:
+            # Raised in the consumer, the pool would not report an error
+            # raised before the first task
+            failed.append(sys.exc_info())
+
+    shared = pool
+    if signer is not None:
+        pool = None
+        results = signer.sign(keys, prepare())
+    else:
+        if pool is None:
+            pool = _sign_pool(keys, workers)
+        chunksize = max(1, min(256, len(rrsets) // ((workers or 1) * 4)))
+        results = pool.imap(_sign_worker, prepare(), chunksize)
+        if shared is not None:
+            pool = None
+    try:
+        results = iter(results)
+        ready = None
+        while True:
+            if not pending:
+                # Wait for the next result, its RR set is pending then. If
+                # there are no more results, all RR sets are prepared.
+                ready = next(results, None)
+                if not pending:
+                    break
+            rrname, rdataset, image, rrsigs, headers = pending.popleft()
+            if headers:
+                if ready is None:
+                    ready = results.next()
+                signatures = iter(ready)
+                ready = None
+            for key, rrsig, missing in rrsigs:
+                if missing:
+                    rrsig.signature = signatures.next()
+                    if cache is not None:
+                        cache.store(rrsig, image, key, origin)
+                yield rrname, rdataset, rrsig
+        if failed:
+            raise failed[0][0], failed[0][1], failed[0][2]
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def _zone_signing_keys(keys):
+    """
+    Get keys used to sign other RR sets than DNSKEY: all keys without SEP flag
+    or all the given keys if there are only SEP keys.
     """
-    # Set defaults
     zsk = [k for k in keys if not (k.flags & DNSKEY_FLAG_SEP)]
     if not len(zsk):
         zsk = keys
+    return zsk
+
+
+def sign_zone(zone, keys, expiration=None, inception=None, nsec3=False,
+               keyttl=3600, nsec3salt=None, nsec3iters=None, workers=None,
+               nsec3cache=None, optout=False, stats=None, signer=None,
+               expiry=None, jitter=0, sigcache=None):
+    """
+    Given dnspython zone instance and uNIC KSK and ZSK keys to be used,
+    sign the zone with DNSSEC. If workers > 1, RR sets are signed (and NSEC3
+    owner names hashed) in parallel by the given number of processes.
+    NSEC3HashCache can be given to reuse NSEC3 hashes from previous runs.
+    With optout, insecure delegations are left out of NSEC3 chain (RFC-5155,
+    section 6). Time spent in individual phases and numbers of records
+    created are collected if SigningStats are given. Signatures are made by
+    the remote signer (SignerClient) if given, keys may be public only then.
+    The given ExpiryIndex is updated with the created signatures. With
+    jitter, expiration of each RR set is moved back by up to the given number
+    of seconds (by the same offset every time for the same RR set), so that
+    the signatures don't expire all at once. Signatures of unchanged RR sets
+    are reused from SignatureCache given as sigcache.
+    """
+    # Set defaults
+    zsk = _zone_signing_keys(keys)
     if expiration is None:
         expiration = time.time() + (3600 * 24 * 90) # 90 days from now
     if inception is None:
@@ -740,38 +2090,795 @@ def sign_zone(zone, keys, expiration=None, inception=None, nsec3=False,
         dnskey_set.add(key.get_pubkey(), ttl=keyttl)
 
     # Add NSEC / NSEC3 RRs
+    with _phase(stats, 'view'):
+        view = _ZoneView(zone)
     if nsec3:
-        add_nsec3(zone, nsec3salt, nsec3iters)
+        index = add_nsec3(zone, nsec3salt, nsec3iters, view, workers,
+                          nsec3cache, optout, stats)
+    else:
+        index = add_nsec(zone, view, stats)
+
+    with _phase(stats, 'collect'):
+        # Sign the DNSKEY records with all keys
+        rrsets = [(zone.origin, dnskey_set, keys)]
+
+        # Sign other RRs
+        for rrname, (node, status) in view.nodes.iteritems():
+            # Delegations and respective glue records MUST NOT be signed
+            # (RFC-4035, section 2.2.)
+            if status == _GLUE:
+                continue
+            for rdataset in node:
+                # DNSKEY are already signed, do not sign again
+                if rdataset.rdtype == dns.rdatatype.DNSKEY:
+                    continue
+                # RRSIG records MUST NOT be signed (RFC-4035, section 2.2.)
+                if rdataset.rdtype == dns.rdatatype.RRSIG:
+                    continue
+                if not view.is_authoritative(rrname, rdataset.rdtype):
+                    continue
+                rrsets.append((rrname, rdataset, zsk))
+
+        # Sign NSEC3 records
+        if nsec3:
+            for owner in index:
+                rdataset = zone.find_rdataset(owner, dns.rdatatype.NSEC3)
+                rrsets.append((owner, rdataset, zsk))
+        if stats is not None:
+            stats.total += sum(len(rrset[2]) for rrset in rrsets)
+
+    with _phase(stats, 'sign'):
+        for rrname, rdataset, rrsig in _sign_rrsets(rrsets, keys, zone.origin,
+                                                    expiration, inception,
+                                                    workers, signer, jitter,
+                                                    sigcache):
+            rrsig_set = zone.find_rdataset(rrname, rdtype=dns.rdatatype.RRSIG,
+                                           covers=rdataset.rdtype, create=True)
+            rrsig_set.add(rrsig, ttl=rdataset.ttl)
+            if stats is not None:
+                stats.signed(rrsig)
+            if expiry is not None:
+                expiry.add(rrname, rrsig)
+
+
+def resign_zone(zone, keys, refresh_before, expiration=None, inception=None,
+                workers=None, signer=None, expiry=None, jitter=0, rrsets=None,
+                sigcache=None, keyttl=3600, unpublish=False):
+    """
+    Refresh signatures in an already signed zone. Only RRSIGs expiring before
+    refresh_before or made by keys not present in the given keys are replaced,
+    all other signatures as well as NSEC/NSEC3 records are kept intact.
+    Authoritative RR sets without signatures are signed.
+    Keys missing from the apex DNSKEY RR set are added to it (with its TTL,
+    or keyttl if there are no DNSKEY records) and the RR set is signed again.
+    DNSKEY records of other keys are removed only if unpublish is True.
+    Signatures are made by the remote signer (SignerClient) if given. The
+    given ExpiryIndex is kept up to date. Jitter of expiration times and
+    SignatureCache are applied as in sign_zone.
+
+    Signatures of RR sets given in rrsets, a set of (name, covered type)
+    tuples (see plan_refresh), are replaced regardless of their expiration.
+    Cached signatures are reused only if they expire after refresh_before
+    and after all the signatures replaced this way.
+
+    Returns the number of created signatures.
+    """
+    zsk = _zone_signing_keys(keys)
+    if expiration is None:
+        expiration = time.time() + (3600 * 24 * 90) # 90 days from now
+    if inception is None:
+        inception = time.time() - (3600 * 24) # 1 day ago
+
+    # Publish new keys, changed DNSKEY RR set has to be signed again
+    dnskey_set = zone.find_rdataset(zone.origin, rdtype=dns.rdatatype.DNSKEY,
+                                    create=True)
+    published = False
+    pubkeys = [key.get_pubkey() for key in keys]
+    if unpublish:
+        for dnskey in list(dnskey_set):
+            if dnskey not in pubkeys:
+                dnskey_set.remove(dnskey)
+                published = True
+    for pubkey in pubkeys:
+        if pubkey not in dnskey_set:
+            dnskey_set.add(pubkey, ttl=dnskey_set.ttl if len(dnskey_set)
+                                       else keyttl)
+            published = True
+
+    current = set((k.algorithm, k.key_tag()) for k in keys)
+    planned = rrsets or ()
+    rrsets = []
+    count = 0
+    # Cached signatures must not bring back the expiring ones
+    before = refresh_before
+    view = _ZoneView(zone)
+    for rrname, node in zone.nodes.iteritems():
+        name = rrname.derelativize(zone.origin)
+        # Hashed owner names of NSEC3 chain are not part of the view
+        node, status = view.nodes.get(name, (node, _AUTHORITATIVE))
+        if status == _GLUE:
+            continue
+        signatures = {}
+        for rdataset in node:
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                signatures.setdefault(rdataset.covers, []).append(rdataset)
+        for rdataset in list(node):
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                continue
+            if status == _DELEGATION and \
+               rdataset.rdtype not in _DELEGATION_TYPES:
+                continue
+            refresh = (published and rdataset is dnskey_set) or \
+                (planned and (name, rdataset.rdtype) in planned)
+
+            # Drop stale signatures and signatures made by retired keys,
+            # keep the rest in a single RRSIG rdataset
+            rrsig_sets = signatures.get(rdataset.rdtype, [])
+            for rrsig_set in rrsig_sets[1:]:
+                node.rdatasets.remove(rrsig_set)
+            valid = set()
+            for rrsig in [rrsig for rrsig_set in rrsig_sets
+                          for rrsig in rrsig_set]:
+                if refresh or rrsig.expiration < refresh_before or \
+                   (rrsig.algorithm, rrsig.key_tag) not in current:
+                    if refresh:
+                        before = max(before, rrsig.expiration + 1)
+                    if rrsig in rrsig_sets[0]:
+                        rrsig_sets[0].remove(rrsig)
+                    if expiry is not None:
+                        expiry.remove(name, rrsig)
+                else:
+                    if rrsig not in rrsig_sets[0]:
+                        rrsig_sets[0].add(rrsig)
+                    valid.add((rrsig.algorithm, rrsig.key_tag))
+
+            if rdataset.rdtype == dns.rdatatype.DNSKEY:
+                signers = keys
+            else:
+                signers = zsk
+            signers = [key for key in signers
+                       if (key.algorithm, key.key_tag()) not in valid]
+            if signers:
+                rrsets.append((rrname, rdataset, signers))
+                count += len(signers)
+
+    for rrname, rdataset, rrsig in _sign_rrsets(rrsets, keys, zone.origin,
+                                                expiration, inception, workers,
+                                                signer, jitter, sigcache,
+                                                before):
+        rrsig_set = zone.find_rdataset(rrname, rdtype=dns.rdatatype.RRSIG,
+                                       covers=rdataset.rdtype, create=True)
+        rrsig_set.add(rrsig, ttl=rdataset.ttl)
+        if expiry is not None:
+            expiry.add(rrname.derelativize(zone.origin), rrsig)
+    return count
+
+
+class _ZoneJournal(object):
+    """
+    Records original content of all RR sets modified through it, so that
+    the differences can be produced afterwards.
+    """
+    def __init__(self, zone):
+        self.zone = zone
+        self.original = {}
+        self.order = []
+
+    def _save(self, name, rdtype, covers):
+        key = (name, rdtype, covers)
+        if key not in self.original:
+            rdataset = self.zone.get_rdataset(name, rdtype, covers)
+            if rdataset is not None:
+                rdataset = rdataset.copy()
+            self.original[key] = rdataset
+            self.order.append(key)
+
+    def find_rdataset(self, name, rdtype, covers=dns.rdatatype.NONE):
+        """
+        Get RR set to be modified, create it if it doesn't exist.
+        """
+        self._save(name, rdtype, covers)
+        return self.zone.find_rdataset(name, rdtype, covers, create=True)
+
+    def delete_rdataset(self, name, rdtype, covers=dns.rdatatype.NONE):
+        """
+        Delete RR set if it exists.
+        """
+        if self.zone.get_rdataset(name, rdtype, covers) is not None:
+            self._save(name, rdtype, covers)
+            self.zone.delete_rdataset(name, rdtype, covers)
+
+    def diff(self):
+        """
+        Get (removed, added) tuple of lists of RR sets (dns.rrset.RRset).
+        Modified RR set is present in both lists.
+        """
+        removed = []
+        added = []
+        for name, rdtype, covers in self.order:
+            old = self.original[(name, rdtype, covers)]
+            new = self.zone.get_rdataset(name, rdtype, covers)
+            if new is not None and not len(new):
+                self.zone.delete_rdataset(name, rdtype, covers)
+                new = None
+            if old == new and (old is None or old.ttl == new.ttl):
+                continue
+            if old is not None:
+                removed.append(_to_rrset(name, old))
+            if new is not None:
+                added.append(_to_rrset(name, new))
+        return removed, added
+
+
+def _to_rrset(name, rdataset):
+    rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype,
+                            rdataset.covers)
+    rrset.update(rdataset)
+    return rrset
+
+
+def _has_descendants(zone, names, candidates, member):
+    """
+    Get subset of the candidate names having any descendant (name, node) in
+    the zone for which member returns True. Names is NameIndex of all the
+    names in the zone (nodes removed during the update are skipped).
+    """
+    found = set()
+    for name in candidates:
+        for n in names.descendants(name):
+            node = zone.get_node(n)
+            if node is not None and member(n, node):
+                found.add(name)
+                break
+    return found
+
+
+def _sync_names(zone, names, changed):
+    """
+    Update NameIndex of all the names in the zone after the given names were
+    changed
+    """
+    for name in changed:
+        if zone.get_node(name) is not None:
+            names.add(name)
+        elif name in names:
+            names.remove(name)
+
+
+def update_zone(zone, keys, add=None, delete=None, expiration=None,
+                inception=None, workers=None, index=None, signer=None,
+                expiry=None, jitter=0, sigcache=None, names=None):
+    """
+    Apply changes to a zone signed by sign_zone. Only the changed RR sets are
+    signed again and NSEC or NSEC3 chain (depending on how the zone was
+    signed) is updated incrementally.
+
+    Both add and delete are lists of RR sets (dns.rrset.RRset or (name,
+    rdataset) tuples). Deleting an empty RR set removes all the records of
+    the given type. DNSSEC records (RRSIG, NSEC, NSEC3, NSEC3PARAM) can't be
+    changed directly, they are maintained by this function.
+
+    The cost of an update depends on the size of the change, provided that
+    NameIndex of the NSEC/NSEC3 chain (see chain_index) and NameIndex of all
+    the names in the zone (see zone_names) are given as index and names.
+    Callers doing repeated updates should build them once and keep them;
+    otherwise they are built on every call, which takes time proportional
+    to the zone size. Both are kept up to date, as well as the given
+    ExpiryIndex. Signatures are made by the remote signer (SignerClient) if
+    given. Jitter of expiration times and SignatureCache are applied as in
+    sign_zone.
+
+    Returns (removed, added) tuple of lists of RR sets (dns.rrset.RRset)
+    describing all the changes made to the zone, including DNSSEC records.
+    """
+    zsk = _zone_signing_keys(keys)
+    if expiration is None:
+        expiration = time.time() + (3600 * 24 * 90) # 90 days from now
+    if inception is None:
+        inception = time.time() - (3600 * 24) # 1 day ago
+
+    journal = _ZoneJournal(zone)
+    touched = set()
+    delegation_changes = set()
+
+    # Apply changes to the zone data
+    for rrset, deleting in [(r, True) for r in (delete or [])] + \
+                           [(r, False) for r in (add or [])]:
+        if isinstance(rrset, tuple):
+            rrname = rrset[0]
+            rdataset = rrset[1]
+        else:
+            rrname = rrset.name
+            rdataset = rrset
+        rrname = rrname.derelativize(zone.origin)
+        if rdataset.rdtype in (dns.rdatatype.RRSIG, dns.rdatatype.NSEC,
+                               dns.rdatatype.NSEC3, dns.rdatatype.NSEC3PARAM):
+            raise ValueError("DNSSEC records can't be updated directly")
+        if rdataset.rdtype == dns.rdatatype.NS and rrname != zone.origin:
+            delegation_changes.add(rrname)
+        touched.add((rrname, rdataset.rdtype))
+
+        current = journal.find_rdataset(rrname, rdataset.rdtype,
+                                        rdataset.covers)
+        if deleting:
+            if len(rdataset):
+                for rdata in rdataset:
+                    current.discard(rdata)
+            else:
+                current.clear()
+        else:
+            for rdata in rdataset:
+                current.add(rdata)
+            current.ttl = rdataset.ttl
+        if not len(current):
+            journal.delete_rdataset(rrname, rdataset.rdtype, rdataset.covers)
+
+    # Collect names whose signatures or NSEC/NSEC3 records may change. If
+    # a delegation appears or disappears, the whole subtree is affected.
+    if names is None:
+        names = zone_names(zone)
+    affected = set(name for name, rdtype in touched)
+    _sync_names(zone, names, affected)
+    for name in delegation_changes:
+        affected.update(names.descendants(name))
+
+    # Re-sign changed RR sets and remove signatures from RR sets which are no
+    # longer authoritative (e.g. became glue)
+    view = _ZoneView(zone, lazy=True)
+    rrsets = []
+    for name in _canonical_order(affected):
+        node = zone.get_node(name) or []
+        rdtypes = set(r.rdtype for r in node)
+        for rdataset in list(node):
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                if rdataset.covers not in rdtypes:
+                    journal.delete_rdataset(name, dns.rdatatype.RRSIG,
+                                            rdataset.covers)
+                continue
+            if rdataset.rdtype in (dns.rdatatype.NSEC, dns.rdatatype.NSEC3):
+                continue
+            sigs = node.get_rdataset(rdataset.rdclass, dns.rdatatype.RRSIG,
+                                     rdataset.rdtype)
+            if not view.is_authoritative(name, rdataset.rdtype):
+                if sigs is not None:
+                    journal.delete_rdataset(name, dns.rdatatype.RRSIG,
+                                            rdataset.rdtype)
+            elif (name, rdataset.rdtype) in touched or sigs is None:
+                journal.delete_rdataset(name, dns.rdatatype.RRSIG,
+                                        rdataset.rdtype)
+                if rdataset.rdtype == dns.rdatatype.DNSKEY:
+                    rrsets.append((name, rdataset, keys))
+                else:
+                    rrsets.append((name, rdataset, zsk))
+
+    # Update the NSEC or NSEC3 chain
+    ttl = _get_minimum_ttl(zone)
+    if index is None:
+        index = chain_index(zone)
+    nsec3param = zone.get_rdataset(zone.origin, dns.rdatatype.NSEC3PARAM)
+    if nsec3param is not None:
+        changed = _update_nsec3(zone, journal, affected, nsec3param[0], ttl,
+                                index, view, names)
+    else:
+        changed = _update_nsec(zone, journal, affected, ttl, index, view)
+    for name, rdataset in changed:
+        journal.delete_rdataset(name, dns.rdatatype.RRSIG, rdataset.rdtype)
+        rrsets.append((name, rdataset, zsk))
+
+    # Sign
+    for rrname, rdataset, rrsig in _sign_rrsets(rrsets, keys, zone.origin,
+                                                expiration, inception, workers,
+                                                signer, jitter, sigcache):
+        rrsig_set = journal.find_rdataset(rrname, dns.rdatatype.RRSIG,
+                                          rdataset.rdtype)
+        rrsig_set.add(rrsig, ttl=rdataset.ttl)
+
+    removed, added = journal.diff()
+    _sync_names(zone, names, set(name for name, rdtype, covers
+                                 in journal.order))
+    if expiry is not None:
+        expiry.update(removed, added)
+    return removed, added
+
+
+def _update_nsec(zone, journal, affected, ttl, index, view):
+    """
+    Update NSEC chain after the given names were changed. Return list of
+    (name, rdataset) tuples of new or modified NSEC RR sets.
+    """
+    def member(name, node):
+        if view.is_occluded(name):
+            return False
+        return view.is_delegation(name) or \
+               any(view.is_authoritative(name, r.rdtype) for r in node
+                   if r.rdtype not in (dns.rdatatype.NSEC, dns.rdatatype.RRSIG))
+
+    names = set()
+    for name in affected:
+        if member(name, zone.get_node(name) or []):
+            index.add(name)
+            names.add(name)
+        elif name in index:
+            index.remove(name)
+            journal.delete_rdataset(name, dns.rdatatype.NSEC)
+            journal.delete_rdataset(name, dns.rdatatype.RRSIG,
+                                    dns.rdatatype.NSEC)
+
+    # Next name changes in NSEC records preceding the changed names
+    for name in affected:
+        names.add(index.predecessor(name))
+
+    changed = []
+    for name in _canonical_order(names):
+        rdataset = zone.get_rdataset(name, dns.rdatatype.NSEC)
+        present = [r.rdtype for r in zone.get_node(name) or []]
+        typemap = _rdtypes_to_bitmaps(list(_nsec_types(view.status(name),
+                                                       present)))
+        nsec = dns.rdtypes.ANY.NSEC.NSEC(dns.rdataclass.IN, dns.rdatatype.NSEC,
+                    index.successor(name), typemap)
+        if rdataset is not None and rdataset[0] == nsec:
+            continue
+        rdataset = journal.find_rdataset(name, dns.rdatatype.NSEC)
+        rdataset.clear()
+        rdataset.add(nsec, ttl=ttl)
+        changed.append((name, rdataset))
+    return changed
+
+
+def _update_nsec3(zone, journal, affected, param, ttl, index, view,
+                  zonenames):
+    """
+    Update NSEC3 chain after the given names were changed. Return list of
+    (name, rdataset) tuples of new or modified NSEC3 RR sets.
+    """
+    flags = NSEC3_FLAG_NONE
+    if len(index):
+        flags = zone.get_rdataset(index[0], dns.rdatatype.NSEC3)[0].flags
+    optout = flags & NSEC3_FLAG_OPTOUT
+
+    def member(name, node):
+        # Insecure delegations are left out of opt-out chain
+        if view.is_occluded(name):
+            return False
+        if optout and view.is_delegation(name) and \
+           node.get_rdataset(zone.rdclass, dns.rdatatype.DS) is None:
+            return False
+        return view.is_delegation(name) or \
+               any(view.is_authoritative(name, r.rdtype) for r in node
+                   if r.rdtype not in (dns.rdatatype.RRSIG,
+                                       dns.rdatatype.NSEC3))
+
+    # Empty non-terminals may appear or disappear above the changed names
+    names = set()
+    for name in affected:
+        while name.is_subdomain(zone.origin):
+            names.add(name)
+            if name == zone.origin:
+                break
+            name = name.parent()
+
+    # Find out which names belong to the chain
+    members = set()
+    occluded = set()
+    for name in names:
+        node = zone.get_node(name) or []
+        if view.is_occluded(name):
+            occluded.add(name)
+            continue
+        if member(name, node):
+            members.add(name)
+    candidates = names - members - occluded
+    for name in list(candidates):
+        for n in affected:
+            if n in members and n.is_subdomain(name):
+                members.add(name)
+                candidates.remove(name)
+                break
+    if candidates:
+        members.update(_has_descendants(zone, zonenames, candidates,
+                                        member))
+
+    updated = {}
+    owners = []
+    for name in names:
+        hashed = _nsec3_hash(name, zone.origin, param.salt, param.iterations)
+        owner = _nsec3_owner(hashed, zone.origin)
+        owners.append(owner)
+        if name in members:
+            index.add(owner)
+            updated[owner] = name
+        elif owner in index:
+            index.remove(owner)
+            journal.delete_rdataset(owner, dns.rdatatype.NSEC3)
+            journal.delete_rdataset(owner, dns.rdatatype.RRSIG,
+                                    dns.rdatatype.NSEC3)
+
+    # Next hash changes in NSEC3 records preceding the changed names
+    check = set(updated)
+    for owner in owners:
+        check.add(index.predecessor(owner))
+
+    changed = []
+    for owner in sorted(check, key=_nsec3_owner_hash):
+        rdataset = zone.get_rdataset(owner, dns.rdatatype.NSEC3)
+        if owner in updated:
+            name = updated[owner]
+            present = [r.rdtype for r in zone.get_node(name) or []]
+            typemap = _rdtypes_to_bitmaps(list(_nsec3_types(
+                                          view.status(name), present)))
+        else:
+            typemap = rdataset[0].windows
+        nexthash = _nsec3_owner_hash(index.successor(owner))
+        nsec3 = dns.rdtypes.ANY.NSEC3.NSEC3(dns.rdataclass.IN,
+                    dns.rdatatype.NSEC3, param.algorithm, flags,
+                    param.iterations, param.salt, nexthash, typemap)
+        if rdataset is not None and rdataset[0] == nsec3:
+            continue
+        rdataset = journal.find_rdataset(owner, dns.rdatatype.NSEC3)
+        rdataset.clear()
+        rdataset.add(nsec3, ttl=ttl)
+        changed.append((owner, rdataset))
+    return changed
+
+
+class VerificationReport(object):
+    """
+    Result of verify_zone. Errors are (name, rdtype, message) tuples, sorted
+    in canonical order of names. Numbers of checked authoritative RR sets and
+    signatures are counted as well.
+    """
+    def __init__(self):
+        self.errors = []
+        self.rrsets = 0
+        self.signatures = 0
+
+    def error(self, name, rdtype, message):
+        self.errors.append((name, rdtype, message))
+
+    def valid(self):
+        """
+        Test if the zone passed all the checks
+        """
+        return not self.errors
+
+    def to_text(self):
+        """
+        Format the errors one per line, followed by a summary line
+        """
+        lines = ['%s %s: %s' % (name, dns.rdatatype.to_text(rdtype), message)
+                 for name, rdtype, message in self.errors]
+        lines.append('%d RR sets, %d signatures checked, %d errors' %
+                     (self.rrsets, self.signatures, len(self.errors)))
+        return '\n'.join(lines)
+
+
+# Public keys of a verification worker process, see _verify_worker_init
+_worker_verifiers = None
+
+def _verify_worker_init(verifiers):
+    """
+    Initialize a verification worker process: public keys are transferred
+    only once per process, not with every task.
+    """
+    global _worker_verifiers
+    _worker_verifiers = verifiers
+
+
+def _verify_signed_data(verifiers, algorithm, data, signature):
+    """
+    Test if any of the given verifiers accepts the signature of the data
+    """
+    digest = _hash_module(algorithm).new(data).digest()
+    for verifier in verifiers:
+        if verifier.verify(digest, signature):
+            return True
+    return False
+
+
+def _verify_worker(task):
+    """
+    Verify signature in a worker process. Task is a ((algorithm, key tag),
+    data, signature) tuple.
+    """
+    index, data, signature = task
+    return _verify_signed_data(_worker_verifiers[index], index[0], data,
+                               signature)
+
+
+def verify_zone(zone, now=None, workers=None):
+    """
+    Verify a zone signed by sign_zone, similarly to dnssec-verify: every
+    signature is validated (the same way as by validate_rrsig, not by the
+    signing code) against DNSKEY records at the zone apex, every
+    authoritative RR set must be signed by all the key algorithms, and
+    NSEC or NSEC3 chain must be complete, correctly ordered and its type
+    bitmaps must match the node contents.
+
+    All the problems found are collected in the returned VerificationReport.
+    If workers > 1, signatures are verified (and NSEC3 owner names hashed)
+    by a pool of processes.
+    """
+    report = VerificationReport()
+    origin = zone.origin
+    if now is None:
+        now = time.time()
+
+    dnskeys = zone.get_rdataset(origin, dns.rdatatype.DNSKEY)
+    if dnskeys is None:
+        report.error(origin, dns.rdatatype.DNSKEY, 'no DNSKEY at zone apex')
+        return report
+    verifiers = {}
+    for rdata in dnskeys:
+        if not _is_supported(rdata.algorithm):
+            report.error(origin, dns.rdatatype.DNSKEY,
+                         'unsupported algorithm %s of key %d' %
+                         (algorithm_to_text(rdata.algorithm), key_id(rdata)))
+            continue
+        index = (rdata.algorithm, key_id(rdata))
+        try:
+            verifiers.setdefault(index, []).append(_verifier(rdata))
+        except ValidationFailure, e:
+            report.error(origin, dns.rdatatype.DNSKEY,
+                         '%s (key %d)' % (e, index[1]))
+    algorithms = set(algorithm for algorithm, tag in verifiers)
+
+    # Collect signatures to be verified
+    view = _ZoneView(zone)
+    rrsets = []
+    checks = []
+    tasks = []
+    for name, node in zone.nodes.iteritems():
+        name = name.derelativize(origin)
+        # Hashed owner names of NSEC3 chain are not part of the view
+        node, status = view.nodes.get(name, (node, _AUTHORITATIVE))
+        # An in-memory zone may hold more RRSIG rdatasets of one type
+        signatures = {}
+        for rdataset in node:
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                signatures.setdefault(rdataset.covers, []).append(rdataset)
+                if node.get_rdataset(zone.rdclass, rdataset.covers) is None:
+                    report.error(name, rdataset.covers,
+                                 'signature of nonexistent RR set')
+        for rdataset in node:
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                continue
+            rrsig_sets = signatures.get(rdataset.rdtype, [])
+            rrsigs = [rrsig for rrsig_set in rrsig_sets for rrsig in rrsig_set]
+            if status == _GLUE or (status == _DELEGATION and
+                                   rdataset.rdtype not in _DELEGATION_TYPES):
+                if rrsigs:
+                    report.error(name, rdataset.rdtype,
+                                 'non-authoritative data signed')
+                continue
+            report.rrsets += 1
+            if not rrsigs:
+                report.error(name, rdataset.rdtype, 'missing signature')
+                continue
+            if len(rrsig_sets) > 1:
+                report.error(name, rdataset.rdtype,
+                             'signatures split in %d RRSIG RR sets' %
+                             len(rrsig_sets))
+            rrsets.append((name, rdataset.rdtype))
+            for rrsig in rrsigs:
+                report.signatures += 1
+                index = (rrsig.algorithm, rrsig.key_tag)
+                if index not in verifiers or \
+                   rrsig.signer.derelativize(origin) != origin:
+                    message = 'unknown key %d' % rrsig.key_tag
+                elif rrsig.expiration < now:
+                    message = 'signature by key %d expired' % rrsig.key_tag
+                elif rrsig.inception > now:
+                    message = 'signature by key %d not yet valid' % \
+                              rrsig.key_tag
+                else:
+                    tasks.append((index, _validation_signed_data(rrsig,
+                                    name, rdataset, origin), rrsig.signature))
+                    checks.append((len(rrsets) - 1, index))
+                    continue
+                report.error(name, rdataset.rdtype, message)
+
+    # Verify the signatures
+    signed = [set() for rrset in rrsets]
+    pool = None
+    if workers and workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(workers, _verify_worker_init, (verifiers,))
+        chunksize = max(1, min(256, len(tasks) // (workers * 4)))
+        results = pool.imap(_verify_worker, tasks, chunksize)
     else:
-        add_nsec(zone)
+        results = (_verify_signed_data(verifiers[index], index[0], data, sig)
+                   for index, data, sig in tasks)
+    try:
+        for (i, (algorithm, tag)), valid in itertools.izip(checks, results):
+            if valid:
+                signed[i].add(algorithm)
+            else:
+                name, rdtype = rrsets[i]
+                report.error(name, rdtype, 'invalid signature by key %d' % tag)
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    for (name, rdtype), algs in itertools.izip(rrsets, signed):
+        for algorithm in sorted(algorithms - algs):
+            report.error(name, rdtype, 'no valid signature by algorithm %s' %
+                         algorithm_to_text(algorithm))
+
+    # Verify NSEC / NSEC3 chain
+    if zone.get_rdataset(origin, dns.rdatatype.NSEC3PARAM) is not None:
+        _verify_nsec3(zone, view, report, workers)
+    else:
+        _verify_nsec(zone, view, report)
 
-    # Sign the DNSKEY records with all keys
-    rrsig_set = zone.find_rdataset(zone.origin, rdtype=dns.rdatatype.RRSIG, 
-                                   create=True)
-    for key in keys:
-        rrsig = sign_rrset((zone.origin, dnskey_set), key, zone.origin, 
-                           expiration, inception)
-        rrsig_set.add(rrsig, ttl=dnskey_set.ttl)
+    report.errors.sort(key=lambda e: (_canonical_key(e[0]), e[1], e[2]))
+    return report
 
-    # Sign other RRs 
-    delegations = _get_delegations(zone)
-    for rrname, rdataset in zone.iterate_rdatasets():
-        # DNSKEY are already signed, do not sign again 
-        if rdataset.rdtype == dns.rdatatype.DNSKEY:
-            continue
-        # RRSIG records MUST NOT be signed (RFC-4035, section 2.2.)
-        if rdataset.rdtype == dns.rdatatype.RRSIG:
+
+def _verify_nsec(zone, view, report):
+    """
+    Check that NSEC chain of the zone matches the given view
+    """
+    names = NameIndex(view.members())
+    for name in names:
+        rdataset = zone.get_rdataset(name, dns.rdatatype.NSEC)
+        if rdataset is None:
+            report.error(name, dns.rdatatype.NSEC, 'missing NSEC')
             continue
-        # Delegations and respective glue records MUST NOT be signed 
-        # (RFC-4035, section 2.2.)
-        if not _is_authoritative(rrname, rdataset, zone, delegations):
+        nsec = rdataset[0]
+        expected = names.successor(name)
+        if nsec.next.derelativize(zone.origin) != expected:
+            report.error(name, dns.rdatatype.NSEC,
+                         'next name %s, expected %s' % (nsec.next, expected))
+        if list(nsec.windows) != list(view.nsec_bitmap(name)):
+            report.error(name, dns.rdatatype.NSEC, 'type bitmap mismatch')
+    for name, rdataset in zone.iterate_rdatasets(dns.rdatatype.NSEC):
+        name = name.derelativize(zone.origin)
+        if name not in names:
+            report.error(name, dns.rdatatype.NSEC, 'NSEC at name out of chain')
+
+
+def _verify_nsec3(zone, view, report, workers=None):
+    """
+    Check that NSEC3 chain of the zone matches the given view
+    """
+    param = zone.get_rdataset(zone.origin, dns.rdatatype.NSEC3PARAM)[0]
+    records = {}
+    for owner, rdataset in zone.iterate_rdatasets(dns.rdatatype.NSEC3):
+        records[owner.derelativize(zone.origin)] = rdataset[0]
+    optout = any(r.flags & NSEC3_FLAG_OPTOUT for r in records.itervalues())
+
+    try:
+        hashed_names = _hashed_order(view.nsec3_members(optout), zone.origin,
+                                     param.salt, param.iterations, workers)
+    except NSEC3Collision:
+        report.error(zone.origin, dns.rdatatype.NSEC3PARAM,
+                     'hash collision, zone must be signed with another salt')
+        return
+
+    owners = set()
+    for i, (name, hashed) in enumerate(hashed_names):
+        owner = _nsec3_owner(hashed, zone.origin)
+        owners.add(owner)
+        nsec3 = records.get(owner)
+        if nsec3 is None:
+            report.error(name, dns.rdatatype.NSEC3, 'missing NSEC3 %s' % owner)
             continue
-        rrsig_set = zone.find_rdataset(rrname, rdtype=dns.rdatatype.RRSIG, 
-                                       create=True)
-        for key in zsk:
-            rrsig = sign_rrset((rrname, rdataset), key, zone.origin,expiration, 
-                               inception)
-            rrsig_set.add(rrsig, ttl=rdataset.ttl)
+        if (nsec3.algorithm, nsec3.iterations, nsec3.salt) != \
+           (param.algorithm, param.iterations, param.salt):
+            report.error(owner, dns.rdatatype.NSEC3,
+                         'parameters differ from NSEC3PARAM')
+        if (nsec3.flags & NSEC3_FLAG_OPTOUT) != optout:
+            report.error(owner, dns.rdatatype.NSEC3,
+                         'inconsistent opt-out flag')
+        if nsec3.next != hashed_names[(i+1) % len(hashed_names)][1]:
+            report.error(owner, dns.rdatatype.NSEC3, 'wrong next hashed name')
+        if list(nsec3.windows) != list(view.nsec3_bitmap(name)):
+            report.error(owner, dns.rdatatype.NSEC3, 'type bitmap mismatch')
+    for owner in records:
+        if owner not in owners:
+            report.error(owner, dns.rdatatype.NSEC3,
+                         'NSEC3 not matching any name in chain')
 
 
 def sigs_expire_before(zone, limit):
@@ -788,6 +2895,189 @@ def sigs_expire_before(zone, limit):
     return False
 
 
+class ExpiryIndex(object):
+    """
+    Index of RRSIG expiration times of a zone, for scheduling of signature
+    refreshes without scanning the zone. Signatures are identified by owner
+    name, covered type, algorithm and key tag; adding a signature with the
+    same identity replaces the previous one.
+
+    The index is built from a zone (from_zone) or while signing: sign_zone,
+    resign_zone and update_zone keep the index given as expiry argument up
+    to date. Replaced entries are left in the heap and skipped lazily; the
+    heap is compacted when they prevail.
+    """
+    DAY = 3600 * 24
+
+    def __init__(self):
+        self._current = {}
+        self._heap = []
+        self._days = {}
+
+    @classmethod
+    def from_zone(cls, zone):
+        """
+        Build the index of all signatures in the given zone (names are kept
+        absolute)
+        """
+        index = cls()
+        for name, node in zone.nodes.iteritems():
+            name = name.derelativize(zone.origin)
+            for rdataset in node:
+                if rdataset.rdtype == dns.rdatatype.RRSIG:
+                    for rrsig in rdataset:
+                        index.add(name, rrsig)
+        return index
+
+    def __len__(self):
+        return len(self._current)
+
+    def _count(self, expiration, delta):
+        day = expiration // self.DAY
+        count = self._days.get(day, 0) + delta
+        if count:
+            self._days[day] = count
+        else:
+            del self._days[day]
+
+    def add(self, name, rrsig):
+        """
+        Add (or replace) the given RRSIG record of the given owner name
+        """
+        key = (name, rrsig.covers(), rrsig.algorithm, rrsig.key_tag)
+        old = self._current.get(key)
+        if old == rrsig.expiration:
+            return
+        if old is not None:
+            self._count(old, -1)
+        self._current[key] = rrsig.expiration
+        self._count(rrsig.expiration, 1)
+        heapq.heappush(self._heap, (rrsig.expiration, key))
+        if len(self._heap) > 2 * len(self._current) + 1024:
+            self._heap = [(e, k) for k, e in self._current.iteritems()]
+            heapq.heapify(self._heap)
+
+    def remove(self, name, rrsig):
+        """
+        Remove the given RRSIG record of the given owner name (if indexed)
+        """
+        key = (name, rrsig.covers(), rrsig.algorithm, rrsig.key_tag)
+        old = self._current.pop(key, None)
+        if old is not None:
+            self._count(old, -1)
+
+    def update(self, removed, added):
+        """
+        Apply changes of RR sets, e.g. as returned by update_zone. RRSIG
+        records of the removed RR sets are removed, the added ones added.
+        """
+        for rrset in removed:
+            if rrset.rdtype == dns.rdatatype.RRSIG:
+                for rrsig in rrset:
+                    self.remove(rrset.name, rrsig)
+        for rrset in added:
+            if rrset.rdtype == dns.rdatatype.RRSIG:
+                for rrsig in rrset:
+                    self.add(rrset.name, rrsig)
+
+    def earliest(self):
+        """
+        Get the earliest expiration time or None if there are no signatures
+        """
+        heap = self._heap
+        while heap:
+            expiration, key = heap[0]
+            if self._current.get(key) == expiration:
+                return expiration
+            heapq.heappop(heap)
+        return None
+
+    def histogram(self, days, now=None):
+        """
+        Get list of numbers of signatures expiring in each of the given
+        number of days from now. Signatures already expired are counted in
+        the first day.
+        """
+        if now is None:
+            now = time.time()
+        first = int(now) // self.DAY
+        counts = [0] * days
+        for day, count in self._days.iteritems():
+            if day < first + days:
+                counts[max(0, day - first)] += count
+        return counts
+
+    def due(self, before):
+        """
+        Get list of (name, covered type) RR sets having a signature expiring
+        before the given time, ordered by the earliest expiration.
+        """
+        heap = self._heap
+        found = []
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            if i >= len(heap) or heap[i][0] >= before:
+                continue
+            expiration, key = heap[i]
+            if self._current.get(key) == expiration:
+                found.append((expiration, key[0], key[1]))
+            stack.append(2 * i + 1)
+            stack.append(2 * i + 2)
+        found.sort()
+        ret = []
+        seen = set()
+        for expiration, name, covers in found:
+            if (name, covers) not in seen:
+                seen.add((name, covers))
+                ret.append((name, covers))
+        return ret
+
+    def first(self, count):
+        """
+        Get list of (name, covered type) of at most count RR sets having the
+        earliest expiring signatures, ordered by expiration
+        """
+        heap = self._heap
+        ret = []
+        seen = set()
+        # Best-first walk of the heap tree
+        frontier = heap and [(heap[0], 0)] or []
+        while frontier and len(ret) < count:
+            (expiration, key), i = heapq.heappop(frontier)
+            if self._current.get(key) == expiration and \
+               key[:2] not in seen:
+                seen.add(key[:2])
+                ret.append(key[:2])
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+        return ret
+
+
+def plan_refresh(expiry, budget, refresh_before, interval=3600 * 24,
+                 now=None):
+    """
+    Plan which RR sets to sign again in this run of periodic signing, to
+    spread the signing load evenly instead of refreshing the whole zone at
+    once. Given ExpiryIndex of the zone and budget (number of RR sets to be
+    signed per run), the RR sets with the earliest expiring signatures are
+    chosen. RR sets whose signatures would expire within refresh_before
+    seconds before the next run (in interval seconds) are always included,
+    even if over budget.
+
+    Return set of (name, covered type) tuples, to be passed as rrsets
+    argument of resign_zone. A budget of about the number of RR sets divided
+    by the number of runs per signature validity period gives flat load.
+    """
+    if now is None:
+        now = time.time()
+    due = expiry.due(now + interval + refresh_before)
+    if len(due) >= budget:
+        return set(due)
+    return set(expiry.first(budget))
+
+
 def signed(zone):
     """
     Test if a zone is signed. Currently, it only checks if there are any DNSKEY
@@ -798,28 +3088,36 @@ def signed(zone):
 
 def unsign_zone(zone):
     """
-    Remove all DNSSEC records from the given zone 
+    Remove all DNSSEC records from the given zone. Nodes are rewritten in
+    place in a single pass; nodes left empty (e.g. NSEC3 owner names) are
+    removed.
     """
-    rdatasets = []
-    for item in zone.iterate_rdatasets():
-        rdatasets.append(item)
-
-    # Remove signatures
-    for rrname, rdataset in rdatasets:
-        if rdataset.rdtype != dns.rdatatype.RRSIG:
-            zone.delete_rdataset(rrname, rdtype=dns.rdatatype.RRSIG, 
-                                 covers=rdataset.rdtype)
-
-    # Remove NSEC/NSEC3
-    for rrname, rdataset in rdatasets:
-        if rdataset.rdtype in (dns.rdatatype.NSEC, dns.rdatatype.NSEC3):
-            zone.delete_rdataset(rrname, rdtype=rdataset.rdtype)
-
-    # Remove NSEC3PARAM
-    zone.delete_rdataset(zone.origin, rdtype=dns.rdatatype.NSEC3PARAM)
+    if zone.relativize:
+        apex = dns.name.empty
+    else:
+        apex = zone.origin
+    dnssec_types = (dns.rdatatype.RRSIG, dns.rdatatype.NSEC,
+                    dns.rdatatype.NSEC3)
+    apex_types = dnssec_types + (dns.rdatatype.NSEC3PARAM,
+                                 dns.rdatatype.DNSKEY)
+
+    empty = []
+    for name, node in zone.nodes.iteritems():
+        if name == apex:
+            types = apex_types
+        else:
+            types = dnssec_types
+        rdatasets = [rdataset for rdataset in node.rdatasets
+                     if rdataset.rdtype not in types]
+        if len(rdatasets) == len(node.rdatasets):
+            continue
+        if rdatasets or name == apex:
+            node.rdatasets[:] = rdatasets
+        else:
+            empty.append(name)
 
-    # Remove DNSKEYs
-    zone.delete_rdataset(zone.origin, rdtype=dns.rdatatype.DNSKEY)
+    for name in empty:
+        del zone.nodes[name]
 
     return zone
 
@@ -838,6 +3136,23 @@ def _rsa2dnskey(key):
     return octets
 
 
+def _dnskey2dsa(keyptr):
+    """
+    Get DSA public key (q, p, g, y) from DNSKEY resource record (RFC-2536)
+    """
+    (t,) = struct.unpack('!B', keyptr[0:1])
+    keyptr = keyptr[1:]
+    octets = 64 + t * 8
+    dsa_q = keyptr[0:20]
+    keyptr = keyptr[20:]
+    dsa_p = keyptr[0:octets]
+    keyptr = keyptr[octets:]
+    dsa_g = keyptr[0:octets]
+    keyptr = keyptr[octets:]
+    dsa_y = keyptr[0:octets]
+    return (dsa_q, dsa_p, dsa_g, dsa_y)
+
+
 def _dnskey2rsa(keyptr):
     (b,) = struct.unpack('!B', keyptr[0:1]) 
     keyptr = keyptr[1:]
@@ -861,6 +3176,12 @@ Exponent2: %(dmq1)s
 Coefficient: %(u)s
 """
 
+_file_privkey_ec = \
+"""Private-key-format: v1.2
+Algorithm: %(alg)d (%(algtxt)s)
+PrivateKey: %(key)s
+"""
+
 class PrivateDNSKEY(dns.rdtypes.ANY.DNSKEY.DNSKEY):
     """
     Adds a private key field and methods to DNSKEY. Used for signature
@@ -872,19 +3193,23 @@ class PrivateDNSKEY(dns.rdtypes.ANY.DNSKEY.DNSKEY):
     
     @classmethod
     def generate(cls, flags, algorithm, bits=None, rdclass=dns.rdataclass.IN,
-                 rdtype=dns.rdatatype.DNSKEY, protocol=3):
+                 rdtype=dns.rdatatype.DNSKEY, protocol=3, pool=None):
         """
-        Generate a new DNSKEY keypair
+        Generate a new DNSKEY keypair. If KeyPool is given, a pre-generated
+        key is taken from it when available.
         """
-        if _is_rsa(algorithm):
-            if not isinstance(bits, (int, long)):
-                raise ValidationFailure("For RSA key generation, key size in "
-                                        "bits must be provided")
-            key = Crypto.PublicKey.RSA.generate(bits)
-            private = key.exportKey(format='PEM')
-            public = _rsa2dnskey(key)
-        else:
+        if _is_rsa(algorithm) and not isinstance(bits, (int, long)):
+            raise ValidationFailure("For RSA key generation, key size in "
+                                    "bits must be provided")
+        backend = _backend_for(algorithm)
+        if backend is None:
             raise ValidationFailure("Unknown algorithm %d" % algorithm)
+        keypair = None
+        if pool is not None:
+            keypair = pool.take(algorithm, bits)
+        if keypair is None:
+            keypair = backend.generate(algorithm, bits)
+        private, public = keypair
 
         return cls(flags, algorithm, public, private, rdclass, rdtype,protocol)
 
@@ -895,6 +3220,29 @@ class PrivateDNSKEY(dns.rdtypes.ANY.DNSKEY.DNSKEY):
                                             algorithm, key)
         self.privkey = privkey
         self._tag = None
+        self._context = None
+
+    def __getstate__(self):
+        # Signing context holds native key objects, which can't be pickled.
+        # It is rebuilt on first use after unpickling (e.g. in worker process).
+        state = self.__dict__.copy()
+        state['_context'] = None
+        slots = dict((s, getattr(self, s)) for s in ('rdclass', 'rdtype',
+                     'flags', 'protocol', 'algorithm', 'key'))
+        return (state, slots)
+
+    def signing_context(self):
+        """
+        Get the parsed private key prepared for signing. It is created on
+        first use only, and again when another backend is selected.
+        """
+        backend = _backend_for(self.algorithm)
+        if backend is None:
+            raise ValidationFailure("Unsupported algorithm %d" %
+                                    self.algorithm)
+        if self._context is None or self._context[0] is not backend:
+            self._context = (backend, backend.signer(self))
+        return self._context[1]
 
     def get_pubkey(self):
         """
@@ -918,6 +3266,10 @@ class PrivateDNSKEY(dns.rdtypes.ANY.DNSKEY.DNSKEY):
         if _is_rsa(self.algorithm): 
             (rsa_e,rsa_n) = _dnskey2rsa(self.key)
             return len(rsa_n)*8
+        elif _is_ecdsa(self.algorithm):
+            return len(self.key) * 4
+        elif _is_eddsa(self.algorithm):
+            return len(self.key) * 8
         else:
             raise ValidationFailure("Unknown algorithm %d" % self.algorithm)
 
@@ -925,21 +3277,38 @@ class PrivateDNSKEY(dns.rdtypes.ANY.DNSKEY.DNSKEY):
         """
         Export this key to a private key file compatible with bind tools
         """
-        if not _is_rsa(self.algorithm):
+        if not (_is_rsa(self.algorithm) or _is_ecdsa(self.algorithm) or
+                _is_eddsa(self.algorithm)):
             raise ValidationFailure("Unknown algorithm %d" % self.algorithm)
 
         # Prepare key data
-        key = Crypto.PublicKey.RSA.importKey(self.privkey)
         keydata = dict(alg=self.algorithm,
                        algtxt=algorithm_to_text(self.algorithm))
-        for field in key.keydata:
-            f = getattr(key, field)
-            f = Crypto.Util.number.long_to_bytes(f)
-            keydata[field] = base64.b64encode(f)
-        dmp1 = Crypto.Util.number.long_to_bytes(key.d % (key.p - 1))
-        keydata['dmp1'] = base64.b64encode(dmp1)
-        dmq1 = Crypto.Util.number.long_to_bytes(key.d % (key.p - 1))
-        keydata['dmq1'] = base64.b64encode(dmq1)
+        if not _is_rsa(self.algorithm):
+            key = serialization.load_pem_private_key(self.privkey, None,
+                                                     default_backend())
+        if _is_ecdsa(self.algorithm):
+            d = key.private_numbers().private_value
+            d = Crypto.Util.number.long_to_bytes(d, len(self.key) // 2)
+            keydata['key'] = base64.b64encode(d)
+            template = _file_privkey_ec
+        elif _is_eddsa(self.algorithm):
+            d = key.private_bytes(serialization.Encoding.Raw,
+                                  serialization.PrivateFormat.Raw,
+                                  serialization.NoEncryption())
+            keydata['key'] = base64.b64encode(d)
+            template = _file_privkey_ec
+        else:
+            key = Crypto.PublicKey.RSA.importKey(self.privkey)
+            for field in key.keydata:
+                f = getattr(key, field)
+                f = Crypto.Util.number.long_to_bytes(f)
+                keydata[field] = base64.b64encode(f)
+            dmp1 = Crypto.Util.number.long_to_bytes(key.d % (key.p - 1))
+            keydata['dmp1'] = base64.b64encode(dmp1)
+            dmq1 = Crypto.Util.number.long_to_bytes(key.d % (key.q - 1))
+            keydata['dmq1'] = base64.b64encode(dmq1)
+            template = _file_privkey_rsa
 
         # Write to file
         if file:
@@ -950,5 +3319,1167 @@ class PrivateDNSKEY(dns.rdtypes.ANY.DNSKEY.DNSKEY):
             if directory:
                 fname = "%s/%s" % (directory, fname)
         fd = open(fname, 'w')
-        fd.write(_file_privkey_rsa % keydata)
+        fd.write(template % keydata)
         fd.close()
+
+
+# Key files of KeyPool: public key line followed by the private key in PEM
+_KEY_FILE_PUBLIC = 'Public: '
+
+def _read_key_file(data):
+    """
+    Parse (private, public) keypair from a KeyPool key file
+    """
+    line, private = data.split('\n', 1)
+    if not line.startswith(_KEY_FILE_PUBLIC) or \
+       not private.startswith('-----BEGIN '):
+        raise ValueError('invalid key file')
+    try:
+        public = base64.b64decode(line[len(_KEY_FILE_PUBLIC):])
+    except TypeError:
+        raise ValueError('invalid key file')
+    return private, public
+
+
+def _private_directory(path):
+    """
+    Create the given directory accessible by the owner only, or check that
+    an existing one is owned by the current user and not accessible by
+    others. Raise ValueError otherwise.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path, 0700)
+        # makedirs mode is subject to umask
+        os.chmod(path, 0700)
+    st = os.stat(path)
+    if st.st_uid != os.geteuid() or stat.S_IMODE(st.st_mode) & 0077:
+        raise ValueError('%s must be owned by the current user and not '
+                         'accessible by others' % path)
+
+
+def _key_worker_init():
+    """
+    Initialize a key generation worker process
+    """
+    Crypto.Random.atfork()
+
+
+def _key_worker(directory, algorithm, bits):
+    """
+    Generate a keypair in a worker process and store it to the directory.
+    The file is written under a temporary name and renamed when complete, so
+    that partially written keys are never taken. Return error message or
+    None.
+    """
+    try:
+        private, public = _backend_for(algorithm).generate(algorithm, bits)
+        name = os.urandom(8).encode('hex')
+        tmpname = os.path.join(directory, '.%s.tmp' % name)
+        fd = os.fdopen(os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                               0600), 'wb')
+        try:
+            fd.write(_KEY_FILE_PUBLIC + base64.b64encode(public) + '\n')
+            fd.write(private)
+            fd.flush()
+            os.fsync(fd.fileno())
+        finally:
+            fd.close()
+        os.rename(tmpname, os.path.join(directory, name + '.key'))
+    except Exception as e:
+        return '%s: %s' % (e.__class__.__name__, e)
+
+
+class KeyPool(object):
+    """
+    Pool of pre-generated keys stored in a directory, one subdirectory for
+    each (algorithm, bits) profile. Keys are generated in background by a
+    pool of worker processes, so that PrivateDNSKEY.generate(..., pool=pool)
+    returns instantly; the pool is refilled to the given size asynchronously
+    after every key taken. Files are readable by the owner only.
+
+    The directory can be shared by more processes of the same user, each key
+    is taken only once. Existing directories accessible by other users are
+    refused. Failures of background generation are collected in errors;
+    if no key is finished for timeout seconds (e.g. a worker died), the
+    pending generations are given up.
+    """
+    def __init__(self, directory, profiles, size=4, workers=1, timeout=600):
+        self.directory = directory
+        self.profiles = [(algorithm, bits) for algorithm, bits in profiles]
+        self.size = size
+        self.timeout = timeout
+        self.errors = []
+        # Started generations: task number -> profile
+        self._pending = {}
+        self._tasks = itertools.count()
+        self._progress = time.time()
+        self._cond = threading.Condition()
+        _private_directory(directory)
+        for profile in self.profiles:
+            _private_directory(self._path(*profile))
+        self._pool = multiprocessing.Pool(workers, _key_worker_init)
+
+    def _path(self, algorithm, bits):
+        return os.path.join(self.directory, '%d-%d' % (algorithm, bits or 0))
+
+    def _keys(self, algorithm, bits):
+        return [name for name in os.listdir(self._path(algorithm, bits))
+                if name.endswith('.key')]
+
+    def available(self, algorithm, bits=None):
+        """
+        Get number of ready keys of the given profile
+        """
+        return len(self._keys(algorithm, bits))
+
+    def take(self, algorithm, bits=None):
+        """
+        Take a ready (private, public) keypair of the given profile and start
+        refilling the pool. Return None if there's no key ready or the
+        profile is not maintained by the pool.
+        """
+        profile = (algorithm, bits)
+        if profile not in self.profiles:
+            return None
+        keypair = None
+        path = self._path(algorithm, bits)
+        for name in self._keys(algorithm, bits):
+            filename = os.path.join(path, name)
+            try:
+                fd = open(filename, 'rb')
+                data = fd.read()
+                fd.close()
+                # Whoever removes the file owns the key
+                os.unlink(filename)
+            except (IOError, OSError) as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            keypair = _read_key_file(data)
+            break
+        self.fill()
+        return keypair
+
+    def _done(self, task, error):
+        with self._cond:
+            # Generations given up are ignored
+            if self._pending.pop(task, None) is not None:
+                self._progress = time.time()
+                if error is not None:
+                    self.errors.append(error)
+            self._cond.notify_all()
+
+    def _expire(self):
+        if self._pending and time.time() - self._progress > self.timeout:
+            self.errors.append('no key generated in %d seconds, %d pending '
+                               'given up' % (self.timeout, len(self._pending)))
+            self._pending.clear()
+
+    def fill(self, wait=False):
+        """
+        Start generation of keys missing in the pool. With wait, block until
+        they are generated.
+        """
+        with self._cond:
+            self._expire()
+            if not self._pending:
+                self._progress = time.time()
+            for profile in self.profiles:
+                missing = self.size - self.available(*profile) - \
+                          self._pending.values().count(profile)
+                for i in xrange(max(0, missing)):
+                    task = self._tasks.next()
+                    self._pending[task] = profile
+                    self._pool.apply_async(_key_worker,
+                        (self._path(*profile),) + profile,
+                        callback=lambda r, t=task: self._done(t, r))
+        if wait:
+            self.wait()
+
+    def wait(self, timeout=None):
+        """
+        Wait until all the started key generations finish or are given up.
+        Return False if the given timeout expired first.
+        """
+        end = timeout is not None and time.time() + timeout
+        with self._cond:
+            while True:
+                self._expire()
+                if not self._pending:
+                    return True
+                if end and time.time() >= end:
+                    return False
+                self._cond.wait(1)
+
+    def close(self):
+        """
+        Stop the worker processes, unfinished keys are dropped
+        """
+        self._pool.terminate()
+        self._pool.join()
+
+
+class Job(object):
+    """
+    Computation running in a background thread, so that the caller (e.g. an
+    event loop) is not blocked. The work is done in chunks; progress is
+    reported and cancellation is checked between them. Create jobs by
+    sign_zone_job, validate_job or generate_job.
+
+    Optional callback is called with the job (from the background thread)
+    when the job finishes, e.g. to wake up an event loop.
+    """
+    def __init__(self, function, args=(), callback=None):
+        self._function = function
+        self._args = args
+        self._callback = callback
+        self._cancelled = False
+        self._finished = threading.Event()
+        self._result = None
+        self._error = None
+        self.progress = (0, None)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self._result = self._function(self, *self._args)
+        except BaseException:
+            # Kept with the traceback, to be re-raised by result()
+            self._error = sys.exc_info()
+        self._finished.set()
+        if self._callback is not None:
+            self._callback(self)
+
+    def checkpoint(self, done, total=None):
+        """
+        Report progress of the job (called by the job function). Raises
+        JobCancelled if the job was cancelled.
+        """
+        self.progress = (done, total)
+        if self._cancelled:
+            raise JobCancelled()
+
+    def cancel(self):
+        """
+        Request cancellation, the job stops at the next checkpoint
+        """
+        self._cancelled = True
+
+    def cancelled(self):
+        return self._finished.is_set() and self._error is not None and \
+               isinstance(self._error[1], JobCancelled)
+
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the job finishes. Return True if it did.
+        """
+        self._finished.wait(timeout)
+        return self._finished.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the job and return its result or raise its exception
+        (JobCancelled if cancelled)
+        """
+        if not self.wait(timeout):
+            raise dns.exception.Timeout()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+
+class _JobStats(SigningStats):
+    """
+    SigningStats reporting signing progress to a job every chunk signatures
+    """
+    def __init__(self, job, chunk):
+        SigningStats.__init__(self)
+        self.job = job
+        self.chunk = chunk
+
+    def signed(self, rrsig):
+        SigningStats.signed(self, rrsig)
+        if self.signatures % self.chunk == 0:
+            self.job.checkpoint(self.signatures, self.total)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.job.checkpoint(self.signatures, self.total or None)
+        with SigningStats.phase(self, name):
+            yield
+
+
+# Types of records added to a zone by sign_zone
+_DNSSEC_TYPES = (dns.rdatatype.DNSKEY, dns.rdatatype.RRSIG, dns.rdatatype.NSEC,
+                 dns.rdatatype.NSEC3, dns.rdatatype.NSEC3PARAM)
+
+def _dnssec_rdatasets(zone):
+    """
+    Get names of all nodes in the zone and copies of all DNSSEC RR sets as
+    (name, rdataset) tuples
+    """
+    return set(zone.nodes), \
+           [(name, rdataset.copy()) for name, node in zone.nodes.iteritems()
+            for rdataset in node.rdatasets if rdataset.rdtype in _DNSSEC_TYPES]
+
+
+def _restore_dnssec_rdatasets(zone, saved):
+    """
+    Replace all DNSSEC RR sets in the zone by the saved ones and remove
+    nodes created since
+    """
+    names, rdatasets = saved
+    for name, node in zone.nodes.items():
+        node.rdatasets[:] = [rdataset for rdataset in node.rdatasets
+                             if rdataset.rdtype not in _DNSSEC_TYPES]
+        if not node.rdatasets and name not in names:
+            del zone.nodes[name]
+    for name, rdataset in rdatasets:
+        zone.replace_rdataset(name, rdataset)
+
+
+def _sign_zone_job(job, zone, keys, chunk, kwargs):
+    stats = _JobStats(job, chunk)
+    # DNSSEC records present before, the zone is restored if signing fails
+    saved = _dnssec_rdatasets(zone)
+    try:
+        sign_zone(zone, keys, stats=stats, **kwargs)
+    except:
+        exc = sys.exc_info()
+        _restore_dnssec_rdatasets(zone, saved)
+        raise exc[0], exc[1], exc[2]
+    job.checkpoint(stats.signatures, stats.total)
+    return stats
+
+
+def sign_zone_job(zone, keys, callback=None, chunk=1000, **kwargs):
+    """
+    Sign the zone in a background thread, see sign_zone for the arguments.
+    Return started Job, its progress is (signatures made, signatures total)
+    and its result is SigningStats. A cancelled (or failed) job leaves the
+    zone as it was before.
+    The zone must not be accessed until the job is done.
+
+    Signing with workers > 1 keeps the calling thread responsive the most,
+    as RSA operations then don't compete for the interpreter lock.
+    """
+    return Job(_sign_zone_job, (zone, keys, chunk, kwargs), callback).start()
+
+
+def _validate_job(job, rrsets, keys, origin, now, chunk):
+    if not isinstance(keys, KeyStore):
+        keys = KeyStore(keys)
+    results = []
+    for i, (rrset, rrsigset) in enumerate(rrsets):
+        if i % chunk == 0:
+            job.checkpoint(i, len(rrsets))
+        try:
+            validate(rrset, rrsigset, keys, origin, now)
+            results.append(None)
+        except ValidationFailure as e:
+            results.append(e)
+    job.checkpoint(len(rrsets), len(rrsets))
+    return results
+
+
+def validate_job(rrsets, keys, origin=None, now=None, callback=None,
+                 chunk=256):
+    """
+    Validate list of (rrset, rrsigset) pairs (see validate) in a background
+    thread. Return started Job, its progress is (validated, total) and its
+    result is a list with None for each valid RR set and ValidationFailure
+    for each invalid one.
+    """
+    return Job(_validate_job, (list(rrsets), keys, origin, now, chunk),
+               callback).start()
+
+
+def _generate_job(job, flags, algorithm, bits):
+    job.checkpoint(0, 1)
+    key = PrivateDNSKEY.generate(flags, algorithm, bits)
+    job.checkpoint(1, 1)
+    return key
+
+
+def generate_job(flags, algorithm, bits=None, callback=None):
+    """
+    Generate a key (see PrivateDNSKEY.generate) in a background thread.
+    Return started Job, its result is PrivateDNSKEY.
+    """
+    return Job(_generate_job, (flags, algorithm, bits), callback).start()
+
+
+# Signing service protocol: every message is a frame prefixed by its length
+# (32 bits). Requests start with a command character ('K' - list keys, 'S' -
+# sign), replies with 'O' (success) or 'E' (error message follows).
+
+# Largest frame accepted from the peer
+_MAX_FRAME = 1 << 26
+
+def _send_frame(sock, data):
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError()
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+def _recv_frame(sock):
+    size, = struct.unpack('!I', _recv_exact(sock, 4))
+    if size > _MAX_FRAME:
+        raise SignerError('frame too large (%d bytes)' % size)
+    return _recv_exact(sock, size)
+
+
+class _FrameReader(object):
+    """
+    Sequential reader of a received frame
+    """
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, fmt):
+        size = struct.calcsize(fmt)
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += size
+        return values
+
+    def read(self, size):
+        if self.offset + size > len(self.data):
+            raise struct.error('frame too short')
+        data = self.data[self.offset:self.offset+size]
+        self.offset += size
+        return data
+
+
+class _SigningHandler(SocketServer.BaseRequestHandler):
+    """
+    Serve requests of one client connection until it's closed
+    """
+    def handle(self):
+        while True:
+            try:
+                request = _recv_frame(self.request)
+            except (EOFError, SignerError):
+                return
+            try:
+                reply = 'O' + self.server.dispatch(request)
+            except (dns.exception.DNSException, struct.error,
+                    IndexError) as e:
+                reply = 'E' + (str(e) or e.__class__.__name__)
+            _send_frame(self.request, reply)
+
+
+class SigningServer(SocketServer.ThreadingMixIn,
+                    SocketServer.UnixStreamServer):
+    """
+    Signing service listening on a Unix domain socket. Private keys are
+    parsed once and kept in memory, clients (SignerClient) send batches of
+    canonical RR set images with RRSIG headers and get signatures back. If
+    workers > 1, batches are signed by a pool of processes started once.
+
+    The socket is accessible by the owner only. A socket left at the path
+    is replaced, ValueError is raised if there's another kind of file. Call
+    serve_forever() to serve requests, shutdown() and server_close() to stop
+    the service.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, keys, workers=None):
+        # A stale socket of a previous server is replaced, nothing else
+        try:
+            mode = os.lstat(path).st_mode
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise ValueError('%s exists and is not a socket' % path)
+            os.unlink(path)
+        self.keys = list(keys)
+        self._index = dict(((key.algorithm, key.key), i)
+                           for i, key in enumerate(self.keys))
+        self._lock = threading.Lock()
+        self._pool = None
+        if workers and workers > 1:
+            self._pool = multiprocessing.Pool(workers, _sign_worker_init,
+                                              (self.keys,))
+        else:
+            for key in self.keys:
+                key.signing_context()
+        SocketServer.UnixStreamServer.__init__(self, path, _SigningHandler)
+
+    def server_bind(self):
+        SocketServer.UnixStreamServer.server_bind(self)
+        # Connections are refused until the socket listens
+        os.chmod(self.server_address, 0600)
+
+    def dispatch(self, request):
+        """
+        Process a request frame and return reply data
+        """
+        reader = _FrameReader(request, 1)
+        if request[:1] == 'K':
+            out = [struct.pack('!H', len(self.keys))]
+            for key in self.keys:
+                out.append(struct.pack('!HBH', key.flags, key.algorithm,
+                                       len(key.key)))
+                out.append(key.key)
+            return ''.join(out)
+        if request[:1] != 'S':
+            raise SignerError('unknown command')
+
+        indexes = []
+        for i in xrange(reader.unpack('!H')[0]):
+            algorithm, size = reader.unpack('!BH')
+            index = self._index.get((algorithm, reader.read(size)))
+            if index is None:
+                raise SignerError('unknown key')
+            indexes.append(index)
+        tasks = []
+        for i in xrange(reader.unpack('!I')[0]):
+            image = reader.read(reader.unpack('!I')[0])
+            headers = []
+            for j in xrange(reader.unpack('!H')[0]):
+                index, size = reader.unpack('!HH')
+                headers.append((indexes[index], reader.read(size)))
+            tasks.append((image, headers))
+
+        if self._pool is not None:
+            results = self._pool.map(_sign_worker, tasks)
+        else:
+            # Native key objects are shared by the connection threads
+            with self._lock:
+                results = [[_sign(header + image, self.keys[index])
+                            for index, header in headers]
+                           for image, headers in tasks]
+        out = []
+        for signatures in results:
+            for signature in signatures:
+                out.append(struct.pack('!H', len(signature)))
+                out.append(signature)
+        return ''.join(out)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+class SignerClient(object):
+    """
+    Client of SigningServer, usable as signer argument of sign_zone,
+    resign_zone, update_zone and sign_rrset. Signing requests are sent in
+    batches of the given number of RR sets over a single connection.
+    """
+    def __init__(self, path, batch=1000):
+        self.path = path
+        self.batch = batch
+        self._sock = None
+
+    def _call(self, request):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(self.path)
+        try:
+            _send_frame(self._sock, request)
+            reply = _recv_frame(self._sock)
+        except (socket.error, EOFError, SignerError) as e:
+            self.close()
+            raise SignerError('signer connection failed: %s' % e)
+        if reply[:1] != 'O':
+            raise SignerError(reply[1:])
+        return _FrameReader(reply, 1)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def keys(self):
+        """
+        Get keys held by the signer, as PrivateDNSKEY without private part
+        """
+        reader = self._call('K')
+        keys = []
+        for i in xrange(reader.unpack('!H')[0]):
+            flags, algorithm, size = reader.unpack('!HBH')
+            keys.append(PrivateDNSKEY(flags, algorithm, reader.read(size)))
+        return keys
+
+    def sign(self, keys, tasks):
+        """
+        Sign (RR set image, [(key index, RRSIG header), ...]) tasks, key
+        indexes referring to the given keys. Yield list of signatures for
+        each task.
+        """
+        prefix = [struct.pack('!H', len(keys))]
+        for key in keys:
+            prefix.append(struct.pack('!BH', key.algorithm, len(key.key)))
+            prefix.append(key.key)
+        prefix = 'S' + ''.join(prefix)
+
+        tasks = iter(tasks)
+        while True:
+            batch = list(itertools.islice(tasks, self.batch))
+            if not batch:
+                break
+            out = [prefix, struct.pack('!I', len(batch))]
+            for image, headers in batch:
+                out.append(struct.pack('!I', len(image)))
+                out.append(image)
+                out.append(struct.pack('!H', len(headers)))
+                for index, header in headers:
+                    out.append(struct.pack('!HH', index, len(header)))
+                    out.append(header)
+            reader = self._call(''.join(out))
+            for image, headers in batch:
+                yield [reader.read(reader.unpack('!H')[0]) for h in headers]
+
+
+class _ExternalSorter(object):
+    """
+    Sort records (tuples) which may not fit into memory: sorted runs of at
+    most size records are written to temporary files and merged on reading.
+    """
+    def __init__(self, size, tmpdir=None):
+        self.size = size
+        self.tmpdir = tmpdir
+        self._buffer = []
+        self._runs = []
+
+    def add(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.size:
+            self._flush()
+
+    def _flush(self):
+        self._buffer.sort()
+        fd = tempfile.TemporaryFile(dir=self.tmpdir)
+        for record in self._buffer:
+            cPickle.dump(record, fd, cPickle.HIGHEST_PROTOCOL)
+        fd.seek(0)
+        self._runs.append(fd)
+        self._buffer = []
+
+    @staticmethod
+    def _read(fd):
+        while True:
+            try:
+                yield cPickle.load(fd)
+            except EOFError:
+                return
+
+    def __iter__(self):
+        if not self._runs:
+            self._buffer.sort()
+            return iter(self._buffer)
+        if self._buffer:
+            self._flush()
+        return heapq.merge(*[self._read(fd) for fd in self._runs])
+
+    def close(self):
+        for fd in self._runs:
+            fd.close()
+        self._runs = []
+        self._buffer = []
+
+
+def _rr_header(tok, ttl, rdclass):
+    """
+    Parse optional TTL and class (in any order) and the type of a master
+    file record. Return (TTL, type), the given TTL if there's none.
+    """
+    seen = set()
+    while True:
+        token = tok.get()
+        if not token.is_identifier():
+            raise dns.exception.SyntaxError()
+        if 'ttl' not in seen:
+            try:
+                ttl = dns.ttl.from_text(token.value)
+                seen.add('ttl')
+                continue
+            except dns.ttl.BadTTL:
+                pass
+        if 'class' not in seen:
+            try:
+                if dns.rdataclass.from_text(token.value) != rdclass:
+                    raise dns.exception.SyntaxError("RR class is not zone's "
+                                                    "class")
+                seen.add('class')
+                continue
+            except dns.rdataclass.UnknownRdataclass:
+                pass
+        try:
+            return ttl, dns.rdatatype.from_text(token.value)
+        except dns.rdatatype.UnknownRdatatype:
+            raise dns.exception.SyntaxError("unknown rdatatype '%s'" %
+                                            token.value)
+
+
+def _rdata_from_text(rdclass, rdtype, tok, origin):
+    try:
+        return dns.rdata.from_text(rdclass, rdtype, tok, origin, False)
+    except dns.exception.SyntaxError:
+        raise
+    except Exception, e:
+        # Errors in RDATA are reported with the position in the file
+        raise dns.exception.SyntaxError('%s: %s' % (e.__class__.__name__, e))
+
+
+# ${offset,width,base} modifier of $GENERATE
+_GENERATE_MODIFIER = re.compile(r'\$(?:\{([+-]?\d+)(?:,(\d+)(?:,([doxX]))?)?\})?')
+
+def _generate_text(template, i):
+    def replace(match):
+        offset, width, base = match.groups()
+        return ('%%0%d%s' % (int(width or 0), base or 'd')) % \
+               (i + int(offset or 0))
+    return _GENERATE_MODIFIER.sub(replace, template)
+
+
+def _master_records(infile, origin, rdclass):
+    """
+    Parse master file one record at a time, the same way as
+    dns.zone.from_file does ($ORIGIN, $TTL, $INCLUDE and $GENERATE
+    directives are supported). Yield (owner, TTL, rdata) of records at or
+    below origin, names are absolute.
+    """
+    tok = dns.tokenizer.Tokenizer(infile, getattr(infile, 'name', '<file>'))
+    current = last = origin
+    ttl = 0
+    # Parser state of the files including the current one
+    included = []
+    files = []
+    try:
+        while True:
+            token = tok.get(True, True)
+            if token.is_eof():
+                if not included:
+                    break
+                files.pop().close()
+                tok, current, last, ttl = included.pop()
+                continue
+            if token.is_eol():
+                continue
+            if token.is_comment():
+                tok.get_eol()
+                continue
+
+            directive = token.value.upper()
+            if directive == '$TTL':
+                token = tok.get()
+                if not token.is_identifier():
+                    raise dns.exception.SyntaxError('bad $TTL')
+                ttl = dns.ttl.from_text(token.value)
+                tok.get_eol()
+            elif directive == '$ORIGIN':
+                current = tok.get_name()
+                tok.get_eol()
+            elif directive == '$INCLUDE':
+                filename = tok.get_string()
+                token = tok.get()
+                new = current
+                if token.is_identifier():
+                    new = dns.name.from_text(token.value, current)
+                    tok.get_eol()
+                elif not token.is_eol_or_eof():
+                    raise dns.exception.SyntaxError('bad origin in $INCLUDE')
+                files.append(open(filename, 'r'))
+                included.append((tok, current, last, ttl))
+                tok = dns.tokenizer.Tokenizer(files[-1], filename)
+                current = new
+            elif directive == '$GENERATE':
+                try:
+                    start, stop, step = dns.grange.from_text(tok.get_string())
+                except dns.exception.SyntaxError:
+                    raise
+                except Exception:
+                    raise dns.exception.SyntaxError('bad $GENERATE range')
+                lhs = tok.get_string()
+                rttl, rdtype = _rr_header(tok, ttl, rdclass)
+                rhs = tok.get_string()
+                tok.get_eol()
+                for i in xrange(start, stop + 1, step):
+                    last = dns.name.from_text(_generate_text(lhs, i), current)
+                    if last.is_subdomain(origin):
+                        yield last, rttl, _rdata_from_text(rdclass, rdtype,
+                                                _generate_text(rhs, i), current)
+            elif directive.startswith('$'):
+                raise dns.exception.SyntaxError(
+                    "Unknown master file directive '%s'" % directive)
+            else:
+                # Owner of the previous record is used if it's left out
+                tok.unget(token)
+                token = tok.get(want_leading=True)
+                if not token.is_whitespace():
+                    last = dns.name.from_text(token.value, current)
+                else:
+                    token = tok.get()
+                    tok.unget(token)
+                    if token.is_eol_or_eof():
+                        continue
+                if not last.is_subdomain(origin):
+                    while not tok.get().is_eol_or_eof():
+                        pass
+                    continue
+                rttl, rdtype = _rr_header(tok, ttl, rdclass)
+                yield last, rttl, _rdata_from_text(rdclass, rdtype, tok,
+                                                   current)
+    except dns.exception.SyntaxError, e:
+        filename, line = tok.where()
+        raise dns.exception.SyntaxError('%s:%d: %s' % (filename, line,
+                                        str(e) or 'syntax error'))
+    finally:
+        for fd in files:
+            fd.close()
+
+
+def _rdata_wire(rdata):
+    """
+    Get uncompressed wire format of RDATA with absolute names
+    """
+    f = cStringIO.StringIO()
+    rdata.to_wire(f, None, None)
+    return f.getvalue()
+
+
+def _read_sorted(infile, origin, rdclass, sorter):
+    """
+    Parse master file and pass its records, except of DNSSEC records, to the
+    sorter as (canonical key, owner, type, TTL, RDATA) tuples
+    """
+    skip = (dns.rdatatype.RRSIG, dns.rdatatype.NSEC, dns.rdatatype.NSEC3,
+            dns.rdatatype.NSEC3PARAM)
+    for name, ttl, rdata in _master_records(infile, origin, rdclass):
+        if rdata.rdtype in skip:
+            continue
+        sorter.add((_canonical_key(name), name.to_wire(), rdata.rdtype, ttl,
+                    _rdata_wire(rdata)))
+
+
+def _sorted_nodes(records, rdclass):
+    """
+    Group sorted records to nodes. Yield (name, node) in canonical order.
+    """
+    for key, group in itertools.groupby(records, lambda r: r[0]):
+        node = dns.node.Node()
+        name = None
+        for key, owner, rdtype, ttl, wire in group:
+            if name is None:
+                name = dns.name.from_wire(owner, 0)[0]
+            rdata = dns.rdata.from_wire(rdclass, rdtype, wire, 0, len(wire))
+            node.find_rdataset(rdclass, rdtype, create=True).add(rdata, ttl)
+        yield name, node
+
+
+class _StreamWriter(object):
+    """
+    Collect nodes of the signed zone and RR sets to be signed; sign them in
+    batches and write the nodes to the output when a batch is full.
+    """
+    def __init__(self, outfile, keys, origin, expiration, inception, batch,
+                 workers, signer, jitter, sigcache, stats, pool):
+        self.outfile = outfile
+        self.keys = keys
+        self.origin = origin
+        self.expiration = expiration
+        self.inception = inception
+        self.batch = batch
+        self.workers = workers
+        self.signer = signer
+        self.jitter = jitter
+        self.sigcache = sigcache
+        self.stats = stats
+        self.pool = pool
+        self._nodes = []
+        self._rrsets = []
+
+    def add(self, name, node, rrsets):
+        """
+        Add node and list of its (rdataset, signing keys) to be signed
+        """
+        self._nodes.append((name, node))
+        for rdataset, signers in rrsets:
+            self._rrsets.append((name, rdataset, signers))
+        if len(self._rrsets) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        nodes = dict(self._nodes)
+        for rrname, rdataset, rrsig in _sign_rrsets(self._rrsets, self.keys,
+                        self.origin, self.expiration, self.inception,
+                        self.workers, self.signer, self.jitter, self.sigcache,
+                        pool=self.pool):
+            rrsig_set = nodes[rrname].find_rdataset(rdataset.rdclass,
+                        dns.rdatatype.RRSIG, rdataset.rdtype, create=True)
+            rrsig_set.add(rrsig, ttl=rdataset.ttl)
+            if self.stats is not None:
+                self.stats.signed(rrsig)
+        for name, node in self._nodes:
+            self.outfile.write(node.to_text(name) + '\n')
+        self._nodes = []
+        self._rrsets = []
+
+
+def sign_zone_file(infile, outfile, origin, keys, expiration=None,
+                   inception=None, nsec3=False, keyttl=3600, nsec3salt=None,
+                   nsec3iters=None, workers=None, optout=False, batch=10000,
+                   tmpdir=None, rdclass=dns.rdataclass.IN, stats=None,
+                   signer=None, jitter=0, sigcache=None):
+    """
+    Sign zone in master file format without loading it to memory. Records
+    are parsed incrementally and sorted in canonical order using temporary
+    files in tmpdir, then NSEC records are added, RR sets are signed and the
+    signed zone is written to outfile in batches of the given number of RR
+    sets. NSEC3 records are sorted by hash in another external sort and
+    written at the end. Memory usage depends on the batch size, not on the
+    zone size.
+
+    The infile and outfile are file names or file objects. DNSSEC records
+    present in the input are dropped. Other arguments are the same as for
+    sign_zone; NSEC3 salt is generated if not given, NSEC3Collision is
+    raised in the (extremely unlikely) case of a hash collision.
+    """
+    if isinstance(origin, basestring):
+        origin = dns.name.from_text(origin)
+    zsk = _zone_signing_keys(keys)
+    if expiration is None:
+        expiration = time.time() + (3600 * 24 * 90) # 90 days from now
+    if inception is None:
+        inception = time.time() - (3600 * 24) # 1 day ago
+    if nsec3salt is None:
+        nsec3salt = os.urandom(8)
+    if nsec3iters is None:
+        nsec3iters = 10
+
+    opened = []
+    if isinstance(infile, basestring):
+        infile = open(infile, 'r')
+        opened.append(infile)
+    if isinstance(outfile, basestring):
+        outfile = open(outfile, 'w')
+        opened.append(outfile)
+
+    records = _ExternalSorter(batch, tmpdir)
+    hashes = _ExternalSorter(batch, tmpdir)
+    pool = None
+    try:
+        with _phase(stats, 'parse'):
+            _read_sorted(infile, origin, rdclass, records)
+        # One pool of workers signs all the batches
+        if signer is None and workers and workers > 1:
+            pool = _sign_pool(keys, workers)
+        writer = _StreamWriter(outfile, keys, origin, expiration, inception,
+                               batch, workers, signer, jitter, sigcache, stats,
+                               pool)
+        with _phase(stats, 'sign'):
+            count, ttl = _stream_sign(_sorted_nodes(records, rdclass), writer,
+                                      origin, rdclass, keys, zsk, keyttl,
+                                      nsec3, nsec3salt, nsec3iters, optout,
+                                      hashes)
+            writer.flush()
+        records.close()
+        if stats is not None:
+            stats.nsec += count
+        if nsec3:
+            with _phase(stats, 'nsec3'):
+                count = _stream_nsec3(hashes, writer, origin, rdclass, zsk,
+                                      ttl, nsec3salt, nsec3iters, optout)
+                writer.flush()
+            if stats is not None:
+                stats.nsec3 += count
+        outfile.flush()
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        records.close()
+        hashes.close()
+        for fd in opened:
+            fd.close()
+
+
+def _stream_sign(nodes, writer, origin, rdclass, keys, zsk, keyttl, nsec3,
+                 salt, iterations, optout, hashes):
+    """
+    Process nodes of the zone in canonical order: determine status of each
+    name, add NSEC records or collect (hash, types) of NSEC3 chain members
+    in hashes, and pass nodes with RR sets to be signed to the writer.
+    Return number of NSEC records and TTL of NSEC/NSEC3 records.
+    """
+    bitmaps = {}
+    def bitmap(types):
+        types = tuple(sorted(types))
+        if types not in bitmaps:
+            bitmaps[types] = _rdtypes_to_bitmaps(list(types))
+        return bitmaps[types]
+
+    def add_hash(name, types):
+        hashes.add((_nsec3_hash_wire(name.to_digestable(), salt, iterations),
+                    tuple(sorted(types))))
+
+    ttl = None
+    cut = None
+    previous = None
+    ents = []
+    pending = []
+    first = None
+    count = 0
+    for name, node in nodes:
+        if ttl is None:
+            # The first node in canonical order is the apex
+            soa = node.get_rdataset(rdclass, dns.rdatatype.SOA)
+            if name != origin or soa is None:
+                raise dns.zone.NoSOA
+            ttl = soa[0].minimum
+            dnskey_set = node.find_rdataset(rdclass, dns.rdatatype.DNSKEY,
+                                            create=True)
+            for key in keys:
+                dnskey_set.add(key.get_pubkey(), ttl=keyttl)
+            if nsec3:
+                node.find_rdataset(rdclass, dns.rdatatype.NSEC3PARAM,
+                                   create=True).add(
+                    dns.rdtypes.ANY.NSEC3PARAM.NSEC3PARAM(rdclass,
+                        dns.rdatatype.NSEC3PARAM, NSEC3_ALG_SHA1,
+                        NSEC3_FLAG_NONE, iterations, salt), ttl=ttl)
+
+        if cut is not None and name.is_subdomain(cut):
+            status = _GLUE
+        elif name != origin and \
+             node.get_rdataset(rdclass, dns.rdatatype.NS) is not None:
+            status = _DELEGATION
+            cut = name
+        else:
+            status = _AUTHORITATIVE
+            cut = None
+        present = [rdataset.rdtype for rdataset in node]
+
+        if nsec3 and status != _GLUE:
+            # Empty non-terminals: ancestors not seen with the previous name
+            while ents and not name.is_subdomain(ents[-1][0]):
+                ents.pop()
+            new = []
+            parent = name.parent()
+            while name != origin and parent != origin and \
+                  not previous.is_subdomain(parent):
+                new.append([parent, False])
+                parent = parent.parent()
+            ents.extend(reversed(new))
+            member = status == _AUTHORITATIVE or not optout or \
+                     dns.rdatatype.DS in present
+            if member:
+                # With opt-out, only empty non-terminals having members
+                # below them are included
+                for ent in ents:
+                    if not ent[1]:
+                        ent[1] = True
+                        add_hash(ent[0], ())
+                add_hash(name, _nsec3_types(status, present))
+        previous = name
+
+        # Delegations and respective glue records MUST NOT be signed
+        # (RFC-4035, section 2.2.), DNSKEY is signed by all the keys
+        rrsets = []
+        if status != _GLUE:
+            for rdataset in node:
+                if status == _DELEGATION and \
+                   rdataset.rdtype not in _DELEGATION_TYPES:
+                    continue
+                if rdataset.rdtype != dns.rdatatype.DNSKEY:
+                    rrsets.append((rdataset, zsk))
+                elif name == origin:
+                    rrsets.append((rdataset, keys))
+
+        if nsec3:
+            writer.add(name, node, rrsets)
+            continue
+
+        # NSEC of the previous member is completed when the next one is known
+        if status != _GLUE:
+            if pending:
+                _stream_nsec(writer, pending, name, bitmap, rdclass, ttl, zsk)
+                count += 1
+            else:
+                first = name
+            pending = []
+        pending.append((name, node, rrsets, status, present))
+
+    if ttl is None:
+        raise dns.zone.NoSOA
+    if pending:
+        _stream_nsec(writer, pending, first, bitmap, rdclass, ttl, zsk)
+        count += 1
+    return count, ttl
+
+
+def _stream_nsec(writer, pending, nextname, bitmap, rdclass, ttl, zsk):
+    """
+    Add NSEC record pointing to the given next name to the first of pending
+    nodes (the chain member, followed by glue nodes) and pass them to writer
+    """
+    name, node, rrsets, status, present = pending[0]
+    rdataset = node.find_rdataset(rdclass, dns.rdatatype.NSEC, create=True)
+    rdataset.add(dns.rdtypes.ANY.NSEC.NSEC(rdclass, dns.rdatatype.NSEC,
+                 nextname, bitmap(_nsec_types(status, present))), ttl=ttl)
+    rrsets.append((rdataset, zsk))
+    for name, node, rrsets, status, present in pending:
+        writer.add(name, node, rrsets)
+
+
+def _stream_nsec3(hashes, writer, origin, rdclass, zsk, ttl, salt, iterations,
+                  optout):
+    """
+    Create NSEC3 records of the (hash, types) tuples sorted by hash and pass
+    them to the writer. Return number of NSEC3 records.
+    """
+    flags = optout and NSEC3_FLAG_OPTOUT or NSEC3_FLAG_NONE
+    bitmaps = {}
+    count = 0
+    records = iter(hashes)
+    first = previous = next(records, None)
+    if first is None:
+        return 0
+    for record in itertools.chain(records, [None]):
+        if record is not None and record[0] == previous[0]:
+            raise NSEC3Collision()
+        hashed, types = previous
+        nexthash = (record or first)[0]
+        if types not in bitmaps:
+            bitmaps[types] = _rdtypes_to_bitmaps(list(types))
+        owner = _nsec3_owner(hashed, origin)
+        node = dns.node.Node()
+        rdataset = node.find_rdataset(rdclass, dns.rdatatype.NSEC3,
+                                      create=True)
+        rdataset.add(dns.rdtypes.ANY.NSEC3.NSEC3(rdclass, dns.rdatatype.NSEC3,
+                     NSEC3_ALG_SHA1, flags, iterations, salt, nexthash,
+                     bitmaps[types]), ttl=ttl)
+        writer.add(owner, node, [(rdataset, zsk)])
+        count += 1
+        previous = record
+    return count
@@ -5,7 +5,12 @@ Distutils setup script for PyDNSSEC module
 """
 
 import sys
-from distutils.core import setup
+try:
+    from setuptools import setup
+    have_setuptools = True
+except ImportError:
+    from distutils.core import setup
+    have_setuptools = False
 
 version = '0.1'
 
@@ -17,8 +22,9 @@ kwargs = {
 PyDNSSEC is a DNSSEC toolkit for Python. It's based on dnspython's dnssec
 module. It supports resource record signing and verification, generating RSA
 keypairs for signing, manipulation with NSEC/NSEC3 authenticated denial of
-existence. Currently, DNSKEY algorithms RSASHA1, RSASHA1NSEC3SHA1, RSASHA256
-and RSASHA512 are supported.
+existence. Currently, DNSKEY algorithms RSASHA1, RSASHA1NSEC3SHA1, RSASHA256,
+RSASHA512, ECDSAP256SHA256, ECDSAP384SHA384, ED25519 and ED448 are supported
+(ECDSA and EdDSA require the cryptography package).
     """,
     'author' : 'Tomas Mazak',
     'author_email' : 'tomas@valec.net',
@@ -28,4 +34,8 @@ and RSASHA512 are supported.
     'requires': ['dns', 'Crypto']
 }
 
+if have_setuptools:
+    # ECDSA, EdDSA and the OpenSSL signing backend
+    kwargs['extras_require'] = {'cryptography': ['cryptography']}
+
 setup(**kwargs)
@@ -17,12 +17,28 @@
 
 """PyDNSSEC unit tests"""
 
+import copy
+import os
+import pickle
+import shutil
+import socket
+import stat
+import StringIO
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
 import unittest
 import Crypto.Util.number
+import dns.exception
 import dns.name
+import dns.node
 import dns.rdata
 import dns.rdataclass
 import dns.rdatatype
+import dns.rdataset
 import dns.rrset
 import dns.zone
 
@@ -103,6 +119,53 @@ example_ds_sha1 = dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.DS,
 
 example_ds_sha256 = dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.DS,
                                         '18673 3 2 eb8344cbbf07c9d3d3d6c81d10c76653e28d8611a65e639ef8f716e4e4e5d913')
+
+# ECDSA examples from RFC-6605, section 6
+abs_example_net = dns.name.from_text('example.net.')
+
+ecdsa_p256_keys = { abs_example_net :
+                    dns.rrset.from_text('example.net.', 3600, 'IN', 'DNSKEY',
+                                        '257 3 13 GojIhhXUN/u4v54ZQqGSnyhWJwaubCvTmeexv7bR6edb krSqQpF64cYbcB7wNcP+e+MAnLr+Wi9xMWyQLc8NAA==')
+                  }
+
+ecdsa_p256_private = 'GU6SnQ/Ou+xC5RumuIUIuJZteXT2z0O/ok1s38Et6mQ='
+
+ecdsa_p384_keys = { abs_example_net :
+                    dns.rrset.from_text('example.net.', 3600, 'IN', 'DNSKEY',
+                                        '257 3 14 xKYaNhWdGOfJ+nPrL8/arkwf2EY3MDJ+SErKivBVSum1 w/egsXvSADtNJhyem5RCOpgQ6K8X1DRSEkrbYQ+OB+v8 /uX45NBwY8rp65F6Glur8I/mlVNgF6W/qTI37m40')
+                  }
+
+ecdsa_a = dns.rrset.from_text('www.example.net.', 3600, 'IN', 'A',
+                              '192.0.2.1')
+
+ecdsa_other_a = dns.rrset.from_text('www.example.net.', 3600, 'IN', 'A',
+                                    '192.0.2.2')
+
+ecdsa_p256_rrsig = dns.rrset.from_text('www.example.net.', 3600, 'IN', 'RRSIG',
+                                       'A 13 3 3600 20100909100439 20100812100439 55648 example.net. qx6wLYqmh+l9oCKTN6qIc+bw6ya+KJ8oMz0YP107epXA yGmt+3SNruPFKG7tZoLBLlUzGGus7ZwmwWep666VCw==')
+
+ecdsa_p384_rrsig = dns.rrset.from_text('www.example.net.', 3600, 'IN', 'RRSIG',
+                                       'A 14 3 3600 20100909102025 20100812102025 10771 example.net. /L5hDKIvGDyI1fcARX3z65qrmPsVz73QD1Mr5CEqOiLP 95hxQouuroGCeZOvzFaxsT8Glr74hbavRKayJNuydCuz WTSSPdz7wnqXL5bdcJzusdnI0RSMROxxwGipWcJm')
+
+when3 = 1283000000
+
+# Ed25519 example from RFC-8080, section 6
+abs_example_com = dns.name.from_text('example.com.')
+
+ed25519_keys = { abs_example_com :
+                 dns.rrset.from_text('example.com.', 3600, 'IN', 'DNSKEY',
+                                     '257 3 15 l02Woi0iS8Aa25FQkUd9RMzZHJpBoRQwAQEX1SxZJA4=')
+               }
+
+ed25519_private = 'ODIyNjAzODQ2MjgwODAxMjI2NDUxOTAyMDQxNDIyNjI='
+
+ed25519_mx = dns.rrset.from_text('example.com.', 3600, 'IN', 'MX',
+                                 '10 mail.example.com.')
+
+ed25519_rrsig = dns.rrset.from_text('example.com.', 3600, 'IN', 'RRSIG',
+                                    'MX 15 2 3600 20150819220000 20150729220000 3613 example.com. oL9krJun7xfBOIWcGHi7mag5/hdZrKWw15jPGrHpjQeRAvTdszaPD+QLs3fx8A4M3e23mRZ9VrbpMngwcrqNAg==')
+
+when4 = 1439000000
 # }}}
 
 class DNSSECValidatorTestCase(unittest.TestCase): # {{{
@@ -129,6 +192,54 @@ class DNSSECValidatorTestCase(unittest.TestCase): # {{{
                                 abs_dnspython_org, when)
         self.failUnlessRaises(dnssec.ValidationFailure, bad)
 
+    def testKeyStore(self):
+        store = dnssec.KeyStore(abs_keys_duplicate_keytag)
+        self.assertEqual(len(store), 3)
+        store.add(abs_example, abs_dsa_keys[abs_example])
+        dnssec.validate(abs_soa, abs_soa_rrsig, store, None, when)
+        dnssec.validate(abs_dsa_soa, abs_dsa_soa_rrsig, store, None, when2)
+        def bad():
+            dnssec.validate(abs_other_soa, abs_soa_rrsig, store, None, when)
+        self.failUnlessRaises(dnssec.ValidationFailure, bad)
+        def unknown():
+            dnssec.validate(abs_soa, abs_soa_rrsig, dnssec.KeyStore(),
+                            None, when)
+        self.failUnlessRaises(dnssec.ValidationFailure, unknown)
+
+    def testNodeKeys(self):
+        node = dns.node.Node()
+        rrset = abs_keys[abs_dnspython_org]
+        node.replace_rdataset(dns.rdataset.from_rdata_list(rrset.ttl, rrset))
+        dnssec.validate(abs_soa, abs_soa_rrsig, {abs_dnspython_org: node},
+                        None, when)
+
+    @unittest.skipUnless(dnssec._have_cryptography, 'requires cryptography')
+    def testECDSAP256Good(self):
+        dnssec.validate(ecdsa_a, ecdsa_p256_rrsig, ecdsa_p256_keys, None, when3)
+
+    @unittest.skipUnless(dnssec._have_cryptography, 'requires cryptography')
+    def testECDSAP384Good(self):
+        dnssec.validate(ecdsa_a, ecdsa_p384_rrsig, ecdsa_p384_keys, None, when3)
+
+    @unittest.skipUnless(dnssec._have_cryptography, 'requires cryptography')
+    def testECDSABad(self):
+        def bad():
+            dnssec.validate(ecdsa_other_a, ecdsa_p256_rrsig, ecdsa_p256_keys,
+                            None, when3)
+        self.failUnlessRaises(dnssec.ValidationFailure, bad)
+
+    @unittest.skipUnless(dnssec._have_eddsa, 'requires cryptography')
+    def testED25519Good(self):
+        dnssec.validate(ed25519_mx, ed25519_rrsig, ed25519_keys, None, when4)
+
+    @unittest.skipUnless(dnssec._have_eddsa, 'requires cryptography')
+    def testED25519Bad(self):
+        other_mx = dns.rrset.from_text('example.com.', 3600, 'IN', 'MX',
+                                       '20 mail.example.com.')
+        def bad():
+            dnssec.validate(other_mx, ed25519_rrsig, ed25519_keys, None, when4)
+        self.failUnlessRaises(dnssec.ValidationFailure, bad)
+
     def testMakeSHA256DS(self):
         ds = dnssec.make_ds(abs_dnspython_org, sep_key, 'SHA256')
         self.failUnless(ds == good_ds)
@@ -609,6 +720,29 @@ class DNSSECSignerTestCase(unittest.TestCase):
                 for rdataset in zone2.nodes[name]:
                     print rdataset.to_text(name)
 
+    def _zsk_pair(self):
+        """
+        Two RSASHA256 zone signing keys, the second one generated once
+        """
+        cls = DNSSECSignerTestCase
+        if not hasattr(cls, '_zsk'):
+            cls._zsk = dnssec.PrivateDNSKEY.generate(
+                dnssec.DNSKEY_FLAG_ZONEKEY, dnssec.RSASHA256, 1024)
+        return [dnssec.PrivateDNSKEY(dnssec.DNSKEY_FLAG_ZONEKEY,
+                                     dnssec.RSASHA256, rsa_pub, rsa_priv),
+                cls._zsk]
+
+    def _rrsig_sets(self, zone):
+        """
+        Get {(name, covered type): number of RRSIG rdatasets}
+        """
+        counts = {}
+        for name, rdataset in zone.iterate_rdatasets():
+            if rdataset.rdtype == dns.rdatatype.RRSIG:
+                key = (name, rdataset.covers)
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
     def setUp(self):
         self.expiration = 1398843106
         self.inception  = 1366443141
@@ -673,6 +807,912 @@ class DNSSECSignerTestCase(unittest.TestCase):
         self._diff(zone, signedzone)
         self.assertEqual(zone, signedzone)
 
+    def testNSEC3HashCache(self):
+        salt = '05D67BB3FE7BF907'.decode('hex')
+        cache = dnssec.NSEC3HashCache()
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha256_ksk], self.expiration,
+                         self.inception, nsec3=True, keyttl=3600,
+                         nsec3salt=salt, nsec3iters=10, workers=2,
+                         nsec3cache=cache)
+        signedzone = dns.zone.from_text(zone_rsasha256_txt,
+                                        relativize=False)
+        self._nsec3fix(signedzone)
+        self.assertEqual(zone, signedzone)
+        self.assertEqual(len(cache), 19)
+
+        self.assertRaises(ValueError, cache.save)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'nsec3cache')
+            cache.save(filename)
+            self.assertEqual(os.listdir(tmpdir), ['nsec3cache'])
+            loaded = dnssec.NSEC3HashCache(filename)
+            fd = open(filename, 'wb')
+            fd.write(pickle.dumps({}))
+            fd.close()
+            self.assertRaises(ValueError, dnssec.NSEC3HashCache, filename)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(len(loaded), 19)
+        origin = dns.name.from_text('example.com.')
+        wire = origin.to_digestable()
+        self.assertEqual(loaded.get(wire, salt, 10),
+                         dnssec._nsec3_hash(origin, None, salt, 10))
+        self.assertEqual(loaded.get(wire, salt, 11), None)
+
+        # Hashes not used by the last run are dropped
+        loaded.prune()
+        self.assertEqual(len(loaded), 1)
+
+    def testNSEC3OptOut(self):
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha256_ksk], self.expiration,
+                         self.inception, nsec3=True, optout=True,
+                         nsec3salt='05D67BB3FE7BF907'.decode('hex'),
+                         nsec3iters=10)
+        nsec3 = [rdataset[0] for name, rdataset
+                 in zone.iterate_rdatasets(dns.rdatatype.NSEC3)]
+        # Both delegations are insecure
+        self.assertEqual(len(nsec3), 17)
+        for rdata in nsec3:
+            self.assertEqual(rdata.flags, dnssec.NSEC3_FLAG_OPTOUT)
+        param = zone.get_rdataset(zone.origin, dns.rdatatype.NSEC3PARAM)
+        self.assertEqual(param[0].flags, dnssec.NSEC3_FLAG_NONE)
+
+        # Secure delegation joins the chain
+        ds = dns.rrset.from_text('delegated.example.com.', 3200, 'IN', 'DS',
+                    '12345 5 1 71b71d4f3e11bbd71b4eff12cde69f7f9215bbe7')
+        dnssec.update_zone(zone, [self.rsasha256_ksk], [ds], [],
+                           self.expiration, self.inception)
+        nsec3 = [rdataset[0] for name, rdataset
+                 in zone.iterate_rdatasets(dns.rdatatype.NSEC3)]
+        self.assertEqual(len(nsec3), 18)
+        for rdata in nsec3:
+            self.assertEqual(rdata.flags, dnssec.NSEC3_FLAG_OPTOUT)
+
+    def testVerifyZone(self):
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha256_ksk], self.expiration,
+                         self.inception, nsec3=True,
+                         nsec3salt='05D67BB3FE7BF907'.decode('hex'),
+                         nsec3iters=10)
+        report = dnssec.verify_zone(zone, self.inception + 60)
+        self.failUnless(report.valid(), report.to_text())
+        self.assertEqual(report.signatures, 40)
+
+        www = dns.name.from_text('www.example.com.')
+        rdataset = zone.find_rdataset(www, dns.rdatatype.A)
+        rdataset.add(dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.A,
+                                         '10.9.9.9'))
+        zone.delete_rdataset('a.example.com.', dns.rdatatype.RRSIG,
+                             dns.rdatatype.A)
+        report = dnssec.verify_zone(zone, self.inception + 60, workers=2)
+        self.assertEqual(report.errors, [
+            (dns.name.from_text('a.example.com.'), dns.rdatatype.A,
+             'missing signature'),
+            (www, dns.rdatatype.A, 'invalid signature by key %d' %
+                                   self.rsasha256_ksk.key_tag()),
+            (www, dns.rdatatype.A, 'no valid signature by algorithm RSASHA256'),
+            ])
+
+    def testVerifyZoneMultipleKeys(self):
+        keys = [self.rsasha256_ksk] + self._zsk_pair()
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, keys, self.expiration, self.inception)
+        report = dnssec.verify_zone(zone, self.inception + 60)
+        self.failUnless(report.valid(), report.to_text())
+        self.assertEqual(report.signatures, 73)
+
+        # Signatures in a second RRSIG rdataset are verified as well
+        www = dns.name.from_text('www.example.com.')
+        node = zone.find_node(www)
+        rrsigs = node.find_rdataset(dns.rdataclass.IN, dns.rdatatype.RRSIG,
+                                    dns.rdatatype.A)
+        rrsig = rrsigs[1]
+        rrsigs.remove(rrsig)
+        split = dns.rdataset.Rdataset(dns.rdataclass.IN, dns.rdatatype.RRSIG,
+                                      dns.rdatatype.A)
+        rrsig = copy.copy(rrsig)
+        rrsig.signature = rrsig.signature[::-1]
+        split.add(rrsig, ttl=rrsigs.ttl)
+        node.rdatasets.append(split)
+        report = dnssec.verify_zone(zone, self.inception + 60)
+        self.assertEqual(report.signatures, 73)
+        self.assertEqual(report.errors, [
+            (www, dns.rdatatype.A, 'invalid signature by key %d' %
+                                   rrsig.key_tag),
+            (www, dns.rdatatype.A, 'signatures split in 2 RRSIG RR sets'),
+            ])
+
+    def testVerifyZoneIndependent(self):
+        # A mistake in the signed data built by the signer must be found,
+        # also while it's in effect
+        image = dnssec._rrset_image
+        dnssec._rrset_image = lambda rrname, rdataset, ttl, origin: \
+            image(rrname, rdataset, ttl + 1, origin)
+        try:
+            zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+            dnssec.sign_zone(zone, [self.rsasha1], self.expiration,
+                             self.inception)
+            report = dnssec.verify_zone(zone, self.inception + 60)
+        finally:
+            dnssec._rrset_image = image
+        self.assertEqual(report.signatures, 36)
+        self.assertEqual(len(report.errors), 72)
+
+    @unittest.skipUnless(dnssec._have_cryptography, 'requires cryptography')
+    def testECDSAGenerate(self):
+        for algorithm, bits in ((dnssec.ECDSAP256SHA256, 256),
+                                (dnssec.ECDSAP384SHA384, 384)):
+            ksk = dnssec.PrivateDNSKEY.generate(257, algorithm)
+            zsk = dnssec.PrivateDNSKEY.generate(256, algorithm)
+            self.assertEqual(zsk.bits(), bits)
+            self.assertEqual(len(zsk.key), bits // 4)
+            zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+            dnssec.sign_zone(zone, [ksk, zsk], self.expiration,
+                             self.inception, workers=2)
+            report = dnssec.verify_zone(zone, self.inception + 60)
+            self.failUnless(report.valid(), report.to_text())
+            rrsig = zone.find_rdataset(zone.origin, dns.rdatatype.RRSIG,
+                                       dns.rdatatype.SOA)[0]
+            self.assertEqual(len(rrsig.signature), bits // 4)
+
+    @unittest.skipUnless(dnssec._have_cryptography, 'requires cryptography')
+    def testECDSAToFile(self):
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        d = Crypto.Util.number.bytes_to_long(ecdsa_p256_private.decode('base64'))
+        private = ec.derive_private_key(d, ec.SECP256R1(), default_backend())
+        pem = private.private_bytes(serialization.Encoding.PEM,
+                                    serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+        dnskey = ecdsa_p256_keys[abs_example_net][0]
+        key = dnssec.PrivateDNSKEY(257, dnssec.ECDSAP256SHA256, dnskey.key, pem)
+        self.assertEqual(key.key_tag(), 55648)
+        rrsig = dnssec.sign_rrset(ecdsa_a, key, abs_example_net,
+                                  1284026679, 1281607479)
+        dnssec.validate_rrsig(ecdsa_a, rrsig, ecdsa_p256_keys, None, when3)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'ecdsa.private')
+            key.to_file('example.net.', file=filename)
+            content = open(filename).read()
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(content, 'Private-key-format: v1.2\n'
+                                  'Algorithm: 13 (ECDSAP256SHA256)\n'
+                                  'PrivateKey: %s\n' % ecdsa_p256_private)
+
+    @unittest.skipUnless(dnssec._have_eddsa, 'requires cryptography')
+    def testED25519Sign(self):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+        private = ed25519.Ed25519PrivateKey.from_private_bytes(
+                        ed25519_private.decode('base64'))
+        pem = private.private_bytes(serialization.Encoding.PEM,
+                                    serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+        dnskey = ed25519_keys[abs_example_com][0]
+        key = dnssec.PrivateDNSKEY(257, dnssec.ED25519, dnskey.key, pem)
+        self.assertEqual(key.key_tag(), 3613)
+        self.assertEqual(key.bits(), 256)
+        # EdDSA signatures are deterministic
+        rrsig = dnssec.sign_rrset(ed25519_mx, key, abs_example_com,
+                                  1440021600, 1438207200)
+        self.assertEqual(rrsig, ed25519_rrsig[0])
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'ed25519.private')
+            key.to_file('example.com.', file=filename)
+            content = open(filename).read()
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(content, 'Private-key-format: v1.2\n'
+                                  'Algorithm: 15 (ED25519)\n'
+                                  'PrivateKey: %s\n' % ed25519_private)
+
+    @unittest.skipUnless(dnssec._have_eddsa, 'requires cryptography')
+    def testED448Generate(self):
+        key = dnssec.PrivateDNSKEY.generate(257, dnssec.ED448)
+        self.assertEqual(len(key.key), 57)
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [key], self.expiration, self.inception,
+                         nsec3=True, workers=2)
+        report = dnssec.verify_zone(zone, self.inception + 60)
+        self.failUnless(report.valid(), report.to_text())
+
+    def testBackends(self):
+        self.assertEqual(dnssec.get_backend(), 'pycrypto')
+        self.failUnlessRaises(ValueError, dnssec.set_backend, 'nonexistent')
+        soa = dns.rrset.from_text('example.com.', 3600, 'IN', 'SOA',
+                        'cns1.example.com. hostmaster.example.com. 1 2 3 4 5')
+        origin = dns.name.from_text('example.com.')
+        try:
+            for name in dnssec.backends():
+                dnssec.set_backend(name)
+                self.assertEqual(dnssec.get_backend(), name)
+                zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+                dnssec.sign_zone(zone, [self.rsasha256_ksk], self.expiration,
+                                 self.inception, nsec3=True, keyttl=3600,
+                                 nsec3salt='05D67BB3FE7BF907'.decode('hex'),
+                                 nsec3iters=10)
+                signedzone = dns.zone.from_text(zone_rsasha256_txt,
+                                                relativize=False)
+                self._nsec3fix(signedzone)
+                self.assertEqual(zone, signedzone)
+
+                key = dnssec.PrivateDNSKEY.generate(257, dnssec.RSASHA256,
+                                                    1024)
+                rrsig = dnssec.sign_rrset(soa, key, origin, self.expiration,
+                                          self.inception)
+                for other in dnssec.backends():
+                    dnssec.set_backend(other)
+                    dnssec.validate_rrsig(soa, rrsig,
+                                          {origin: [key.get_pubkey()]},
+                                          None, self.inception + 60)
+
+            # Keys used before follow the backend selection
+            if 'openssl' in dnssec.backends():
+                dnssec.set_backend('pycrypto')
+                context = self.rsasha1.signing_context()
+                dnssec.set_backend('openssl')
+                self.failIf(self.rsasha1.signing_context() is context)
+                self.assertEqual(
+                    dnssec._backend_for(dnssec.ECDSAP256SHA256).name,
+                    'openssl')
+        finally:
+            dnssec.set_backend('pycrypto')
+
+    def testSignRRsetMulti(self):
+        soa = dns.rrset.from_text('example.com.', 3600, 'IN', 'SOA',
+                        'cns1.example.com. hostmaster.example.com. 1 2 3 4 5')
+        origin = dns.name.from_text('example.com.')
+        keys = [self.rsasha1, self.rsasha256_ksk, self.rsasha512_ksk]
+        rrsigs = dnssec.sign_rrset_multi(soa, keys, origin, self.expiration,
+                                         self.inception)
+        self.assertEqual(rrsigs, [dnssec.sign_rrset(soa, key, origin,
+                                  self.expiration, self.inception)
+                                  for key in keys])
+
+        # RRs are ordered by canonical wire format of RDATA, not by name
+        ns = dns.rrset.from_text('example.com.', 3600, 'IN', 'NS',
+                                 'ab.example.org.', 'b.example.org.')
+        image = dnssec._rrset_image(ns.name, ns, 3600, None)
+        self.failUnless(image.index('\x01b\x07example') <
+                        image.index('\x02ab\x07example'))
+
+    def testSigningStats(self):
+        finished = []
+        stats = dnssec.SigningStats(lambda *args: finished.append(args[0]))
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha1], self.expiration, self.inception,
+                         nsec3=True, nsec3salt='\x05\xd6\x7b\xb3\xfe\x7b\xf9\x07',
+                         nsec3iters=10, stats=stats)
+        self.assertEqual(finished, ['view', 'hash', 'nsec3', 'collect', 'sign'])
+        self.assertEqual([p[0] for p in stats.phases], finished)
+        rrsigs = sum(len(rdataset) for node in zone.nodes.values()
+                     for rdataset in node
+                     if rdataset.rdtype == dns.rdatatype.RRSIG)
+        self.assertEqual(stats.signatures, rrsigs)
+        self.assertEqual(stats.rrsets, {self.rsasha1.key_tag(): rrsigs})
+        self.assertEqual(stats.nsec3, 19)
+        self.assertEqual(stats.nsec, 0)
+        self.failUnless(stats.wall() >= stats.wall('sign') > 0)
+        self.assertEqual(stats.to_dict()['signatures'], rrsigs)
+
+        stats = dnssec.SigningStats()
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        index = dnssec.add_nsec(zone, stats=stats)
+        self.assertEqual([p[0] for p in stats.phases], ['view', 'nsec'])
+        self.assertEqual(stats.nsec, len(index))
+
+    def testJobs(self):
+        finished = []
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        job = dnssec.sign_zone_job(zone, [self.rsasha1], finished.append,
+                                   expiration=self.expiration,
+                                   inception=self.inception, chunk=5)
+        stats = job.result(60)
+        self.assertEqual(finished, [job])
+        self.assertEqual(job.progress, (stats.signatures, stats.total))
+        signedzone = dns.zone.from_text(zone_rsasha1_txt, relativize=False)
+        self.assertEqual(zone, signedzone)
+
+        # Cancelled signing leaves the zone as it was, also a signed one
+        # and its empty nodes
+        empty = dns.name.from_text('empty.example.com.')
+        for text, nsec3 in ((zone_orig_txt, True), (zone_rsasha1_txt, False)):
+            zone = dns.zone.from_text(text, relativize=False)
+            zone.nodes[empty] = dns.node.Node()
+            job = dnssec.Job(dnssec._sign_zone_job,
+                             (zone, [self.rsasha256_ksk], 5,
+                              {'nsec3': nsec3}))
+            job.cancel()
+            job.start()
+            self.assertRaises(dnssec.JobCancelled, job.result, 60)
+            self.failUnless(job.cancelled())
+            self.failUnless(empty in zone.nodes)
+            del zone.nodes[empty]
+            self.assertEqual(zone, dns.zone.from_text(text,
+                                                      relativize=False))
+
+        # Errors are re-raised with the traceback of the job
+        def fail(job):
+            raise ValueError('failed')
+        job = dnssec.Job(fail).start()
+        try:
+            job.result(60)
+        except ValueError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+            self.assertEqual(frames[-1][2], 'fail')
+        else:
+            self.fail('error not raised')
+
+        soa = signedzone.find_rrset(signedzone.origin, dns.rdatatype.SOA)
+        rrsig = signedzone.find_rrset(signedzone.origin, dns.rdatatype.RRSIG,
+                                      dns.rdatatype.SOA)
+        keys = {signedzone.origin: [self.rsasha1.get_pubkey()]}
+        forged = dns.rrset.from_text(soa.name, soa.ttl, 'IN', 'SOA',
+                    'ns1.example.com. hostmaster.example.com. 2 2 3 4 5')
+        job = dnssec.validate_job([(soa, rrsig), (forged, rrsig)], keys, None,
+                                  self.inception + 60)
+        results = job.result(60)
+        self.assertEqual(results[0], None)
+        self.failUnless(isinstance(results[1], dnssec.ValidationFailure))
+        self.assertEqual(job.progress, (2, 2))
+
+    def testSigningServer(self):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'signer.sock')
+        # Only a stale socket is replaced
+        open(path, 'w').close()
+        self.assertRaises(ValueError, dnssec.SigningServer, path,
+                          [self.rsasha1])
+        self.failUnless(os.path.isfile(path))
+        os.remove(path)
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        umask = os.umask(0)
+        os.umask(umask)
+        server = dnssec.SigningServer(path, [self.rsasha1])
+        self.assertEqual(os.umask(umask), umask)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0600)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        client = dnssec.SignerClient(path, batch=4)
+        try:
+            # Oversized frames close the connection
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+            sock.sendall(struct.pack('!I', dnssec._MAX_FRAME + 1))
+            self.assertEqual(sock.recv(1), '')
+            sock.close()
+
+            keys = client.keys()
+            self.assertEqual(keys, [self.rsasha1.get_pubkey()])
+            self.assertEqual(keys[0].privkey, None)
+
+            zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+            dnssec.sign_zone(zone, keys, self.expiration, self.inception,
+                             signer=client)
+            signedzone = dns.zone.from_text(zone_rsasha1_txt,
+                                            relativize=False)
+            self.assertEqual(zone, signedzone)
+
+            soa = signedzone.find_rrset(signedzone.origin, dns.rdatatype.SOA)
+            self.assertRaises(dnssec.SignerError, dnssec.sign_rrset, soa,
+                              self.rsasha256_ksk, signedzone.origin,
+                              self.expiration, self.inception, client)
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            self.failIf(os.path.exists(path))
+            shutil.rmtree(tmpdir)
+
+    def testKeyPool(self):
+        tmpdir = tempfile.mkdtemp()
+        directory = os.path.join(tmpdir, 'keypool')
+        pool = dnssec.KeyPool(directory, [(dnssec.RSASHA256, 1024)], size=2)
+        try:
+            self.assertEqual(stat.S_IMODE(os.stat(directory).st_mode), 0700)
+            pool.fill(wait=True)
+            self.assertEqual(pool.available(dnssec.RSASHA256, 1024), 2)
+            for name in os.listdir(pool._path(dnssec.RSASHA256, 1024)):
+                mode = os.stat(os.path.join(pool._path(dnssec.RSASHA256,
+                                                       1024), name)).st_mode
+                self.assertEqual(stat.S_IMODE(mode), 0600)
+
+            key = dnssec.PrivateDNSKEY.generate(257, dnssec.RSASHA256, 1024,
+                                                pool=pool)
+            self.assertEqual(key.flags, 257)
+            self.assertEqual(key.bits(), 1024)
+            pool.wait()
+            self.assertEqual(pool.available(dnssec.RSASHA256, 1024), 2)
+            self.assertEqual(pool.errors, [])
+
+            soa = dns.rrset.from_text('example.com.', 3600, 'IN', 'SOA',
+                        'cns1.example.com. hostmaster.example.com. 1 2 3 4 5')
+            origin = dns.name.from_text('example.com.')
+            rrsig = dnssec.sign_rrset(soa, key, origin, self.expiration,
+                                      self.inception)
+            dnssec.validate_rrsig(soa, rrsig, {origin: [key.get_pubkey()]},
+                                  None, self.inception + 60)
+
+            # Profiles not maintained by the pool are generated directly
+            self.assertEqual(pool.take(dnssec.RSASHA256, 2048), None)
+
+            # Key files are not unpickled
+            path = pool._path(dnssec.RSASHA256, 1024)
+            for name in os.listdir(path):
+                os.unlink(os.path.join(path, name))
+            fd = open(os.path.join(path, 'bad.key'), 'w')
+            fd.write(pickle.dumps(('private', 'public')))
+            fd.close()
+            self.assertRaises(ValueError, pool.take, dnssec.RSASHA256, 1024)
+            pool.wait()
+
+            # A generation lost with its worker doesn't block forever
+            pool.timeout = 0
+            pool._pending[-1] = (dnssec.RSASHA256, 1024)
+            self.failUnless(pool.wait(5))
+            self.assertEqual(len(pool.errors), 1)
+        finally:
+            pool.close()
+            shutil.rmtree(tmpdir)
+
+        # Directories accessible by others are refused
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.chmod(tmpdir, 0755)
+            self.assertRaises(ValueError, dnssec.KeyPool, tmpdir,
+                              [(dnssec.RSASHA256, 1024)])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testRSASHA1Parallel(self):
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha1], self.expiration, self.inception, 
+                         nsec3=False, keyttl=3600, workers=2)
+        signedzone = dns.zone.from_text(zone_rsasha1_txt, relativize=False)
+        self._diff(zone, signedzone)
+        self.assertEqual(zone, signedzone)
+
+    def testMultipleKeys(self):
+        keys = [self.rsasha256_ksk] + self._zsk_pair()
+        for workers in (None, 2):
+            zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+            dnssec.sign_zone(zone, keys, self.expiration, self.inception,
+                             workers=workers)
+            counts = self._rrsig_sets(zone)
+            self.assertEqual(len(counts), 36)
+            self.assertEqual(set(counts.values()), set([1]))
+            for name, rdataset in zone.iterate_rdatasets():
+                if rdataset.rdtype != dns.rdatatype.RRSIG:
+                    continue
+                if rdataset.covers == dns.rdatatype.DNSKEY:
+                    self.assertEqual(len(rdataset), 3)
+                else:
+                    self.assertEqual(len(rdataset), 2)
+
+    def testSigningContextPickle(self):
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        rrset = (zone.origin, zone.find_rdataset(zone.origin, 'SOA'))
+        expected = dnssec.sign_rrset(rrset, self.rsasha1, zone.origin,
+                                     self.expiration, self.inception)
+        self.failUnless(self.rsasha1._context is not None)
+        key = pickle.loads(pickle.dumps(self.rsasha1, 2))
+        self.failUnless(key._context is None)
+        self.assertEqual(key, self.rsasha1)
+        rrsig = dnssec.sign_rrset(rrset, key, zone.origin, self.expiration,
+                                  self.inception)
+        self.assertEqual(rrsig, expected)
+
+    def testResignZone(self):
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha1], self.expiration, self.inception)
+        signedzone = dns.zone.from_text(zone_rsasha1_txt, relativize=False)
+
+        # Nothing to refresh
+        count = dnssec.resign_zone(zone, [self.rsasha1], self.expiration,
+                                   self.expiration + 3600, self.inception)
+        self.assertEqual(count, 0)
+        self.assertEqual(zone, signedzone)
+
+        # All signatures are refreshed
+        count = dnssec.resign_zone(zone, [self.rsasha1], self.expiration + 1,
+                                   self.expiration + 3600, self.inception)
+        self.assertEqual(count, 36)
+        self.failIf(dnssec.sigs_expire_before(zone, self.expiration + 3600))
+
+    def testResignZoneMultipleKeys(self):
+        keys = [self.rsasha256_ksk] + self._zsk_pair()
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, keys, self.expiration, self.inception)
+        signedzone = dns.zone.from_text(zone.to_text(relativize=False),
+                                        zone.origin, relativize=False)
+
+        # Nothing to refresh, also when run again
+        for i in range(2):
+            count = dnssec.resign_zone(zone, keys, self.inception + 60,
+                                       self.expiration, self.inception)
+            self.assertEqual(count, 0)
+            self.assertEqual(zone, signedzone)
+
+        # RR sets without signatures are signed
+        www = dns.name.from_text('www.example.com.')
+        zone.delete_rdataset(www, dns.rdatatype.RRSIG, dns.rdatatype.A)
+        count = dnssec.resign_zone(zone, keys, self.inception + 60,
+                                   self.expiration, self.inception)
+        self.assertEqual(count, 2)
+        self.assertEqual(zone, signedzone)
+
+        # Signatures split in more RRSIG rdatasets are merged
+        node = zone.find_node(www)
+        rrsigs = node.find_rdataset(dns.rdataclass.IN, dns.rdatatype.RRSIG,
+                                    dns.rdatatype.A)
+        rrsig = rrsigs[1]
+        rrsigs.remove(rrsig)
+        split = dns.rdataset.Rdataset(dns.rdataclass.IN, dns.rdatatype.RRSIG,
+                                      dns.rdatatype.A)
+        split.add(rrsig, ttl=rrsigs.ttl)
+        node.rdatasets.append(split)
+        count = dnssec.resign_zone(zone, keys, self.inception + 60,
+                                   self.expiration, self.inception)
+        self.assertEqual(count, 0)
+        self.assertEqual(zone, signedzone)
+        self.assertEqual(set(self._rrsig_sets(zone).values()), set([1]))
+
+    def testResignZoneRetiredKey(self):
+        # The retired key stays published unless asked otherwise
+        zone = dns.zone.from_text(zone_rsasha1_txt, relativize=False)
+        dnssec.resign_zone(zone, [self.rsasha256_ksk], 0, self.expiration,
+                           self.inception)
+        dnskeys = zone.get_rdataset(zone.origin, dns.rdatatype.DNSKEY)
+        self.assertEqual(len(dnskeys), 2)
+        self.failUnless(self.rsasha1.get_pubkey() in dnskeys)
+
+        zone = dns.zone.from_text(zone_rsasha1_txt, relativize=False)
+        count = dnssec.resign_zone(zone, [self.rsasha256_ksk], 0,
+                                   self.expiration, self.inception,
+                                   unpublish=True)
+        self.assertEqual(count, 36)
+        tag = self.rsasha256_ksk.key_tag()
+        for name, rdataset in zone.iterate_rdatasets(dns.rdatatype.RRSIG):
+            for rrsig in rdataset:
+                self.assertEqual((rrsig.algorithm, rrsig.key_tag),
+                                 (dnssec.RSASHA256, tag))
+        # The new key replaces the retired one
+        dnskeys = zone.get_rdataset(zone.origin, dns.rdatatype.DNSKEY)
+        self.assertEqual(list(dnskeys), [self.rsasha256_ksk.get_pubkey()])
+        self.assertEqual(dnskeys.ttl, 3600)
+        self.failUnless(dnssec.verify_zone(zone, self.inception + 60).valid())
+
+    def testExpiryIndex(self):
+        day = 3600 * 24
+        expiry = dnssec.ExpiryIndex()
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha1], self.expiration,
+                         self.inception, expiry=expiry)
+        self.assertEqual(len(expiry), 36)
+        self.assertEqual(expiry._current,
+                         dnssec.ExpiryIndex.from_zone(zone)._current)
+        self.assertEqual(expiry.earliest(), self.expiration)
+        self.assertEqual(len(expiry.due(self.expiration + 1)), 36)
+        self.assertEqual(expiry.due(self.expiration), [])
+
+        # Refreshed signatures replace the original ones
+        count = dnssec.resign_zone(zone, [self.rsasha1], self.expiration + 1,
+                                   self.expiration + 5 * day, self.inception,
+                                   expiry=expiry)
+        self.assertEqual(count, 36)
+        self.assertEqual(len(expiry), 36)
+        self.assertEqual(expiry.earliest(), self.expiration + 5 * day)
+        now = self.expiration + 3 * day
+        self.assertEqual(expiry.histogram(3, now), [0, 0, 36])
+        self.assertEqual(expiry.histogram(2, now), [0, 0])
+
+        # Changes made by update_zone are applied
+        new = dns.rrset.from_text('new.example.com.', 3200, 'IN', 'A',
+                                  '10.1.2.4')
+        dnssec.update_zone(zone, [self.rsasha1], [new], [],
+                           self.expiration + 10 * day, self.inception,
+                           expiry=expiry)
+        self.assertEqual(expiry._current,
+                         dnssec.ExpiryIndex.from_zone(zone)._current)
+        due = expiry.due(self.expiration + 6 * day)
+        www = dns.name.from_text('www.example.com.')
+        self.failUnless((www, dns.rdatatype.A) in due)
+        self.failUnless((new.name, dns.rdatatype.A) not in due)
+
+    def testExpirationJitter(self):
+        day = 3600 * 24
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha1], self.expiration,
+                         self.inception, jitter=10 * day)
+        expirations = [rrsig.expiration for node in zone.nodes.values()
+                       for rdataset in node
+                       if rdataset.rdtype == dns.rdatatype.RRSIG
+                       for rrsig in rdataset]
+        self.failUnless(len(set(expirations)) > 30)
+        self.failUnless(min(expirations) >= self.expiration - 10 * day)
+        self.failUnless(max(expirations) <= self.expiration)
+        self.failUnless(dnssec.verify_zone(zone, self.inception + 60).valid())
+
+        # The same RR set gets the same offset again
+        other = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(other, [self.rsasha1], self.expiration,
+                         self.inception, jitter=10 * day, workers=2)
+        self.assertEqual(zone, other)
+
+        # Budget of 5 RR sets refreshes the 5 earliest expiring ones
+        expiry = dnssec.ExpiryIndex.from_zone(zone)
+        earliest = expiry.first(6)
+        plan = dnssec.plan_refresh(expiry, 5, 0, now=self.inception)
+        self.assertEqual(plan, set(earliest[:5]))
+        count = dnssec.resign_zone(zone, [self.rsasha1], 0,
+                                   self.expiration + 30 * day,
+                                   self.inception, expiry=expiry, rrsets=plan)
+        self.assertEqual(count, 5)
+        self.assertEqual(expiry.first(1), earliest[5:])
+
+        # RR sets close to expiration are refreshed over budget
+        plan = dnssec.plan_refresh(expiry, 5, 10 * day,
+                                   now=self.expiration - day)
+        self.assertEqual(len(plan), 31)
+
+    def testSignatureCache(self):
+        day = 3600 * 24
+        now = int(time.time())
+        cache = dnssec.SignatureCache(refresh=30 * day)
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha1], now + 90 * day, now - day,
+                         sigcache=cache)
+        self.assertEqual(len(cache), 36)
+        self.assertRaises(ValueError, cache.save)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'sigcache')
+            cache.save(filename)
+            self.assertEqual(os.listdir(tmpdir), ['sigcache'])
+            cache = dnssec.SignatureCache(filename, refresh=30 * day)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(len(cache), 36)
+
+        # Signatures of unchanged RR sets are reused with their validity
+        for workers in (None, 2):
+            other = dns.zone.from_text(zone_orig_txt, relativize=False)
+            dnssec.sign_zone(other, [self.rsasha1], now + 100 * day, now,
+                             workers=workers, sigcache=cache)
+            self.assertEqual(other, zone)
+
+        # Changed RR set is signed again
+        other = dns.zone.from_text(zone_orig_txt, relativize=False)
+        www = dns.name.from_text('www.example.com.')
+        other.find_rdataset(www, dns.rdatatype.A).add(
+            dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.A,
+                                '10.1.2.6'))
+        dnssec.sign_zone(other, [self.rsasha1], now + 100 * day, now,
+                         sigcache=cache)
+        expirations = [rrsig.expiration for node in other.nodes.values()
+                       for rdataset in node
+                       if rdataset.rdtype == dns.rdatatype.RRSIG
+                       for rrsig in rdataset]
+        self.assertEqual(expirations.count(now + 100 * day), 1)
+        self.assertEqual(len(cache), 37)
+
+        # Signatures expiring within the refresh period are not reused
+        cache.refresh = 95 * day
+        rrsig = dnssec.sign_rrset(other.find_rrset(www, dns.rdatatype.A),
+                                  self.rsasha1, other.origin,
+                                  now + 100 * day, now, cache=cache)
+        self.assertEqual(rrsig.expiration, now + 100 * day)
+        cache.prune()
+        self.assertEqual(len(cache), 1)
+
+    def testResignZoneSignatureCache(self):
+        # Re-signing must not bring back the replaced signatures from cache
+        day = 3600 * 24
+        now = int(time.time())
+        cache = dnssec.SignatureCache(refresh=7 * day)
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha1], now + 20 * day, now - day,
+                         sigcache=cache)
+        count = dnssec.resign_zone(zone, [self.rsasha1], now + 30 * day,
+                                   now + 90 * day, now, sigcache=cache)
+        self.assertEqual(count, 36)
+        self.failIf(dnssec.sigs_expire_before(zone, now + 30 * day))
+
+        # Planned refresh moves expiration forward as well
+        expiry = dnssec.ExpiryIndex.from_zone(zone)
+        earliest = expiry.earliest()
+        plan = dnssec.plan_refresh(expiry, 5, 0, now=now)
+        dnssec.resign_zone(zone, [self.rsasha1], 0, now + 100 * day, now,
+                           expiry=expiry, rrsets=plan, sigcache=cache)
+        self.assertEqual(len(expiry.due(earliest + 1)), 31)
+
+    def _update(self, nsec3, add, delete, initial=()):
+        # Incrementally updated zone must be equal to the updated zone signed
+        # from scratch
+        salt = '05D67BB3FE7BF907'.decode('hex')
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        for rrset in initial:
+            zone.replace_rdataset(rrset.name,
+                dns.rdataset.from_rdata_list(rrset.ttl, list(rrset)))
+        dnssec.sign_zone(zone, [self.rsasha1nsec3sha1], self.expiration,
+                         self.inception, nsec3=nsec3, nsec3salt=salt,
+                         nsec3iters=10)
+        diff = dnssec.update_zone(zone, [self.rsasha1nsec3sha1], add, delete,
+                                  self.expiration, self.inception)
+
+        expected = dns.zone.from_text(zone_orig_txt, relativize=False)
+        for rrset in initial:
+            expected.replace_rdataset(rrset.name,
+                dns.rdataset.from_rdata_list(rrset.ttl, list(rrset)))
+        for rrset in delete:
+            expected.delete_rdataset(rrset.name, rrset.rdtype)
+        for rrset in add:
+            expected.replace_rdataset(rrset.name,
+                dns.rdataset.from_rdata_list(rrset.ttl, list(rrset)))
+        dnssec.sign_zone(expected, [self.rsasha1nsec3sha1], self.expiration,
+                         self.inception, nsec3=nsec3, nsec3salt=salt,
+                         nsec3iters=10)
+        self._diff(zone, expected)
+        self.assertEqual(zone, expected)
+        return diff
+
+    def testUpdateNSEC(self):
+        removed, added = self._update(False,
+            [dns.rrset.from_text('new.example.com.', 3200, 'IN', 'A',
+                                 '10.1.2.4')],
+            [dns.rrset.from_text('www.example.com.', 3200, 'IN', 'A',
+                                 '10.1.2.3', '10.1.2.4', '10.1.2.5')])
+        rdtypes = sorted((r.name.to_text(), r.rdtype, r.covers)
+                         for r in added)
+        self.assertEqual(rdtypes, sorted([
+            ('delegation2.example.com.', dns.rdatatype.NSEC,
+             dns.rdatatype.NONE),
+            ('delegation2.example.com.', dns.rdatatype.RRSIG,
+             dns.rdatatype.NSEC),
+            ('new.example.com.', dns.rdatatype.A, dns.rdatatype.NONE),
+            ('new.example.com.', dns.rdatatype.NSEC, dns.rdatatype.NONE),
+            ('new.example.com.', dns.rdatatype.RRSIG, dns.rdatatype.A),
+            ('new.example.com.', dns.rdatatype.RRSIG, dns.rdatatype.NSEC),
+            ('uppercase.example.com.', dns.rdatatype.NSEC, dns.rdatatype.NONE),
+            ('uppercase.example.com.', dns.rdatatype.RRSIG,
+             dns.rdatatype.NSEC)]))
+        self.assertEqual(len(removed), 8)
+
+    def testUpdateNSECDelegation(self):
+        self._update(False,
+            [dns.rrset.from_text('a.example.com.', 3200, 'IN', 'NS',
+                                 'ns.example.org.')], [])
+
+    def testUpdateOccludedDelegation(self):
+        below = dns.rrset.from_text('x.delegated.example.com.', 3200, 'IN',
+                                    'NS', 'ns.example.org.')
+        child = dns.rrset.from_text('x.www.example.com.', 3200, 'IN', 'NS',
+                                    'ns.example.org.')
+        parent = dns.rrset.from_text('www.example.com.', 3200, 'IN', 'NS',
+                                     'ns.example.org.')
+        for nsec3 in (False, True):
+            # NS added below an existing delegation
+            self._update(nsec3, [below], [])
+            # Existing delegation occluded by a new one above it
+            self._update(nsec3, [parent], [], [child])
+
+    def testUpdateNSEC3(self):
+        self._update(True,
+            [dns.rrset.from_text('x.y.new.example.com.', 3200, 'IN', 'A',
+                                 '10.1.2.4')],
+            [dns.rrset.from_text('empty.non.terminal.example.com.', 3200, 'IN',
+                                 'A', '10.1.2.4')])
+
+    def testUpdateNSEC3Delegation(self):
+        self._update(True, [],
+            [dns.rrset.from_text('delegation2.example.com.', 3200, 'IN', 'NS',
+                                 'ns1.delegation2.example.com.')])
+
+    def testUpdateWithIndex(self):
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        index = dnssec.add_nsec(zone)
+        self.assertEqual(len(index), 16)
+        zone = dns.zone.from_text(zone_rsasha1_txt, relativize=False)
+        index = dnssec.chain_index(zone)
+        names = dnssec.zone_names(zone)
+        self.assertEqual(len(index), 16)
+        new = dns.rrset.from_text('new.example.com.', 3200, 'IN', 'A',
+                                  '10.1.2.4')
+        dnssec.update_zone(zone, [self.rsasha1], [new], [], self.expiration,
+                           self.inception, index=index, names=names)
+        self.assertEqual(len(index), 17)
+        self.assertEqual(list(names), list(dnssec.zone_names(zone)))
+        dnssec.update_zone(zone, [self.rsasha1], [], [new], self.expiration,
+                           self.inception, index=index, names=names)
+        self.assertEqual(len(index), 16)
+        self.assertEqual(list(names), list(dnssec.zone_names(zone)))
+        signedzone = dns.zone.from_text(zone_rsasha1_txt, relativize=False)
+        self.assertEqual(zone, signedzone)
+
+    def testNameIndex(self):
+        names = [dns.name.from_text(n) for n in
+                 ('example.', 'a.example.', 'yljkjljk.a.example.',
+                  'Z.a.example.', 'zABC.a.EXAMPLE.', 'z.example.',
+                  '\\001.z.example.', '*.z.example.', '\\200.z.example.')]
+        # Example from RFC-4034, section 6.1
+        index = dnssec.NameIndex(reversed(names))
+        self.assertEqual(list(index), names)
+        self.assertEqual(dnssec._canonical_order(names), list(index))
+        self.failUnless(dns.name.from_text('z.A.example.') in index)
+        name = dns.name.from_text('b.example.')
+        self.failIf(name in index)
+        self.assertEqual(index.predecessor(name), names[4])
+        self.assertEqual(index.covering(name), names[4])
+        self.assertEqual(index.successor(name), names[5])
+        self.assertEqual(index.covering(names[5]), names[5])
+        self.assertEqual(index.successor(names[8]), names[0])
+        index.add(name)
+        self.assertEqual(index.predecessor(names[5]), name)
+        index.remove(name)
+        self.assertEqual(index.predecessor(names[5]), names[4])
+        self.assertEqual(list(index.descendants(names[1])), names[2:5])
+        self.assertEqual(list(index.descendants(names[4])), [])
+        self.assertEqual(list(index.descendants(names[0])), names[1:])
+
+    def testZoneViewLazy(self):
+        zone = dns.zone.from_text(zone_orig_txt)
+        name = lambda n: dns.name.from_text(n, zone.origin)
+        for view in (dnssec._ZoneView(zone), dnssec._ZoneView(zone, True)):
+            self.failUnless(view.is_delegation(name('delegation2')))
+            self.failIf(view.is_delegation(name('ns1.delegation2')))
+            self.failUnless(view.is_occluded(name('ns1.delegation2')))
+            self.failIf(view.is_occluded(name('delegation2')))
+            self.failIf(view.is_occluded(name('www')))
+            self.failUnless(view.is_authoritative(name('delegation2'),
+                                                  dns.rdatatype.DS))
+            self.failIf(view.is_authoritative(name('delegation2'),
+                                              dns.rdatatype.NS))
+            self.failIf(view.is_authoritative(name('ns1.delegation2'),
+                                              dns.rdatatype.A))
+            self.failUnless(view.is_authoritative(name('www'),
+                                                  dns.rdatatype.A))
+            self.failUnless(view.is_authoritative(name('nonexistent.www'),
+                                                  dns.rdatatype.A))
+            self.failIf(view.is_authoritative(
+                dns.name.from_text('example.org.'), dns.rdatatype.A))
+        self.assertEqual(view.nodes, {})
+        self.assertEqual(view.empty_non_terminals, [])
+
+    def testZoneView(self):
+        zone = dns.zone.from_text(zone_orig_txt)
+        # Empty non-terminal below a delegation is occluded
+        zone.find_rdataset('x.y.delegation2', dns.rdatatype.A, create=True)
+        view = dnssec._ZoneView(zone)
+        lazy = dnssec._ZoneView(zone, lazy=True)
+        name = lambda n: dns.name.from_text(n, zone.origin)
+        self.assertEqual(set(view.empty_non_terminals),
+                         set([name('_tcp'), name('non.terminal'),
+                              name('terminal')]))
+        self.assertEqual(len(view.nodes), len(zone.nodes))
+        for n, (node, status) in view.nodes.iteritems():
+            self.assertEqual(status, lazy.status(n))
+        self.assertEqual(view.nodes[name('delegated')][1], dnssec._DELEGATION)
+        self.assertEqual(view.nodes[name('x.y.delegation2')][1],
+                         dnssec._GLUE)
+        self.assertEqual(view.nodes[name('www')][1], dnssec._AUTHORITATIVE)
+        self.assertEqual(len(view.members()), 16)
+        # Bitmaps are shared by names with the same status and types
+        self.failUnless(view.nsec_bitmap(name('z')) is
+                        view.nsec_bitmap(name('www')))
+        self.assertEqual(view.nsec3_bitmap(name('non.terminal')), [])
+
     def test_unsign_zone(self):
         zone = dns.zone.from_text(zone_orig_txt, relativize=False)
         signedzone = dns.zone.from_text(zone_rsasha512_txt,                     
@@ -680,6 +1720,95 @@ class DNSSECSignerTestCase(unittest.TestCase):
         unsignedzone = dnssec.unsign_zone(signedzone)
         self.assertEqual(zone, unsignedzone)
 
+    def test_unsign_zone_nsec3(self):
+        zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+        dnssec.sign_zone(zone, [self.rsasha1], self.expiration,
+                         self.inception, nsec3=True)
+        # NSEC3 owner nodes are dropped, also from relativized zones
+        signedzone = dns.zone.from_text(zone.to_text(relativize=True),
+                                        zone.origin, relativize=True)
+        unsignedzone = dnssec.unsign_zone(signedzone)
+        self.assertEqual(unsignedzone, dns.zone.from_text(zone_orig_txt))
+
+    def test_sign_zone_file(self):
+        salt = '05D67BB3FE7BF907'.decode('hex')
+        zsk = dnssec.PrivateDNSKEY(dnssec.DNSKEY_FLAG_ZONEKEY,
+                                   dnssec.RSASHA256, rsa_pub, rsa_priv)
+        pair = [self.rsasha256_ksk, zsk]
+        for keys, nsec3, optout, workers in (
+                ([self.rsasha1], False, False, None),
+                ([self.rsasha1], True, False, None),
+                ([self.rsasha1], True, True, 2),
+                (pair, False, False, 2),
+                (pair, True, False, None)):
+            zone = dns.zone.from_text(zone_orig_txt, relativize=False)
+            dnssec.sign_zone(zone, keys, self.expiration, self.inception,
+                             nsec3=nsec3, nsec3salt=salt, nsec3iters=10,
+                             optout=optout)
+            out = StringIO.StringIO()
+            dnssec.sign_zone_file(StringIO.StringIO(zone_orig_txt), out,
+                                  zone.origin, keys, self.expiration,
+                                  self.inception, nsec3=nsec3,
+                                  nsec3salt=salt, nsec3iters=10,
+                                  optout=optout, batch=3, workers=workers)
+            signed = dns.zone.from_text(out.getvalue(), zone.origin,
+                                        relativize=False)
+            self.assertEqual(signed, zone)
+            report = dnssec.verify_zone(signed, now=self.inception)
+            self.failUnless(report.valid(), report.to_text())
+
+
+    def testMasterRecords(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            include = os.path.join(tmpdir, 'include.zone')
+            with open(include, 'w') as f:
+                f.write('host 600 A 10.0.0.1\n'
+                        '     AAAA ::1\n'
+                        '$ORIGIN deeper.example.com.\n'
+                        'x MX 10 mail\n')
+            text = ('$TTL 300\n'
+                    '@ IN SOA ns1 hostmaster ( 1 2 3 4\n'
+                    '                          5 ) ; comment\n'
+                    '  NS ns1\n'
+                    'ns1 3600 IN A 10.1.1.1\n'
+                    '    60 IN TXT "a b" ; comment\n'
+                    '$ORIGIN sub.example.com.\n'
+                    'www CNAME @\n'
+                    '$INCLUDE %s include\n'
+                    '$GENERATE 1-3 gen${5,3,d} A 10.2.0.$\n'
+                    'other.example.org. A 10.9.9.9\n'
+                    'back A 10.3.3.3\n' % include)
+            origin = dns.name.from_text('example.com.')
+            records = sorted((name, ttl, rdata) for name, ttl, rdata in
+                             dnssec._master_records(StringIO.StringIO(text),
+                                                    origin, dns.rdataclass.IN))
+            zone = dns.zone.from_text(text, origin, relativize=False,
+                                      allow_include=True)
+            self.assertEqual(records, sorted((name, rdataset.ttl, rdata)
+                for name, rdataset in zone.iterate_rdatasets()
+                for rdata in rdataset))
+            self.assertEqual(len(records), 12)
+
+            # Class may precede TTL, $GENERATE supports other bases
+            text = ('ns1 IN 60 A 10.1.1.1\n'
+                    '$GENERATE 10-11 g$ PTR ${0,2,x}\n')
+            records = [(name.to_text(), ttl, rdata.to_text()) for
+                       name, ttl, rdata in dnssec._master_records(
+                       StringIO.StringIO(text), origin, dns.rdataclass.IN)]
+            self.assertEqual(records, [
+                ('ns1.example.com.', 60, '10.1.1.1'),
+                ('g10.example.com.', 0, '0a.example.com.'),
+                ('g11.example.com.', 0, '0b.example.com.')])
+
+            bad = StringIO.StringIO('@ SOA ns1 hostmaster 1 2 3 4 5\n'
+                                    'www CH A 10.1.1.1\n')
+            self.assertRaises(dns.exception.SyntaxError, list,
+                              dnssec._master_records(bad, origin,
+                                                     dns.rdataclass.IN))
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main()